@@ -3,6 +3,7 @@
 from janggu.data.coverage import Cover  # noqa
 from janggu.data.coverage import plotGenomeTrack  # noqa
 from janggu.data.data import Dataset  # noqa
+from janggu.data.data import RandomReverseComplement  # noqa
 from janggu.data.dna import Bioseq  # noqa
 from janggu.data.genomic_indexer import GenomicIndexer  # noqa
 from janggu.data.genomicarray import GenomicArray  # noqa
@@ -34,12 +35,14 @@ def split_train_test(dataset, holdout_chroms):
     gind_test = gind.filter_by_region(include=holdout_chroms)
     if isinstance(dataset, Cover):
         traindata = Cover(dataset.name, dataset.garray, gind_train,
-                          dataset._channel_last)
+                          dataset._channel_last, dataset.batch_dtype)
         testdata = Cover(dataset.name, dataset.garray, gind_test,
-                         dataset._channel_last)
+                         dataset._channel_last, dataset.batch_dtype)
     elif isinstance(dataset, Bioseq):
         traindata = Bioseq(dataset.name, dataset.garray, gind_train,
-                           dataset._alphabetsize, dataset._channel_last)
+                           dataset._alphabetsize, dataset._channel_last,
+                           dataset.batch_dtype)
         testdata = Bioseq(dataset.name, dataset.garray, gind_test,
-                          dataset._alphabetsize, dataset._channel_last)
+                          dataset._alphabetsize, dataset._channel_last,
+                          dataset.batch_dtype)
     return traindata, testdata
@@ -1,6 +1,8 @@
 """Coverage dataset"""
 
 import os
+import pickle
+from multiprocessing import Pool
 
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import cm
@@ -9,6 +11,9 @@ from HTSeq import GenomicInterval
 
 from janggu.data.data import Dataset
 from janggu.data.genomic_indexer import GenomicIndexer
+from janggu.data.genomicarray import _collapse_mean
+from janggu.data.genomicarray import _collapse_sum
+from janggu.data.genomicarray import _get_iv_length
 from janggu.data.genomicarray import create_genomic_array
 from janggu.utils import _get_genomic_reader
 from janggu.utils import _iv_to_str
@@ -24,6 +29,129 @@ try:
 except ImportError:  # pragma: no cover
     pysam = None
 
+
+def _get_chunks(binsize, resolution):
+    """Window length in array coordinates to align the storage chunks to."""
+    if binsize is None or resolution is None:
+        return None
+    return max(1, binsize // resolution)
+
+
+def _get_read_positions(fields, min_mapq, pairedend):
+    """Determine the read positions to be counted from a chunk of alignments.
+
+    Parameters
+    ----------
+    fields : numpy.array
+        Integer array of shape (nreads, 8) with the columns
+        flag, reference_start, reference_end, mapq, template_length,
+        next_reference_start, query_length and whether the mate
+        maps to the same reference.
+    min_mapq : int
+        Minimum mapping quality.
+    pairedend : str
+        Paired-end mode 'midpoint' or '5prime'.
+
+    Returns
+    -------
+    tuple(numpy.array, numpy.array)
+        Positions and strands (0 for forward and 1 for reverse reads)
+        of the reads that are counted.
+    """
+    flag, rstart, rend, mapq, tlen, mstart, qlen, sameref = fields.T
+
+    # discard unmapped reads and reads with low mapping quality.
+    # only consider read1 so as not to double count
+    # fragments for paired end reads.
+    keep = (flag & 0x4 == 0) & (mapq >= min_mapq) & (flag & 0x80 == 0)
+
+    paired = flag & 0x1 != 0
+    reverse = flag & 0x10 != 0
+
+    # only consider paired end reads if both mates
+    # are properly mapped and they map to the
+    # same reference_name
+    keep &= ~paired | ((flag & 0x2 != 0) & (sameref != 0))
+
+    # single end reads are counted at the
+    # strand specific 5 prime end
+    pos = np.where(reverse, rend, rstart)
+
+    if pairedend == 'midpoint':
+        pepos = np.minimum(rstart, mstart) + np.abs(tlen) // 2
+    else:
+        # last position of the downstream read or
+        # first position of the upstream read
+        pepos = np.where(reverse, np.maximum(rend, mstart + qlen),
+                         np.minimum(rstart, mstart))
+    pos = np.where(paired, pepos, pos)
+
+    return pos[keep], reverse[keep].astype('int64')
+
+
+def _count_bam_reads(job, chunksize=100000):  # pylint: disable=too-many-locals
+    """Count the reads of a single BAM file in a given locus.
+
+    This function is defined on the module level such that
+    it can be dispatched to worker processes.
+    The alignment fields are collected in chunks for which
+    the read positions are determined and counted at once.
+
+    Parameters
+    ----------
+    job : tuple
+        Tuple (sample_file, locus, length, offset, min_mapq, pairedend,
+        dtype, binsize), where offset is subtracted from the read positions
+        or None, if the entire chromosome is counted.
+        The reads are counted in bins of size binsize.
+        If binsize is None, all reads are counted in a single bin.
+    chunksize : int
+        Number of alignments that are processed at once.
+
+    Returns
+    -------
+    numpy.array
+        Read counts of shape (nbins, 2).
+    """
+    sample_file, locus, length, offset, min_mapq, pairedend, dtype, binsize = job
+
+    nbins = _get_iv_length(length, binsize)
+    counts = np.zeros(nbins * 2, dtype='int64')
+
+    def _count(chunk):
+        pos, strand = _get_read_positions(np.asarray(chunk, dtype='int64'),
+                                          min_mapq, pairedend)
+        if offset is not None:
+            # if we get here, a region was given,
+            # otherwise, the entire chromosome is read.
+            pos -= offset
+
+        # reads whose 5 p end or mid point is outside
+        # of the region of interest are discarded
+        inside = (pos >= 0) & (pos < length)
+        pos = pos[inside] // binsize if binsize is not None else pos[inside] * 0
+        counts[:] += np.bincount(pos * 2 + strand[inside],
+                                 minlength=nbins * 2)
+
+    aln_file = pysam.AlignmentFile(sample_file, 'rb')  # pylint: disable=no-member
+    chunk = []
+    for aln in aln_file.fetch(*locus):
+        rend = aln.reference_end
+        chunk.append((aln.flag, aln.reference_start,
+                      rend if rend is not None else -1,
+                      aln.mapping_quality, aln.template_length,
+                      aln.next_reference_start, aln.query_length,
+                      aln.reference_id == aln.next_reference_id))
+        if len(chunk) >= chunksize:
+            _count(chunk)
+            chunk = []
+    if chunk:
+        _count(chunk)
+    aln_file.close()
+
+    return counts.reshape(nbins, 2).astype(dtype)
+
+
 class BamLoader:
     """BamLoader class.
 
@@ -47,14 +175,18 @@ class BamLoader:
         Minimum mapping quality to be considered.
     pairedend : str
         Paired-end mode 'midpoint' or '5prime'.
+    num_workers : int
+        Number of worker processes that count the reads for
+        different files and chromosomes in parallel. Default: 1.
     """
     def __init__(self, files, gsize, template_extension,
-                 min_mapq, pairedend):
+                 min_mapq, pairedend, num_workers=1):
         self.files = files
         self.gsize = gsize
         self.template_extension = template_extension
         self.min_mapq = min_mapq
         self.pairedend = pairedend
+        self.num_workers = num_workers
 
     def __call__(self, garray):
         files = self.files
@@ -65,10 +197,18 @@ class BamLoader:
         min_mapq = self.min_mapq
         pairedend = self.pairedend
 
+        # summing read counts in bins of size resolution is equivalent
+        # to counting the read positions divided by the resolution.
+        # This avoids allocating the counts at base pair resolution.
+        collapser = garray.collapser
+        binned = collapser is None or collapser is _collapse_sum
+        binsize = resolution if binned else 1
+
         print("load from bam")
+        jobs = []
+        targets = []
         for i, sample_file in enumerate(files):
             print('Counting from {}'.format(sample_file))
-            aln_file = pysam.AlignmentFile(sample_file, 'rb')  # pylint: disable=no-member
             for chrom in gsize:
 
                 locus = _str_to_iv(chrom,
@@ -82,85 +222,130 @@ class BamLoader:
                     length = garray.get_iv_end(locus[2] -
                                                locus[1]) * resolution
 
-                array = np.zeros((length, 2), dtype=dtype)
-
                 # locus = (chr, start, end)
-                start = locus[1]
                 # or locus = (chr, )
+                offset = None if garray._full_genome_stored \
+                    else locus[1] + template_extension
 
-                for aln in aln_file.fetch(*locus):
-
-                    if aln.is_unmapped:
-                        continue
-
-                    if aln.mapq < min_mapq:
-                        continue
-
-                    if aln.is_read2:
-                        # only consider read1 so as not to double count
-                        # fragments for paired end reads
-                        # read2 will also be false for single end
-                        # reads.
-                        continue
-
-                    if aln.is_paired:
-                        # if paired end read, consider the midpoint
-                        if not (aln.is_proper_pair and
-                                aln.reference_name == aln.next_reference_name):
-                            # only consider paired end reads if both mates
-                            # are properly mapped and they map to the
-                            # same reference_name
-                            continue
-                        # if the next reference start >= 0,
-                        # the read is considered as a paired end read
-                        # in this case we consider the mid point
-                        if pairedend == 'midpoint':
-                            pos = min(aln.reference_start,
-                                      aln.next_reference_start) + \
-                                      abs(aln.template_length) // 2
-                        else:
-                            if aln.is_reverse:
-                                # last position of the downstream read
-                                pos = max(aln.reference_end,
-                                          aln.next_reference_start +
-                                          aln.query_length)
-                            else:
-                                # first position of the upstream read
-                                pos = min(aln.reference_start,
-                                          aln.next_reference_start)
-                    else:
-                        # here we consider single end reads
-                        # whose 5 prime end is determined strand specifically
-                        if aln.is_reverse:
-                            pos = aln.reference_end
-                        else:
-                            pos = aln.reference_start
-
-                    if not garray._full_genome_stored:
-                        # if we get here, a region was given,
-                        # otherwise, the entire chromosome is read.
-                        pos -= start + template_extension
-
-                        if pos < 0 or pos >= length:
-                            # if the read 5 p end or mid point is outside
-                            # of the region of interest, the read is discarded
-                            continue
-
-                    # compute divide by the resolution
-                    #pos = garray.get_iv_start(pos)
-
-                    # fill up the read strand specifically
-                    if aln.is_reverse:
-                        array[pos, 1] += 1
-                    else:
-                        array[pos, 0] += 1
+                jobs.append((sample_file, locus, length, offset,
+                             min_mapq, pairedend, dtype, binsize))
+                targets.append((GenomicInterval(*locus), i))
 
-                garray[GenomicInterval(*locus), i] = array
+        if binned:
+            # the counts are already aggregated at the target resolution.
+            garray.collapser = None
+        try:
+            if self.num_workers > 1:
+                pool = Pool(self.num_workers)
+                try:
+                    # the counts are written into the genomic array
+                    # by the parent process as they arrive.
+                    for target, array in zip(targets,
+                                             pool.imap(_count_bam_reads, jobs)):
+                        garray[target] = array
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for target, job in zip(targets, jobs):
+                    garray[target] = _count_bam_reads(job)
+        finally:
+            garray.collapser = collapser
 
         return garray
 
 
 
+def _check_picklable(collapser):
+    """Checks that a collapser can be sent to worker processes."""
+    try:
+        pickle.dumps(collapser)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        raise ValueError('With num_workers > 1, the collapser must be '
+                         'picklable, e.g. a function defined at the module '
+                         'level rather than a lambda or a closure.')
+
+
+def _read_bigwig_values(bwfile, chrom, start, end, nan_to_num):
+    """Read the signal of a bigwig file as numpy array."""
+    if pyBigWig.numpy:
+        values = bwfile.values(chrom, start, end, numpy=True)
+    else:  # pragma: no cover
+        values = np.asarray(bwfile.values(chrom, start, end))
+    if nan_to_num:
+        values = np.nan_to_num(values, copy=False)
+    return values
+
+
+def _load_bigwig(job, chunksize=1 << 22):  # pylint: disable=too-many-locals
+    """Load the signal of a single bigwig file in a given locus.
+
+    This function is defined on the module level such that
+    it can be dispatched to worker processes.
+    The signal is read in chunks of at most chunksize base pairs,
+    which are aggregated at the target resolution one after the other.
+
+    Parameters
+    ----------
+    job : tuple
+        Tuple (sample_file, locus, resolution, collapser, nan_to_num, dtype).
+    chunksize : int
+        Number of base pairs that are read at once.
+
+    Returns
+    -------
+    numpy.array
+        Signal of shape (nbins, 1) at the target resolution.
+    """
+    sample_file, locus, resolution, collapser, nan_to_num, dtype = job
+    chrom, start, end = locus
+
+    bwfile = pyBigWig.open(sample_file)
+    # positions beyond the chromosome end remain zero
+    readend = min(end, bwfile.chroms(chrom) or end)
+
+    if resolution is None:
+        # aggregate the entire interval
+        array = np.zeros((end - start, 1), dtype=dtype)
+        if readend > start:
+            values = _read_bigwig_values(bwfile, chrom, start, readend, nan_to_num)
+            array[:len(values), 0] = values
+        bwfile.close()
+        return collapser(array.reshape((1,) + array.shape))
+
+    nbins = _get_iv_length(end - start, resolution)
+    result = np.zeros((nbins, 1), dtype=dtype)
+
+    # the bigwig summaries yield the sums (or means) per bin directly,
+    # if NaNs count as zeros.
+    use_stats = resolution > 1 and nan_to_num and \
+        collapser in [_collapse_sum, _collapse_mean]
+    nstats = (readend - start) // resolution if use_stats else 0
+    if nstats > 0:
+        sums = bwfile.stats(chrom, start, start + nstats * resolution,
+                            type='sum', nBins=nstats, exact=True)
+        sums = np.asarray([0. if val is None else val for val in sums])
+        if collapser is _collapse_mean:
+            sums /= resolution
+        result[:nstats, 0] = sums
+
+    chunksize = max(1, chunksize // resolution) * resolution
+    for chunkstart in range(start + nstats * resolution, readend, chunksize):
+        chunkend = min(chunkstart + chunksize, readend)
+        values = _read_bigwig_values(bwfile, chrom, chunkstart, chunkend,
+                                     nan_to_num)
+        # the last chunk is zero padded to a multiple of the resolution
+        array = np.zeros((_get_iv_length(chunkend - chunkstart, resolution) *
+                          resolution, 1), dtype=dtype)
+        array[:len(values), 0] = values
+        offset = (chunkstart - start) // resolution
+        result[offset:(offset + len(array) // resolution)] = \
+            collapser(array.reshape((-1, resolution, 1)))
+
+    bwfile.close()
+    return result
+
+
 class BigWigLoader:
     """BigWigLoader class.
 
@@ -175,11 +360,17 @@ class BigWigLoader:
         Dictionary of genome sizes.
     nan_to_num : bool
         Whether to convert NAN's to zeros or not. Default: True.
+    num_workers : int
+        Number of worker processes that load the signal for
+        different files and chromosomes in parallel.
+        If num_workers > 1, the collapser of the genomic array
+        must be picklable. Default: 1.
     """
-    def __init__(self, files, gsize, nan_to_num):
+    def __init__(self, files, gsize, nan_to_num, num_workers=1):
         self.files = files
         self.gsize = gsize
         self.nan_to_num = nan_to_num
+        self.num_workers = num_workers
 
     def __call__(self, garray):
         files = self.files
@@ -187,34 +378,110 @@ class BigWigLoader:
         resolution = garray.resolution
         dtype = garray.typecode
         nan_to_num = self.nan_to_num
+        collapser = garray.collapser
+
+        if self.num_workers > 1:
+            _check_picklable(collapser)
 
         print("load from bigwig")
+        jobs = []
+        targets = []
         for i, sample_file in enumerate(files):
-            bwfile = pyBigWig.open(sample_file)
-
             for chrom in gsize:
 
                 locus = _str_to_iv(chrom)
                 if len(locus) == 1:
                     locus = (locus[0], 0, gsize[chrom])
 
-                if resolution is None:
-                    length = locus[2] - locus[1]
-                else:
-                    length = garray.get_iv_end(locus[2]-locus[1]) * resolution
+                # without collapser the signal is stored
+                # at base pair resolution
+                jobs.append((sample_file, (locus[0], int(locus[1]), int(locus[2])),
+                             resolution,
+                             collapser if collapser is not None else _collapse_sum,
+                             nan_to_num, dtype))
+                targets.append((GenomicInterval(*locus), i))
 
-                array = np.zeros((length, 1), dtype=dtype)
+        # the signal is already aggregated at the target resolution.
+        garray.collapser = None
+        try:
+            if self.num_workers > 1:
+                pool = Pool(self.num_workers)
+                try:
+                    for target, array in zip(targets,
+                                             pool.imap(_load_bigwig, jobs)):
+                        garray[target] = array
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for target, job in zip(targets, jobs):
+                    garray[target] = _load_bigwig(job)
+        finally:
+            garray.collapser = collapser
+        return garray
 
-                values = np.asarray(bwfile.values(locus[0],
-                                                  int(locus[1]),
-                                                  int(locus[2])))
-                if nan_to_num:
-                    values = np.nan_to_num(values, copy=False)
 
-                array[:len(values), 0] = values
+def _paint_regions(starts, ends, values):
+    """Paint regions as a step function that holds the maximum value.
 
-                garray[GenomicInterval(*locus), i] = array
-        return garray
+    Parameters
+    ----------
+    starts : numpy.array
+        Region starts.
+    ends : numpy.array
+        Region ends.
+    values : numpy.array
+        Region values.
+
+    Returns
+    -------
+    tuple(numpy.array, numpy.array)
+        Breakpoints and the values between consecutive breakpoints.
+        The function is zero outside of the regions.
+    """
+    breaks = np.unique(np.concatenate([starts, ends]))
+    steps = np.zeros(max(len(breaks) - 1, 0), dtype=values.dtype)
+
+    # each region covers the steps between its first and last breakpoint
+    first = np.searchsorted(breaks, starts)
+    counts = np.searchsorted(breaks, ends) - first
+    counts = np.maximum(counts, 0)
+    offsets = np.repeat(first - np.cumsum(counts) + counts, counts)
+    idx = offsets + np.arange(counts.sum())
+    np.maximum.at(steps, idx, np.repeat(values, counts))
+    return breaks, steps
+
+
+def _merge_runs(starts, ends):
+    """Merge overlapping or adjacent intervals into disjoint runs.
+
+    Returns
+    -------
+    tuple(numpy.array, numpy.array)
+        Sorted starts and ends of the runs.
+    """
+    order = np.argsort(starts)
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    newrun = np.concatenate([[True], starts[1:] > ends[:-1]])
+    return starts[newrun], ends[np.concatenate([newrun[1:], [True]])]
+
+
+def _split_runs(starts, ends, length):
+    """Split intervals into consecutive pieces of at most length."""
+    counts = -(-(ends - starts) // length)
+    pieces = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+    pstarts = np.repeat(starts, counts) + pieces * length
+    return pstarts, np.minimum(pstarts + length, np.repeat(ends, counts))
+
+
+def _eval_regions(breaks, steps, positions):
+    """Evaluate the step function obtained from _paint_regions."""
+    idx = np.searchsorted(breaks, positions, side='right') - 1
+    valid = (idx >= 0) & (idx < len(steps))
+    values = np.zeros(len(positions), dtype=steps.dtype)
+    values[valid] = steps[idx[valid]]
+    return values
 
 
 class BedLoader:
@@ -223,6 +490,15 @@ class BedLoader:
     This class loads the GenomicArray with signal coverage
     extracted from BED files.
 
+    The regions are sorted by chromosome and painted as a step function
+    holding the maximum score per condition. Afterwards, the intervals of
+    the GenomicIndexer that overlap any region are filled in from
+    the step function, which is evaluated per chromosome and condition
+    in chunks of bounded length. If the whole genome is stored,
+    the overlapping intervals are merged into contiguous blocks,
+    such that a tiled chromosome is written in a few large pieces.
+    Otherwise, each region of interest is written to its own entry.
+
     Parameters
     ----------
     files : str or list(str)
@@ -232,66 +508,112 @@ class BedLoader:
     mode : str
         Mode might be 'binary', 'score' or 'categorical'.
     """
+    # number of base pairs that are evaluated at once
+    _chunk_length = 1 << 20
+
     def __init__(self, files, gindexer, mode):
         self.files = files
         self.gindexer = gindexer
         self.mode = mode
 
-
-    def __call__(self, garray):
-        files = self.files
+    def _read_regions(self):
+        """Read all regions as columns chrom, start, end, condition and value."""
+        mode = self.mode
+        regions = []
+        for i, sample_file in enumerate(self.files):
+            for region in _get_genomic_reader(sample_file):
+                if region.score is None and mode in ['score',
+                                                     'categorical']:
+                    raise ValueError(
+                        'No Score available. Score field must '
+                        'present in {}'.format(sample_file) + \
+                        'for mode="{}"'.format(mode))
+                # if region score is not defined, take the mere
+                # presence of a range as positive label.
+                if mode == 'categorical':
+                    condition, score = int(region.score), 1
+                elif mode == 'score':
+                    condition, score = i, region.score
+                else:
+                    condition, score = i, 1
+                regions.append((region.iv.chrom, region.iv.start,
+                                region.iv.end, condition, score))
+
+        if not regions:
+            return (np.zeros(0, dtype=str),) + \
+                tuple(np.zeros(0, dtype='int64') for _ in range(3)) + \
+                (np.zeros(0),)
+        chroms, starts, ends, conditions, scores = zip(*regions)
+        return (np.asarray(chroms), np.asarray(starts, dtype='int64'),
+                np.asarray(ends, dtype='int64'),
+                np.asarray(conditions, dtype='int64'), np.asarray(scores))
+
+    def __call__(self, garray):  # pylint: disable=too-many-locals
         dtype = garray.typecode
         gindexer = self.gindexer
-        mode = self.mode
 
         print("load from bed")
-        for i, sample_file in enumerate(files):
-            regions_ = _get_genomic_reader(sample_file)
-
-            for region in regions_:
-
-                gidx = gindexer.filter_by_region(
-                    include=region.iv.chrom,
-                    start=region.iv.start,
-                    end=region.iv.end)
-                for greg in gidx:
-                    if region.score is None and mode in ['score',
-                                                         'categorical']:
-                        raise ValueError(
-                            'No Score available. Score field must '
-                            'present in {}'.format(sample_file) + \
-                            'for mode="{}"'.format(mode))
-                    # if region score is not defined, take the mere
-                    # presence of a range as positive label.
-
-                    score = region.score if mode == 'score' else 1
-                    array = np.repeat(
-                        np.dtype(dtype).type(score).reshape((1, 1)),
-                        greg.length, axis=0)
-
-                    if greg.start < region.iv.start:
-                        # set the beginning of array to zero
-                        array[:(region.iv.start - greg.start), 0] = 0
-                    if greg.end > region.iv.end:
-                        # set the end of the array to zero
-                        array[-(greg.end - region.iv.end):, 0] = 0
-
-                    #if garray.resolution is not None:
-                    array = np.maximum(array,
-                                       np.repeat(garray[greg][:, :, i],
-                                       greg.length if garray.resolution is None \
-                                       else garray.resolution, axis=0))
-
-                    #    array = np.maximum(array, np.repeat(garray[greg][:, :, i], greg.length, axis=0)
-
-                    if mode == 'score':
-                        garray[greg, i] = array
-                    elif mode == 'categorical':
-                        garray[greg, int(region.score)] = array
-                    elif mode == 'binary':
-                        garray[greg, i] = array
+        rchroms, rstarts, rends, rconds, rscores = self._read_regions()
+        # scores below zero do not exceed the empty coverage
+        rscores = np.maximum(rscores.astype(dtype), 0)
+
+        for chrom in np.unique(rchroms):
+            rsel = rchroms == chrom
+
+            # find the intervals that overlap any of the regions.
+            # the indexer is only queried for the current chromosome.
+            _, istarts, iends, _ = gindexer.get_batch(
+                gindexer.idx_by_region(include=str(chrom)))
+            run_starts, run_ends = _merge_runs(rstarts[rsel], rends[rsel])
+            first = np.searchsorted(run_ends, istarts, side='right')
+            touched = first < len(run_starts)
+            touched[touched] = run_starts[first[touched]] < iends[touched]
+            if not touched.any():
+                continue
+            istarts, iends = istarts[touched], iends[touched]
+
+            if garray._full_genome_stored:  # pylint: disable=protected-access
+                # the touched intervals are written as merged blocks,
+                # aligned to the resolution of the array and split into
+                # chunks of bounded length.
+                resolution = garray.resolution
+                wstarts, wends = _split_runs(
+                    *_merge_runs(istarts // resolution * resolution,
+                                 -(-iends // resolution) * resolution),
+                    length=max(1, self._chunk_length // resolution) * resolution)
+            else:
+                # each region of interest is stored separately
+                wstarts, wends = istarts, iends
+
+            paints = [(cond, _paint_regions(rstarts[rsel & (rconds == cond)],
+                                            rends[rsel & (rconds == cond)],
+                                            rscores[rsel & (rconds == cond)]))
+                      for cond in np.unique(rconds[rsel])]
+
+            # the blocks are evaluated in groups of bounded total length
+            lengths = wends - wstarts
+            groups = (np.cumsum(lengths) - lengths) // self._chunk_length
+            for group in np.split(np.arange(len(wstarts)),
+                                  np.nonzero(np.diff(groups))[0] + 1):
+                # all positions of the written blocks
+                glengths = lengths[group]
+                positions = np.repeat(wstarts[group] - np.cumsum(glengths) +
+                                      glengths, glengths) + \
+                    np.arange(glengths.sum())
+                splits = np.cumsum(glengths)[:-1]
+
+                for cond, (breaks, steps) in paints:
+                    values = np.split(_eval_regions(breaks, steps,
+                                                    positions).astype(dtype),
+                                      splits)
+                    for start, end, value in zip(wstarts[group],
+                                                 wends[group], values):
+                        garray[GenomicInterval(str(chrom), int(start),
+                                               int(end)),
+                               int(cond)] = value.reshape(-1, 1)
         return garray
 
+
 class ArrayLoader:
     """ArrayLoader class.
 
@@ -347,6 +669,9 @@ class Cover(Dataset):
         A genomic indexer translates an integer index to a
         corresponding genomic coordinate.
         It can be None the genomic indexer is supplied later.
+    batch_dtype : str
+        Datatype of the returned batches, e.g. 'float32' or 'float16'.
+        Default: 'float64'.
     """
 
     _flank = None
@@ -354,11 +679,13 @@ class Cover(Dataset):
 
     def __init__(self, name, garray,
                  gindexer,  # indices of pointing to region start
-                 channel_last):  # padding value
+                 channel_last,  # padding value
+                 batch_dtype='float64'):
 
         self.garray = garray
         self.gindexer = gindexer
         self._channel_last = channel_last
+        self.batch_dtype = batch_dtype
         Dataset.__init__(self, name)
 
     @classmethod
@@ -382,7 +709,10 @@ class Cover(Dataset):
                         channel_last=True,
                         normalizer=None,
                         zero_padding=True,
-                        store_whole_genome=False):
+                        store_whole_genome=False,
+                        num_workers=1,
+                        num_threads=1,
+                        batch_dtype='float64'):
         """Create a Cover class from a bam-file (or files).
 
         This constructor can be used to obtain coverage from BAM files.
@@ -445,7 +775,7 @@ class Cover(Dataset):
             Default: 1.
         storage : str
             Storage mode for storing the coverage data can be
-            'ndarray', 'hdf5' or 'sparse'. Default: 'ndarray'.
+            'ndarray', 'hdf5', 'memmap' or 'sparse'. Default: 'ndarray'.
         dtype : str
             Typecode to be used for storage the data.
             Default: 'int'.
@@ -493,6 +823,19 @@ class Cover(Dataset):
             Indicates whether the whole genome or only ROI
             should be loaded. If False, a bed-file with regions of interest
             must be specified. Default: False
+        num_workers : int
+            Number of worker processes used for counting the reads.
+            Each BAM file and chromosome (or region) is processed
+            as a separate job. Default: 1.
+        num_threads : int
+            Number of threads used for normalizing the coverage.
+            Each chromosome (or region) is processed as a separate job.
+            It is ignored for storage='hdf5', because h5py serializes
+            all calls with a global lock. Default: 1.
+        batch_dtype : str
+            Datatype of the returned batches, e.g. 'float32' or 'float16'.
+            In contrast, dtype determines the datatype of the stored
+            coverage. Default: 'float64'.
         """
 
         if pysam is None:  # pragma: no cover
@@ -541,7 +884,7 @@ class Cover(Dataset):
 
 
         bamloader = BamLoader(bamfiles, gsize, template_extension,
-                              min_mapq, pairedend)
+                              min_mapq, pairedend, num_workers)
 
         datatags = [name] + datatags if datatags else [name]
 
@@ -557,10 +900,13 @@ class Cover(Dataset):
                                      resolution=resolution,
                                      loader=bamloader,
                                      normalizer=normalizer,
-                                     collapser='sum')
+                                     collapser='sum',
+                                     chunks=_get_chunks(binsize, resolution),
+                                     num_threads=num_threads)
 
         return cls(name, cover, gindexer,
-                   channel_last=channel_last)
+                   channel_last=channel_last,
+                   batch_dtype=batch_dtype)
 
     @classmethod
     def create_from_bigwig(cls, name,  # pylint: disable=too-many-locals
@@ -579,7 +925,10 @@ class Cover(Dataset):
                            zero_padding=True,
                            normalizer=None,
                            collapser=None,
-                           nan_to_num=True):
+                           nan_to_num=True,
+                           num_workers=1,
+                           num_threads=1,
+                           batch_dtype='float64'):
         """Create a Cover class from a bigwig-file (or files).
 
         Parameters
@@ -635,7 +984,7 @@ class Cover(Dataset):
             Default: 0.
         storage : str
             Storage mode for storing the coverage data can be
-            'ndarray', 'hdf5' or 'sparse'. Default: 'ndarray'.
+            'ndarray', 'hdf5', 'memmap' or 'sparse'. Default: 'ndarray'.
         dtype : str
             Typecode to define the datatype to be used for storage.
             Default: 'float32'.
@@ -680,11 +1029,30 @@ class Cover(Dataset):
         nan_to_num : boolean
             Indicates whether NaN values contained in the bigwig files should
             be interpreted as zeros. Default: True
+        num_workers : int
+            Number of worker processes used for loading the bigwig files.
+            Each file and chromosome (or region) is processed
+            as a separate job. If num_workers > 1, a custom collapser
+            must be picklable, i.e. a lambda or a closure is not
+            supported. Default: 1.
+        num_threads : int
+            Number of threads used for normalizing the coverage.
+            Each chromosome (or region) is processed as a separate job.
+            It is ignored for storage='hdf5', because h5py serializes
+            all calls with a global lock. Default: 1.
+        batch_dtype : str
+            Datatype of the returned batches, e.g. 'float32' or 'float16'.
+            In contrast, dtype determines the datatype of the stored
+            coverage. Default: 'float64'.
         """
         if pyBigWig is None:  # pragma: no cover
             raise Exception('pyBigWig not available. '
                             '`create_from_bigwig` requires pyBigWig to be installed.')
 
+        if num_workers > 1 and callable(collapser):
+            # the collapser is sent to the worker processes
+            _check_picklable(collapser)
+
         collapse = True if resolution is None else False
 
         if roi is not None:
@@ -718,7 +1086,7 @@ class Cover(Dataset):
             conditions = [os.path.splitext(os.path.basename(f))[0] for f in bigwigfiles]
 
 
-        bigwigloader = BigWigLoader(bigwigfiles, gsize, nan_to_num)
+        bigwigloader = BigWigLoader(bigwigfiles, gsize, nan_to_num, num_workers)
         datatags = [name] + datatags if datatags else [name]
         datatags += ['resolution{}'.format(resolution)]
 
@@ -734,10 +1102,13 @@ class Cover(Dataset):
                                      typecode=dtype,
                                      loader=bigwigloader,
                                      collapser=collapser_,
-                                     normalizer=normalizer)
+                                     normalizer=normalizer,
+                                     chunks=_get_chunks(binsize, resolution),
+                                     num_threads=num_threads)
 
         return cls(name, cover, gindexer,
-                   channel_last=channel_last)
+                   channel_last=channel_last,
+                   batch_dtype=batch_dtype)
 
     @classmethod
     def create_from_bed(cls, name,  # pylint: disable=too-many-locals
@@ -756,7 +1127,8 @@ class Cover(Dataset):
                         zero_padding=True,
                         normalizer=None,
                         collapser=None,
-                        datatags=None, cache=False):
+                        datatags=None, cache=False,
+                        batch_dtype='float64'):
         """Create a Cover class from a bed-file (or files).
 
         Parameters
@@ -808,7 +1180,7 @@ class Cover(Dataset):
             Default: 0.
         storage : str
             Storage mode for storing the coverage data can be
-            'ndarray', 'hdf5' or 'sparse'. Default: 'ndarray'.
+            'ndarray', 'hdf5', 'memmap' or 'sparse'. Default: 'ndarray'.
         dtype : str
             Typecode to define the datatype to be used for storage.
             Default: 'int'.
@@ -853,6 +1225,10 @@ class Cover(Dataset):
             Default: None.
         cache : boolean
             Indicates whether to cache the dataset. Default: False.
+        batch_dtype : str
+            Datatype of the returned batches, e.g. 'float32' or 'float16'.
+            In contrast, dtype determines the datatype of the stored
+            coverage. Default: 'float64'.
         """
 
         if roi is None and genomesize is None:
@@ -919,10 +1295,12 @@ class Cover(Dataset):
                                      store_whole_genome=store_whole_genome,
                                      loader=bedloader,
                                      collapser=collapser_,
-                                     normalizer=normalizer)
+                                     normalizer=normalizer,
+                                     chunks=_get_chunks(binsize, resolution))
 
         return cls(name, cover, gindexer,
-                   channel_last=channel_last)
+                   channel_last=channel_last,
+                   batch_dtype=batch_dtype)
 
     @classmethod
     def create_from_array(cls, name,  # pylint: disable=too-many-locals
@@ -935,7 +1313,8 @@ class Cover(Dataset):
                           datatags=None,
                           cache=False,
                           channel_last=True,
-                          store_whole_genome=False):
+                          store_whole_genome=False,
+                          batch_dtype='float64'):
         """Create a Cover class from a numpy.array.
 
         The purpose of this function is to convert output prediction from
@@ -962,7 +1341,7 @@ class Cover(Dataset):
             and file-ending).
         storage : str
             Storage mode for storing the coverage data can be
-            'ndarray', 'hdf5' or 'sparse'. Default: 'ndarray'.
+            'ndarray', 'hdf5', 'memmap' or 'sparse'. Default: 'ndarray'.
         overwrite : boolean
             Overwrite cachefiles. Default: False.
         datatags : list(str) or None
@@ -980,6 +1359,10 @@ class Cover(Dataset):
             It indicates whether the condition axis is the last dimension
             or the first. For example, tensorflow expects the channel at the
             last position. Default: True.
+        batch_dtype : str
+            Datatype of the returned batches, e.g. 'float32' or 'float16'.
+            In contrast, dtype determines the datatype of the stored
+            coverage. Default: 'float64'.
         """
 
         if not store_whole_genome:
@@ -1052,7 +1435,8 @@ class Cover(Dataset):
                                      collapser=_dummy_collapser)
 
         return cls(name, cover, gindexer,
-                   channel_last=channel_last)
+                   channel_last=channel_last,
+                   batch_dtype=batch_dtype)
 
     @property
     def gindexer(self):
@@ -1156,13 +1540,40 @@ class Cover(Dataset):
         except TypeError:
             raise IndexError('Cover.__getitem__: index must be iterable')
 
-        data = np.zeros((len(idxs),) + self.shape_static[1:])
+        return self.get_batch(idxs)
 
-        for i, idx in enumerate(idxs):
-            interval = self.gindexer[idx]
+    def get_batch(self, idxs, length=None, out=None):
+        """Returns the coverage for a set of indices.
 
-            dat = self._getsingleitem(interval)
-            data[i, :len(dat), :, :] = dat
+        Parameters
+        ----------
+        idxs : list(int)
+            List of region indexes.
+        length : int or None
+            Number of bins of the batch. Shorter regions are zero-padded.
+            Default: None means the number of bins of the dataset is used.
+        out : numpy.array or None
+            Optional output buffer with the shape given by
+            :code:`_batch_shape(len(idxs), length)`.
+            Default: None means a new array is allocated.
+
+        Returns
+        -------
+        numpy.array
+            Coverage of the regions.
+        """
+        shape = self._batch_shape(len(idxs), length)
+        if out is None:
+            data = np.zeros(shape, dtype=self.batch_dtype)
+        else:
+            if out.shape != shape:
+                raise ValueError('out must have shape {}, but has shape {}.'.format(
+                    shape, out.shape))
+            data = out
+            data[:] = 0
+
+        # fetch the entire batch at once
+        self.garray.fill_batch(*self.gindexer.get_batch(idxs), out=data)
 
         for transform in self.transformations:
             data = transform(data)
@@ -1172,6 +1583,13 @@ class Cover(Dataset):
 
         return data
 
+    def _batch_shape(self, size, length=None):
+        """Shape of a batch before the channel axis is moved."""
+        shape = self.shape_static[1:]
+        if length is not None:
+            shape = (length,) + shape[1:]
+        return (size,) + shape
+
     def _getsingleitem(self, pinterval):
 
         if pinterval.strand == '-':
@@ -1193,6 +1611,20 @@ class Cover(Dataset):
 
         return tuple(self.shape_static[x] for x in [0, 3, 1, 2])
 
+    @property
+    def sequence_lengths(self):
+        """Number of bins of the regions.
+
+        None is returned if the regions are collapsed
+        to a single value (resolution=None).
+        """
+        if self.garray.resolution is None:
+            return None
+        _, starts, ends, _ = self.gindexer.get_batch(np.arange(len(self)))
+        lengths = -(-ends // self.garray.resolution) - \
+            starts // self.garray.resolution
+        return np.minimum(lengths, self.shape_static[1])
+
     @property
     def shape_static(self):
         """Shape of the dataset"""
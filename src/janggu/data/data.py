@@ -3,6 +3,10 @@
 from abc import ABCMeta
 from abc import abstractmethod
 from abc import abstractproperty
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from threading import local
 
 import numpy
 from keras.utils import Sequence
@@ -89,15 +93,191 @@ def _data_props(data):
     raise Exception('inputSpace wrong argument: {}'.format(data))
 
 
+class _ReverseComplementTransform(object):
+    """Reverse complement transformation bound to a dataset.
+
+    Applies the flips drawn by the associated
+    :class:`RandomReverseComplement` to the batches of the dataset.
+    """
+    def __init__(self, augmentation, permutation=None):
+        self.augmentation = augmentation
+        self.permutation = permutation
+
+    def __call__(self, data):
+        mask = self.augmentation.mask
+        if mask is None or len(mask) != len(data) or not mask.any():
+            return data
+
+        # flip the sequence and strand axis using reversed views.
+        # if the entire batch is flipped, no copy is required.
+        flipped = data[:, ::-1, ::-1] if mask.all() else data[mask][:, ::-1, ::-1]
+        if self.permutation is not None:
+            flipped = flipped.take(self.permutation, axis=-1)
+
+        if mask.all():
+            return flipped
+
+        data[mask] = flipped
+        return data
+
+
+class RandomReverseComplement(object):
+    """Reverse complement data augmentation.
+
+    A random fraction of the samples of each batch is reverse complemented.
+    The same augmentation object can be attached to several datasets, e.g.
+    Bioseq inputs and Cover outputs, in which case all of them are flipped
+    consistently within each batch of a :class:`JangguSequence`.
+    For Bioseq datasets, the sequence is reversed and the nucleotides
+    are complemented. For Cover datasets, the signal is reversed and
+    the strands are swapped.
+
+    The flips are only applied to batches served by a
+    :class:`JangguSequence`. Indexing the datasets directly
+    returns the original data.
+
+    Parameters
+    ----------
+    fraction : float
+        Fraction of samples to reverse complement. Default: 0.5.
+    seed : int or None
+        Random seed. Default: None.
+
+    Examples
+    --------
+    .. code-block:: python
+
+      rcomp = RandomReverseComplement(fraction=0.5)
+      dna.transformations = [rcomp.transformation(dna)]
+      cover.transformations = [rcomp.transformation(cover)]
+    """
+    def __init__(self, fraction=0.5, seed=None):
+        if not 0. <= fraction <= 1.:
+            raise ValueError('fraction must be between zero and one.')
+        self.fraction = fraction
+        self.random_state = numpy.random.RandomState(seed)
+        # the flips are kept per thread, such that
+        # batches can be assembled concurrently.
+        self._local = local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = local()
+
+    @property
+    def mask(self):
+        """Samples to be flipped in the current batch."""
+        return getattr(self._local, 'mask', None)
+
+    @mask.setter
+    def mask(self, mask):
+        self._local.mask = mask
+
+    def draw(self, size):
+        """Draws the samples to be flipped for the next batch."""
+        self.mask = self.random_state.rand(size) < self.fraction
+
+    def reset(self):
+        """Disables the flips until the next draw."""
+        self.mask = None
+
+    def transformation(self, dataset):
+        """Creates the transformation for a given dataset.
+
+        Parameters
+        ----------
+        dataset : :class:`Bioseq` or :class:`Cover`
+            Dataset whose batches should be augmented.
+
+        Returns
+        -------
+        callable
+            Transformation to be added to dataset.transformations.
+        """
+        # Bioseq datasets provide the complementary
+        # index for each (higher-order) nucleotide.
+        return _ReverseComplementTransform(self, getattr(dataset, '_rcindex',
+                                                         None))
+
+
+def _get_augmentations(datasets):
+    """Collects the RandomReverseComplement objects of the datasets."""
+    augmentations = []
+    for data in datasets:
+        for transform in getattr(data, 'transformations', []):
+            if isinstance(transform, _ReverseComplementTransform) and \
+                    not any(transform.augmentation is aug for aug in augmentations):
+                augmentations.append(transform.augmentation)
+    return augmentations
+
+
+class _BatchBuffers(object):
+    """Ring of reusable batch buffers.
+
+    For each dataset, size buffers are allocated and handed out in turn.
+    Each buffer is a flat array that grows to the largest requested batch,
+    such that smaller batches are served by contiguous views of it.
+    """
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('The number of buffers must be a positive integer.')
+        self.size = size
+        self._rings = {}
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # buffers and locks are not shared with worker processes
+        return {'size': self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'])
+
+    def get(self, key, shape, dtype):
+        """Returns the next buffer for a dataset."""
+        nelem = int(numpy.prod(shape))
+        with self._lock:
+            buffers, pos = self._rings.get(key, ([None] * self.size, 0))
+            self._rings[key] = (buffers, (pos + 1) % self.size)
+
+            buf = buffers[pos]
+            if buf is None or buf.size < nelem or buf.dtype != numpy.dtype(dtype):
+                buf = numpy.empty(nelem, dtype=dtype)
+                buffers[pos] = buf
+        return buf[:nelem].reshape(shape)
+
+
 class JangguSequence(Sequence):
     """JangguSequence class.
 
     This class is a subclass of keras.utils.Sequence.
     It is used to serve the fit_generator, predict_generator
     and evaluate_generator.
+
+    If the datasets carry :class:`RandomReverseComplement` transformations,
+    the samples to be flipped are drawn once per batch and
+    shared across all inputs and outputs.
+
+    With bucket_by_length=True, regions of similar length
+    are grouped into the same batch and each batch is only
+    padded to its longest region. This requires at least one
+    dataset with variable sequence lengths, e.g. a Bioseq dataset
+    created with variable_length=True. The batches are ordered by
+    the lengths of the first such dataset.
+
+    With buffers=n, the batches of Bioseq and Cover datasets are
+    written into a ring of n preallocated buffers per dataset
+    rather than newly allocated arrays. A buffer is reused
+    n batches later. Therefore, n must exceed the number of batches
+    that are held at the same time, e.g. by the queue of
+    fit_generator (max_queue_size) or a :class:`PrefetchSequence`.
     """
     def __init__(self, batch_size, inputs, outputs=None, sample_weights=None,
-                 shuffle=False):
+                 shuffle=False, bucket_by_length=False, buffers=None):
 
         self.inputs = inputs
         self.outputs = outputs
@@ -117,38 +297,258 @@ class JangguSequence(Sequence):
 
         self.indices = list(range(xlen))
         self.shuffle = shuffle
+        # datasets are identified by their section and key,
+        # which remains valid in worker processes.
+        datasets = [(('inputs', k), inputs[k]) for k in inputs] + \
+            [(('outputs', k), outputs[k]) for k in outputs or []]
+        self.augmentations = _get_augmentations([data for _, data in datasets])
+        self.buffers = _BatchBuffers(buffers) if buffers else None
+
+        # precompute the sequence lengths of each dataset
+        # which are used to determine the padding of each batch.
+        self.lengths = {}
+        self.batches = None
+        if bucket_by_length:
+            for key, data in datasets:
+                lengths = getattr(data, 'sequence_lengths', None)
+                if lengths is not None:
+                    self.lengths[key] = numpy.asarray(lengths)
+            if not self.lengths:
+                raise ValueError('bucket_by_length requires a dataset '
+                                 'with sequence lengths, e.g. Bioseq or Cover.')
+            self._bucket_key = self.lengths[next(
+                key for key, _ in datasets if key in self.lengths)]
+            self._make_buckets()
 
     def __len__(self):
         return int(numpy.ceil(len(self.indices) / float(self.batch_size)))
 
+    def _make_buckets(self):
+        """Groups the indices into batches of similar length."""
+        indices = numpy.asarray(self.indices)
+        if self.shuffle:
+            # randomize the order of equally long regions
+            numpy.random.shuffle(indices)
+        indices = indices[numpy.argsort(self._bucket_key[indices],
+                                        kind='mergesort')]
+        self.batches = [indices[i:(i + self.batch_size)].tolist()
+                        for i in range(0, len(indices), self.batch_size)]
+        if self.shuffle:
+            numpy.random.shuffle(self.batches)
+
+    def _batch_indices(self, idx):
+        """Indices of a batch."""
+        if self.batches is not None:
+            return self.batches[idx]
+        return self.indices[idx*self.batch_size:(idx+1)*self.batch_size]
+
+    def _fetch(self, key, data, idxs):
+        """Fetches a batch from a dataset.
+
+        With bucketing, the batch is only padded to its longest region.
+        With buffers, the batch is written into the next buffer of the dataset.
+        """
+        length = None
+        if key in self.lengths:
+            length = int(self.lengths[key][idxs].max())
+
+        if self.buffers is not None and hasattr(data, '_batch_shape'):
+            out = self.buffers.get(key,
+                                   data._batch_shape(len(idxs), length),  # pylint: disable=protected-access
+                                   data.batch_dtype)
+            return data.get_batch(idxs, length, out=out)
+
+        if length is not None:
+            return data.get_batch(idxs, length)
+        return data[idxs]
+
     def __getitem__(self, idx):
+        return self._getbatch(self._batch_indices(idx))
+
+    def _getbatch(self, idxs):
+        """Assembles the batch for a set of indices."""
+        for augmentation in self.augmentations:
+            augmentation.draw(len(idxs))
 
         inputs = {}
 
         for k in self.inputs:
-            inputs[k] = self.inputs[k][
-                self.indices[idx*self.batch_size:(idx+1)*self.batch_size]]
+            inputs[k] = self._fetch(('inputs', k), self.inputs[k], idxs)
 
         ret = (inputs, )
         if self.outputs is not None:
             outputs = {}
             for k in self.outputs:
-                outputs[k] = self.outputs[k][
-                    self.indices[idx*self.batch_size:(idx+1)*self.batch_size]]
+                outputs[k] = self._fetch(('outputs', k), self.outputs[k], idxs)
         else:
             outputs = None
 
         if self.sample_weights is not None:
 
-            sweight = self.sample_weights[
-                self.indices[idx*self.batch_size:(idx+1)*self.batch_size]]
+            sweight = self.sample_weights[idxs]
         else:
             sweight = None
         ret += (outputs, sweight)
 
+        for augmentation in self.augmentations:
+            augmentation.reset()
+
         return ret
 
     def on_epoch_end(self):
         """Stuff to do after epoch end."""
         if self.shuffle:
             numpy.random.shuffle(self.indices)
+            if self.batches is not None:
+                self._make_buckets()
+
+
+# sequence of the current worker process
+_WORKER_SEQUENCE = None
+
+
+def _init_prefetch_worker(sequence):
+    """Stores the sequence in the worker process."""
+    global _WORKER_SEQUENCE  # pylint: disable=global-statement
+    _WORKER_SEQUENCE = sequence
+    # avoid drawing the same augmentations in all workers
+    for augmentation in getattr(sequence, 'augmentations', []):
+        augmentation.random_state = numpy.random.RandomState()
+
+
+def _prefetch_batch(idxs):
+    """Assembles a batch in the worker process."""
+    return _WORKER_SEQUENCE._getbatch(idxs)  # pylint: disable=protected-access
+
+
+class PrefetchSequence(Sequence):
+    """PrefetchSequence class.
+
+    This class wraps a :class:`JangguSequence` and assembles
+    the upcoming batches ahead of time in a pool of worker threads or
+    processes, while the current batch is consumed.
+
+    Threads share the datasets with the main process
+    and are sufficient for most datasets, since the
+    batches are mostly assembled by numpy which releases the GIL.
+    Worker processes obtain a copy of the sequence only once
+    when the pool is started. Datasets stored with storage='memmap'
+    or 'hdf5' are reopened by the workers rather than being copied.
+
+    The batches are prefetched in the order in which they are
+    delivered. In order to visit the batches in random order,
+    use shuffle=True rather than shuffling on the Keras side,
+    e.g. Janggu.fit(pseq, shuffle=False).
+    If the batches are nevertheless requested out of order,
+    each batch is still assembled only once per epoch, but it
+    may not have been prefetched when it is requested.
+
+    Parameters
+    ----------
+    sequence : :class:`JangguSequence`
+        Sequence to prefetch batches from.
+    workers : int
+        Number of workers. Default: 2.
+    queue_size : int
+        Number of batches that are prefetched. Default: 4.
+    use_multiprocessing : boolean
+        Whether to use worker processes rather than threads. Default: False.
+    shuffle : boolean
+        Whether to deliver the batches in a random order,
+        which is drawn anew for each epoch. Default: False.
+
+    Examples
+    --------
+    .. code-block:: python
+
+      jseq = PrefetchSequence(JangguSequence(32, inputs, outputs),
+                              workers=4, queue_size=8, shuffle=True)
+      model.fit(jseq, epochs=10, shuffle=False)
+    """
+    def __init__(self, sequence, workers=2, queue_size=4,
+                 use_multiprocessing=False, shuffle=False):
+        if workers < 1:
+            raise ValueError('workers must be a positive integer.')
+        if queue_size < 1:
+            raise ValueError('queue_size must be a positive integer.')
+        self.sequence = sequence
+        self.workers = workers
+        self.queue_size = queue_size
+        self.use_multiprocessing = use_multiprocessing
+        self.shuffle = shuffle
+        self._pool = None
+        self._pending = {}
+        # batches that were requested in the current epoch
+        self._requested = set()
+        self._order = numpy.random.permutation(len(sequence)) \
+            if shuffle else None
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getattr__(self, name):
+        # expose the attributes of the wrapped sequence,
+        # e.g. inputs and outputs.
+        if name.startswith('_') or name == 'sequence':
+            raise AttributeError(name)
+        return getattr(self.sequence, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_pending'] = {}
+        state['_requested'] = set()
+        return state
+
+    def _submit(self, idx):
+        """Schedules the assembly of a batch."""
+        if self._order is not None:
+            idx = self._order[idx]
+        idxs = self.sequence._batch_indices(idx)  # pylint: disable=protected-access
+        if self.use_multiprocessing:
+            return self._pool.apply_async(_prefetch_batch, (idxs,))
+        return self._pool.apply_async(
+            self.sequence._getbatch, (idxs,))  # pylint: disable=protected-access
+
+    def __getitem__(self, idx):
+        if self._pool is None:
+            if self.use_multiprocessing:
+                self._pool = Pool(self.workers, _init_prefetch_worker,
+                                  (self.sequence,))
+            else:
+                self._pool = ThreadPool(self.workers)
+
+        self._requested.add(idx)
+        result = self._pending.pop(idx, None)
+        if result is None:
+            result = self._submit(idx)
+
+        # schedule the upcoming batches. Pending batches are kept
+        # until they are requested, such that no batch is assembled twice.
+        for i in range(idx + 1, len(self)):
+            if len(self._pending) >= self.queue_size:
+                break
+            if i not in self._pending and i not in self._requested:
+                self._pending[i] = self._submit(i)
+
+        return result.get()
+
+    def on_epoch_end(self):
+        """Stuff to do after epoch end."""
+        # the batches change if the sequence is shuffled
+        self._pending = {}
+        self._requested = set()
+        self.sequence.on_epoch_end()
+        if self.shuffle:
+            self._order = numpy.random.permutation(len(self))
+
+    def close(self):
+        """Shuts down the workers."""
+        if self.__dict__.get('_pool') is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._pending = {}
+
+    def __del__(self):
+        self.close()
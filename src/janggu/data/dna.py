@@ -2,15 +2,22 @@
 
 import Bio
 import numpy as np
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 from HTSeq import GenomicInterval
 
 from janggu.data.data import Dataset
 from janggu.data.genomic_indexer import GenomicIndexer
+from janggu.data.genomicarray import FastaGenomicArray
+from janggu.data.genomicarray import PackedGenomicArray
 from janggu.data.genomicarray import create_genomic_array
+from janggu.utils import IndexedFasta
 from janggu.utils import _complement_index
 from janggu.utils import _iv_to_str
 from janggu.utils import _str_to_iv
 from janggu.utils import as_onehot
+from janggu.utils import kmer_index
 from janggu.utils import seq2ind
 from janggu.utils import sequence_padding
 from janggu.utils import sequences_from_fasta
@@ -47,15 +54,14 @@ class SeqLoader:
                 interval = GenomicInterval(*_str_to_iv(seq.id,
                                                        template_extension=0))
 
-            indarray = np.asarray(seq2ind(seq), dtype=dtype)
+            indarray = seq2ind(seq)
 
             if order > 1:
                 # for higher order motifs, this part is used
-                filter_ = np.asarray([pow(len(seq.seq.alphabet.letters),
-                                          i) for i in range(order)])
-                indarray = np.convolve(indarray, filter_, mode='valid')
+                indarray = kmer_index(indarray, order,
+                                      len(seq.seq.alphabet.letters))
 
-            garray[interval, 0] = indarray.reshape(-1, 1)
+            garray[interval, 0] = indarray.astype(dtype).reshape(-1, 1)
 
 class Bioseq(Dataset):
     """Bioseq class.
@@ -75,6 +81,9 @@ class Bioseq(Dataset):
         genomic coordinate. Can be None, if the Dataset is only loaded.
     alphabetsize : int
         Alphabetsize of the sequence.
+    batch_dtype : str
+        Datatype of the returned one-hot encoded batches,
+        e.g. 'int8', 'float32' or 'float16'. Default: 'int8'.
     """
 
     _order = None
@@ -82,14 +91,18 @@ class Bioseq(Dataset):
     _flank = None
     _gindexer = None
 
-    def __init__(self, name, garray, gindexer, alphabetsize, channel_last):
+    def __init__(self, name, garray, gindexer, alphabetsize, channel_last,
+                 batch_dtype='int8'):
 
         self.garray = garray
         self.gindexer = gindexer
         self._alphabetsize = alphabetsize
-        self._rcindex = [_complement_index(idx, garray.order)
-                         for idx in range(pow(alphabetsize, garray.order))]
+        # lookup table for the reverse complement of each k-mer index
+        self._rcindex = _complement_index(
+            np.arange(pow(alphabetsize, garray.order)),
+            garray.order).astype('int16')
         self._channel_last = channel_last
+        self.batch_dtype = batch_dtype
 
         Dataset.__init__(self, '{}'.format(name))
 
@@ -120,6 +133,12 @@ class Bioseq(Dataset):
         datatags = [name] + datatags if datatags else [name]
         datatags += ['order{}'.format(order)]
 
+        if storage == 'packed':
+            return PackedGenomicArray(seqs, order=order,
+                                      datatags=datatags + ['packed'],
+                                      store_whole_genome=store_whole_genome,
+                                      cache=cache, overwrite=overwrite)
+
         garray = create_genomic_array(chromlens, stranded=False,
                                       storage=storage,
                                       datatags=datatags,
@@ -143,7 +162,8 @@ class Bioseq(Dataset):
                               cache=False,
                               overwrite=False,
                               channel_last=True,
-                              store_whole_genome=False):
+                              store_whole_genome=False,
+                              batch_dtype='int8'):
         """Create a Bioseq class from a reference genome.
 
         This constructor loads nucleotide sequences from a reference genome.
@@ -180,8 +200,13 @@ class Bioseq(Dataset):
         order : int
             Order for the one-hot representation. Default: 1.
         storage : str
-            Storage mode for storing the sequence may be 'ndarray', 'hdf5' or
-            'sparse'. Default: 'hdf5'.
+            Storage mode for storing the sequence may be 'ndarray', 'hdf5',
+            'memmap', 'sparse', 'packed' or 'fasta'.
+            'packed' stores the nucleotides with 2 bits per base.
+            With 'fasta', nothing is loaded
+            upfront. Instead, the sequences are read on demand
+            from the indexed FASTA file. This requires refgenome to be
+            a FASTA filename. Default: 'hdf5'.
         datatags : list(str) or None
             List of datatags. Together with the dataset name,
             the datatags are used to construct a cache file.
@@ -195,6 +220,9 @@ class Bioseq(Dataset):
             Indicates whether the whole genome or only ROI
             should be loaded. If False, a bed-file with regions of interest
             must be specified. Default: False.
+        batch_dtype : str
+            Datatype of the returned one-hot encoded batches,
+            e.g. 'int8', 'float32' or 'float16'. Default: 'int8'.
         """
         # fill up int8 rep of DNA
         # load bioseq, region index, and within region index
@@ -209,27 +237,46 @@ class Bioseq(Dataset):
         if not store_whole_genome and gindexer is None:
             raise ValueError('Either roi must be supplied or store_whole_genome must be True')
 
-        if isinstance(refgenome, str):
-            seqs = sequences_from_fasta(refgenome, 'dna')
-        else:
-            # This is already a list of SeqRecords
-            seqs = refgenome
+        if storage == 'fasta':
+            if not isinstance(refgenome, str):
+                raise ValueError("storage='fasta' requires refgenome to be "
+                                 "a FASTA filename.")
+            return cls(name, FastaGenomicArray(refgenome, order), gindexer,
+                       alphabetsize=len(IUPAC.unambiguous_dna.letters),
+                       channel_last=channel_last,
+                       batch_dtype=batch_dtype)
 
         if not store_whole_genome and gindexer is not None:
             # the genome is loaded with a bed file,
             # only the specific subset is loaded
             # to keep the memory overhead low.
             # Otherwise the entire reference genome is loaded.
-            rgen = {seq.id: seq for seq in seqs}
-            subseqs = []
+            if isinstance(refgenome, str):
+                # read only the required regions from the indexed fasta file
+                fasta = IndexedFasta(refgenome)
+
+                def fetch(giv):
+                    return SeqRecord(Seq(fasta.fetch(giv.chrom, giv.start, giv.end),
+                                         IUPAC.unambiguous_dna))
+            else:
+                rgen = {seq.id: seq for seq in refgenome}
+
+                def fetch(giv):
+                    return rgen[giv.chrom][giv.start:(giv.end)]
+
+            seqs = []
             for giv in gindexer:
-                subseq = rgen[giv.chrom][giv.start:(giv.end)]
+                subseq = fetch(giv)
                 subseq.id = _iv_to_str(giv.chrom, giv.start, giv.end - order + 1)
                 subseq.name = subseq.id
                 subseq.description = subseq.id
 
-                subseqs.append(subseq)
-            seqs = subseqs
+                seqs.append(subseq)
+        elif isinstance(refgenome, str):
+            seqs = sequences_from_fasta(refgenome, 'dna')
+        else:
+            # This is already a list of SeqRecords
+            seqs = refgenome
 
         garray = cls._make_genomic_array(name, seqs, order, storage,
                                          datatags=datatags,
@@ -239,7 +286,8 @@ class Bioseq(Dataset):
 
         return cls(name, garray, gindexer,
                    alphabetsize=len(seqs[0].seq.alphabet.letters),
-                   channel_last=channel_last)
+                   channel_last=channel_last,
+                   batch_dtype=batch_dtype)
 
     @classmethod
     def create_from_seq(cls, name,  # pylint: disable=too-many-locals
@@ -251,7 +299,9 @@ class Bioseq(Dataset):
                         datatags=None,
                         cache=False,
                         channel_last=True,
-                        overwrite=False):
+                        overwrite=False,
+                        variable_length=False,
+                        batch_dtype='int8'):
         """Create a Bioseq class from a biological sequences.
 
         This constructor loads a set of nucleotide or amino acid sequences.
@@ -277,8 +327,10 @@ class Bioseq(Dataset):
             are already of equal length. An exception is raised if this is
             not the case. Default: None.
         storage : str
-            Storage mode for storing the sequence may be 'ndarray', 'hdf5' or
-            'sparse'. Default: 'ndarray'.
+            Storage mode for storing the sequence may be 'ndarray', 'hdf5',
+            'memmap', 'sparse' or 'packed'.
+            'packed' stores nucleotides with 2 bits per base and is
+            not available for protein sequences. Default: 'ndarray'.
         datatags : list(str) or None
             List of datatags. Together with the dataset name,
             the datatags are used to construct a cache file.
@@ -288,6 +340,16 @@ class Bioseq(Dataset):
             Indicates whether to cache the dataset. Default: False.
         overwrite : boolean
             Overwrite the cachefiles. Default: False.
+        variable_length : boolean
+            Allows sequences of variable length. The shape of the dataset
+            is determined by the longest sequence and shorter sequences are
+            zero-padded. This can be used in conjunction with
+            :code:`JangguSequence(..., bucket_by_length=True)`,
+            which pads each batch only to its longest sequence.
+            Default: False.
+        batch_dtype : str
+            Datatype of the returned one-hot encoded batches,
+            e.g. 'int8', 'float32' or 'float16'. Default: 'int8'.
         """
         seqs = []
         if isinstance(fastafile, str):
@@ -307,8 +369,8 @@ class Bioseq(Dataset):
 
         # Check if sequences are equally long
         lens = [len(seq) for seq in seqs]
-        assert lens == [len(seqs[0])] * len(seqs), "Input sequences must " + \
-            "be of equal length."
+        assert variable_length or lens == [len(seqs[0])] * len(seqs), \
+            "Input sequences must be of equal length."
 
         # Chromnames are required to be Unique
         chroms = [seq.id for seq in seqs]
@@ -320,7 +382,7 @@ class Bioseq(Dataset):
                                          overwrite=overwrite,
                                          store_whole_genome=True)
 
-        reglen = lens[0]
+        reglen = max(lens)
         flank = 0
         stepsize = 1
 
@@ -330,11 +392,12 @@ class Bioseq(Dataset):
         gindexer.chrs = chroms
         gindexer.starts = [0]*len(lens)
         gindexer.strand = ['.']*len(lens)
-        gindexer.ends = [reglen + 2*flank]*len(lens)
+        gindexer.ends = [length + 2*flank for length in lens]
 
         return cls(name, garray, gindexer,
                    alphabetsize=len(seqs[0].seq.alphabet.letters),
-                   channel_last=channel_last)
+                   channel_last=channel_last,
+                   batch_dtype=batch_dtype)
 
     def __repr__(self):  # pragma: no cover
         return 'Bioseq("{}")'.format(self.name,)
@@ -355,7 +418,7 @@ class Bioseq(Dataset):
 
         self._gindexer = gindexer
 
-    def iseq4idx(self, idxs):
+    def iseq4idx(self, idxs, length=None):
         """Extracts the Bioseq sequence for set of indices.
 
         This method gets as input a list of indices (e.g.
@@ -366,6 +429,10 @@ class Bioseq(Dataset):
         ----------
         idxs : list(int)
             List of region indexes
+        length : int or None
+            Length of the index sequences. Shorter sequences are padded
+            with invalid letters. Default: None means
+            `sequence_length + 2*flank - order + 1`.
 
         Returns
         -------
@@ -374,30 +441,55 @@ class Bioseq(Dataset):
             with shape `(len(idxs), sequence_length + 2*flank - order + 1)`
         """
 
-        # for each index read use the adaptor indices to retrieve the seq.
-        iseq = np.zeros((len(idxs), self.gindexer.binsize +
-                         2*self.gindexer.flank - self.garray.order + 1),
-                        dtype="int16")
+        if length is None:
+            length = self.gindexer.binsize + \
+                2*self.gindexer.flank - self.garray.order + 1
+        iseq = np.zeros((len(idxs), length, 1, 1), dtype="int16")
 
-        for i, idx in enumerate(idxs):
-            interval = self.gindexer[idx]
+        # fetch the windows of the entire batch at once.
+        # minus strand windows are returned in reverse order
+        # and only need to be complemented.
+        chroms, starts, ends, strands = self.gindexer.get_batch(idxs)
+        ends = ends - self.garray.order + 1
+        self.garray.fill_batch(chroms, starts, ends, strands, out=iseq)
+        iseq = iseq[:, :, 0, 0]
 
-            dat = self._getsingleitem(interval)
+        # positions beyond the end of shorter sequences
+        # are marked as invalid letters.
+        iseq[np.arange(length) >= (ends - starts)[:, None]] = -1024
 
-            iseq[i, :len(dat)] = dat
+        reverse = strands == '-'
+        if reverse.any():
+            iseq[reverse] = self._complement(iseq[reverse])
 
         return iseq
 
+    def _complement(self, iseq):
+        """Complements index sequences.
+
+        Invalid letters (e.g. N), represented by negative indices,
+        are left unchanged.
+        """
+        valid = iseq >= 0
+        return np.where(valid, self._rcindex.take(np.where(valid, iseq, 0)),
+                        iseq)
+
+    def _reverse_complement(self, iseq):
+        """Reverse complements index sequences along the last axis."""
+        return self._complement(iseq)[..., ::-1]
+
     def _getsingleitem(self, interval):
-        interval.end += - self.garray.order + 1
+        interval = GenomicInterval(interval.chrom, interval.start,
+                                   interval.end - self.garray.order + 1,
+                                   interval.strand)
 
         # Computing the forward or reverse complement of the
         # sequence, depending on the strand flag.
         if interval.strand in ['.', '+']:
             return np.asarray(self.garray[interval][:, 0, 0])
 
-        return np.asarray([self._rcindex[val] for val
-                           in self.garray[interval][:, 0, 0]])[::-1]
+        return self._reverse_complement(
+            np.asarray(self.garray[interval][:, 0, 0]))
 
 
     def __getitem__(self, idxs):
@@ -438,8 +530,30 @@ class Bioseq(Dataset):
             raise IndexError('Bioseq.__getitem__: '
                              + 'index must be iterable')
 
-        data = as_onehot(self.iseq4idx(idxs), self.garray.order,
-                         self._alphabetsize)
+        return self.get_batch(idxs)
+
+    def get_batch(self, idxs, length=None, out=None):
+        """Returns the one-hot encoded sequences for a set of indices.
+
+        Parameters
+        ----------
+        idxs : list(int)
+            List of region indexes.
+        length : int or None
+            Sequence length of the batch. Shorter sequences are zero-padded.
+            Default: None means the sequence length of the dataset is used.
+        out : numpy.array or None
+            Optional output buffer with the shape given by
+            :code:`_batch_shape(len(idxs), length)`.
+            Default: None means a new array is allocated.
+
+        Returns
+        -------
+        numpy.array
+            One-hot encoded sequences.
+        """
+        data = as_onehot(self.iseq4idx(idxs, length), self.garray.order,
+                         self._alphabetsize, out=out, dtype=self.batch_dtype)
 
         for transform in self.transformations:
             data = transform(data)
@@ -449,9 +563,22 @@ class Bioseq(Dataset):
 
         return data
 
+    def _batch_shape(self, size, length=None):
+        """Shape of a batch before the channel axis is moved."""
+        if length is None:
+            length = self.gindexer.binsize + \
+                2*self.gindexer.flank - self.garray.order + 1
+        return (size, length, 1, pow(self._alphabetsize, self.garray.order))
+
     def __len__(self):
         return len(self.gindexer)
 
+    @property
+    def sequence_lengths(self):
+        """Sequence lengths of the regions in the index representation."""
+        return np.maximum(self.gindexer.get_lengths() -
+                          self.garray.order + 1, 0)
+
     @property
     def shape(self):
         """Shape of the dataset"""
@@ -6,26 +6,70 @@ from HTSeq import GenomicInterval
 from janggu.utils import _get_genomic_reader
 
 
+def _tile_region(start, end, binsize, stepsize, zero_padding):
+    """Determines the tiling of a region.
+
+    Returns
+    -------
+    tuple(int)
+        Start of the first bin, the number of bins and whether
+        the last bin is a variable length fragment.
+    """
+    if stepsize <= binsize:
+        val = (end - start - binsize + stepsize)
+    else:
+        val = (end - start)
+
+    reglen = val // stepsize
+    nbins = max(reglen, 0)
+    # if there is a variable length fragment at the end,
+    # we record the remaining fragment length
+    fragment = bool(zero_padding and val % stepsize > 0)
+    if fragment:
+        nbins += 1
+    return start + stepsize * min(reglen, 0), nbins, fragment
+
+
+def _expand_ranges(firsts, counts):
+    """Concatenates the index ranges [first, first + count)."""
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(firsts - offsets, counts) + \
+        np.arange(counts.sum(), dtype='int64')
+
+
 class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
     """GenomicIndexer maps a set of integer indices to respective
     genomic intervals.
 
     The genomic intervals can be directly used to obtain data from a genomic
     array.
+
+    Internally, the intervals are stored column-wise as numpy arrays,
+    with the chromosome names encoded as categorical integer codes.
+    Region queries are answered by binary search
+    on the per-chromosome sorted interval starts.
+
+    In lazy mode, only the tiling of each input region is kept,
+    and the intervals are computed arithmetically on demand.
+    This avoids materializing the intervals, e.g. when
+    tiling the entire genome.
     """
 
     _stepsize = None
     _binsize = None
     _flank = None
-    chrs = None
-    starts = None
-    strand = None
-    ends = None
+    _chrom_names = None
+    _chrom_codes = None
+    _starts = None
+    _ends = None
+    _strand = None
+    _index = None
+    _regions = None
 
     @classmethod
     def create_from_file(cls, regions,  # pylint: disable=too-many-locals
                          binsize, stepsize, flank=0,
-                         zero_padding=True, collapse=False):
+                         zero_padding=True, collapse=False, lazy=False):
         """Creates a GenomicIndexer object.
 
         This method constructs a GenomicIndexer from
@@ -56,6 +100,14 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
             In this case, zero_padding does not have an effect. Intervals
             may be of fixed or variable lengths.
             Default: False.
+        lazy : boolean
+            Indicates whether the intervals are computed on demand
+            from the region tiling rather than being materialized.
+            This reduces memory consumption and startup time
+            for genome-wide tiling. Note that the :code:`create_from_*`
+            constructors of Cover and Bioseq always use eager indexers.
+            A lazy indexer can be passed to the Cover or Bioseq
+            constructor directly instead. Default: False.
         """
 
         regions_ = _get_genomic_reader(regions)
@@ -78,29 +130,41 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
 
         gind = cls(binsize, stepsize, flank)
 
-        gind.chrs = []
-        gind.starts = []
-        gind.strand = []
-        gind.ends = []
+        chrs = []
+        firsts = []
+        nbins = []
+        ends = []
+        binsizes = []
+        strands = []
+        fragments = []
 
         for reg in regions_:
-
-            tmp_gidx = cls.create_from_region(
-                reg.iv.chrom,
-                reg.iv.start, reg.iv.end, reg.iv.strand,
-                binsize, stepsize, flank, zero_padding)
-
-            gind.chrs += tmp_gidx.chrs
-            gind.starts += tmp_gidx.starts
-            gind.strand += tmp_gidx.strand
-            gind.ends += tmp_gidx.ends
+            # with collapse=True, each region is represented by a single bin
+            regbinsize = reg.iv.length if binsize is None else binsize
+            first, nbin, fragment = _tile_region(reg.iv.start, reg.iv.end,
+                                                 regbinsize, stepsize,
+                                                 zero_padding)
+
+            chrs.append(reg.iv.chrom)
+            firsts.append(first)
+            nbins.append(nbin)
+            ends.append(reg.iv.end)
+            binsizes.append(regbinsize)
+            strands.append(reg.iv.strand)
+            fragments.append(fragment)
+
+        gind._set_regions(chrs, firsts, nbins, ends, binsizes, strands,
+                          fragments)
+
+        if not lazy:
+            gind._materialize()
 
         return gind
 
     @classmethod
     def create_from_region(cls, chrom, start, end, strand,
                            binsize, stepsize, flank=0,
-                           zero_padding=True):
+                           zero_padding=True, lazy=False):
         """Creates a GenomicIndexer object.
 
         This method constructs a GenomicIndexer from
@@ -129,6 +193,10 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
             lengths are used in conjunction with zero-padding.
             If zero_padding is True, a binsize must be specified.
             Default: True.
+        lazy : boolean
+            Indicates whether the intervals are computed on demand
+            from the region tiling rather than being materialized.
+            Default: False.
         """
 
         if binsize is None:
@@ -139,29 +207,14 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
 
         gind = cls(binsize, stepsize, flank)
 
-        if stepsize <= binsize:
-            val = (end - start - binsize + stepsize)
-        else:
-            val = (end - start)
-
-        reglen = val // stepsize
-        chrs = [chrom] * reglen
-        starts = [x for x in range(start, start+(stepsize*reglen), stepsize)]
-
-        ends = [x + binsize for x in starts]
-        strands = [strand] * reglen
-        # if there is a variable length fragment at the end,
-        # we record the remaining fragment length
-        if zero_padding and val % stepsize > 0:
-            chrs += [chrom]
-            starts += [start+(stepsize*reglen)]
-            ends += [end]
-            strands += [strand]
-
-        gind.chrs = chrs
-        gind.starts = starts
-        gind.strand = strands
-        gind.ends = ends
+        first, nbin, fragment = _tile_region(start, end, binsize, stepsize,
+                                             zero_padding)
+        gind._set_regions([chrom], [first], [nbin], [end], [binsize], [strand],
+                          [fragment])
+
+        if not lazy:
+            gind._materialize()
+
         return gind
 
     def __init__(self, binsize, stepsize, flank=0):
@@ -170,8 +223,15 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
         self.stepsize = stepsize
         self.flank = flank
 
+        self.chrs = []
+        self.starts = []
+        self.strand = []
+        self.ends = []
+
     def __len__(self):
-        return len(self.chrs)
+        if self._regions is not None:
+            return int(self._regions['offsets'][-1])
+        return len(self._starts)
 
     def __repr__(self):  # pragma: no cover
         return "GenomicIndexer(<regions>, " \
@@ -180,17 +240,187 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
                                                           self.flank)
 
     def __getitem__(self, index):
-        if isinstance(index, int):
-            start = self.starts[index]
-            end = self.ends[index]
+        if isinstance(index, (int, np.integer)):
+            if self._regions is not None:
+                if index < 0:
+                    index += len(self)
+                if not 0 <= index < len(self):
+                    raise IndexError('GenomicIndexer index out of range')
+
+            codes, starts, ends, strands = self._coords(np.asarray([index]))
+            start = int(starts[0])
+            end = int(ends[0])
             if end == start:
                 end += 1
-            return GenomicInterval(self.chrs[index], start - self.flank,
-                                   end + self.flank, self.strand[index])
+            return GenomicInterval(str(self._chrom_names[codes[0]]),
+                                   start - self.flank,
+                                   end + self.flank, str(strands[0]))
 
         raise IndexError('Index support only for "int". Given {}'.format(
             type(index)))
 
+    def get_batch(self, idxs):
+        """Returns the genomic coordinates for a set of indices.
+
+        In contrast to :code:`__getitem__`, which constructs one
+        GenomicInterval per index, the coordinates of all
+        requested regions are returned as arrays which allows
+        to fetch entire batches from a genomic array at once.
+        As for :code:`__getitem__`, the flank is already
+        attached to the start and end positions.
+
+        Parameters
+        ----------
+        idxs : list(int)
+            List of region indexes.
+
+        Returns
+        -------
+        tuple(numpy.array)
+            Chromosome names, starts, ends and strands of the regions.
+        """
+        idxs = np.asarray(idxs, dtype='int64')
+        if self._regions is not None:
+            idxs = np.where(idxs < 0, idxs + len(self), idxs)
+            if np.any((idxs < 0) | (idxs >= len(self))):
+                raise IndexError('GenomicIndexer index out of range')
+        codes, starts, ends, strands = self._coords(idxs)
+        ends = ends.copy()
+
+        # zero-length regions are extended by one position as in __getitem__
+        ends[ends == starts] += 1
+
+        return (self._chrom_names[codes], starts - self.flank,
+                ends + self.flank, strands)
+
+    def get_lengths(self, idxs=None):
+        """Returns the interval lengths for a set of indices.
+
+        As for :code:`get_batch`, the lengths include the flanks.
+
+        Parameters
+        ----------
+        idxs : list(int) or None
+            List of region indexes. Default: None means
+            the lengths of all intervals are returned.
+
+        Returns
+        -------
+        numpy.array
+            Interval lengths.
+        """
+        if idxs is None:
+            idxs = np.arange(len(self))
+        _, starts, ends, _ = self.get_batch(idxs)
+        return ends - starts
+
+    def _set_regions(self, chrs, firsts, nbins,  # pylint: disable=too-many-arguments
+                     ends, binsizes, strands, fragments):
+        """Sets up the lazy representation from the region tiling."""
+        names, codes = np.unique(np.asarray(chrs, dtype=str),
+                                 return_inverse=True)
+        nbins = np.asarray(nbins, dtype='int64')
+
+        self._chrom_names = names
+        self._regions = {'codes': codes.astype('int32'),
+                         'firsts': np.asarray(firsts, dtype='int64'),
+                         'nbins': nbins,
+                         'ends': np.asarray(ends, dtype='int64'),
+                         'binsizes': np.asarray(binsizes, dtype='int64'),
+                         'strand': np.asarray(strands, dtype=str),
+                         # whether the last bin is a variable length fragment
+                         'fragments': np.asarray(fragments, dtype=bool),
+                         # cumulative number of bins for the region lookup
+                         'offsets': np.concatenate([[0], np.cumsum(nbins)])}
+        self._index = None
+
+    def _coords(self, idxs):
+        """Chromosome codes, starts, ends and strands for a set of indices."""
+        if self._regions is None:
+            return (self._chrom_codes[idxs], self._starts[idxs],
+                    self._ends[idxs], self._strand[idxs])
+
+        regions = self._regions
+        ridx = np.searchsorted(regions['offsets'], idxs, side='right') - 1
+        starts = regions['firsts'][ridx] + \
+            (idxs - regions['offsets'][ridx]) * self.stepsize
+        # the variable length fragment at the end
+        # of a region extends to the region end
+        last = regions['fragments'][ridx] & \
+            (idxs == regions['offsets'][ridx + 1] - 1)
+        ends = np.where(last, regions['ends'][ridx],
+                        starts + regions['binsizes'][ridx])
+        return regions['codes'][ridx], starts, ends, regions['strand'][ridx]
+
+    def _columns(self):
+        """Chromosome codes, starts, ends and strands of all intervals."""
+        if self._regions is not None:
+            return self._coords(np.arange(len(self)))
+        return self._chrom_codes, self._starts, self._ends, self._strand
+
+    def _materialize(self):
+        """Expands the lazy representation to interval arrays."""
+        if self._regions is None:
+            return
+        codes, starts, ends, strands = self._coords(np.arange(len(self)))
+        self._regions = None
+        self._chrom_codes = codes
+        self._starts = starts
+        self._ends = ends
+        self._strand = strands
+        self._index = None
+
+    @property
+    def chrs(self):
+        """Chromosome names of the intervals
+
+        In lazy mode, the names are computed on each access,
+        without materializing the indexer.
+        """
+        return self._chrom_names[self._columns()[0]]
+
+    @chrs.setter
+    def chrs(self, value):
+        self._materialize()
+        # store the chromosome names as categorical codes
+        names, codes = np.unique(np.asarray(value, dtype=str),
+                                 return_inverse=True)
+        self._chrom_names = names
+        self._chrom_codes = codes.astype('int32')
+        self._index = None
+
+    @property
+    def starts(self):
+        """Interval starts"""
+        return self._columns()[1]
+
+    @starts.setter
+    def starts(self, value):
+        self._materialize()
+        self._starts = np.asarray(value, dtype='int64')
+        self._index = None
+
+    @property
+    def ends(self):
+        """Interval ends"""
+        return self._columns()[2]
+
+    @ends.setter
+    def ends(self, value):
+        self._materialize()
+        self._ends = np.asarray(value, dtype='int64')
+        self._index = None
+
+    @property
+    def strand(self):
+        """Interval strands"""
+        return self._columns()[3]
+
+    @strand.setter
+    def strand(self, value):
+        self._materialize()
+        self._strand = np.asarray(value, dtype=str)
+
     @property
     def binsize(self):
         """binsize of the intervals"""
@@ -228,14 +458,99 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
         """Returns representing the region."""
         return ['{}:{}-{}'.format(iv.chrom, iv.start, iv.end) for iv in self]
 
+    def _region_index(self):
+        """Per-chromosome sorted interval starts.
+
+        The index is constructed lazily and reused for
+        subsequent region queries.
+        """
+        if self._index is None:
+            order = np.lexsort((self._starts, self._chrom_codes))
+            offsets = np.searchsorted(self._chrom_codes[order],
+                                      np.arange(len(self._chrom_names) + 1))
+            # the maximum interval length per chromosome bounds the search
+            # range for intervals that overlap with a query start.
+            maxlen = np.zeros(len(self._chrom_names), dtype='int64')
+            np.maximum.at(maxlen, self._chrom_codes, self._ends - self._starts)
+            self._index = (order, self._starts[order], offsets, maxlen)
+        return self._index
+
+    def _query(self, code, start, end):
+        """Indices of the intervals on a chromosome overlapping start and end."""
+        if self._regions is not None:
+            return self._query_regions(code, start, end)
+
+        order, sorted_starts, offsets, maxlen = self._region_index()
+        first, last = offsets[code], offsets[code + 1]
+
+        if end is not None:
+            last = first + np.searchsorted(sorted_starts[first:last],
+                                           end + self.flank, side='left')
+        if start is not None:
+            first = first + np.searchsorted(sorted_starts[first:last],
+                                            start - self.flank - maxlen[code],
+                                            side='right')
+        idxs = order[first:last]
+        if start is not None:
+            idxs = idxs[(self._ends[idxs] + self.flank) > start]
+        return idxs
+
+    def _query_regions(self, code, start, end):
+        """Indices of the intervals on a chromosome overlapping start and end.
+
+        In lazy mode, the range of overlapping bins
+        is determined arithmetically for each region.
+        """
+        regions = self._regions
+        ridx = np.nonzero(regions['codes'] == code)[0]
+        firsts = regions['firsts'][ridx]
+
+        lower = np.zeros(len(ridx), dtype='int64')
+        upper = regions['nbins'][ridx]
+
+        if start is not None:
+            # first bin that ends after start
+            lower = np.maximum(lower, (start - self.flank - firsts -
+                                       regions['binsizes'][ridx]) //
+                               self.stepsize + 1)
+            # the fragment extends to the region end, which is checked below
+            lower = np.where(regions['fragments'][ridx],
+                             np.minimum(lower, upper - 1), lower)
+            upper = np.where(regions['ends'][ridx] + self.flank > start,
+                             upper, 0)
+        if end is not None:
+            # bins that start before end
+            upper = np.minimum(upper, -((firsts - end - self.flank) //
+                                        self.stepsize))
+
+        return _expand_ranges(regions['offsets'][ridx] + lower,
+                              np.maximum(upper - lower, 0))
+
+    def _chrom_selection(self, include, exclude):
+        """Codes of the included and not excluded chromosomes."""
+        if isinstance(include, str):
+            include = [include]
+
+        if isinstance(exclude, str):
+            exclude = [exclude]
+
+        if include:
+            codes = np.nonzero(np.isin(self._chrom_names, include))[0]
+        else:
+            codes = np.arange(len(self._chrom_names))
+
+        if exclude:
+            codes = codes[~np.isin(self._chrom_names[codes], exclude)]
+        return codes
+
     def idx_by_region(self, include=None, exclude=None, start=None, end=None):
 
         """idx_by_region filters for chromosome and region ids.
 
         It takes a list of chromosome ids which should be
         included or excluded, the start and the end of
-        a required interval as integers and returns a new GenomicIndexer
-        associated with the compatible intervals after filtering.
+        a required interval as integers and returns the
+        indices of the compatible intervals after filtering.
 
         Parameters
         ----------
@@ -251,43 +566,24 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
 
         Returns
         -------
-        idxs
-            Containing a list of filtered regions indexes.
+        numpy.array
+            Containing the sorted filtered region indexes.
         """
 
-        if isinstance(include, str):
-            include = [include]
-
-        if isinstance(exclude, str):
-            exclude = [exclude]
+        codes = self._chrom_selection(include, exclude)
 
-        if not include:
-            idxs = set(range(len(self)))
-        else:
-            idxs = set()
-            for inc in include:
-                idxs.update(np.where(np.asarray(self.chrs) == inc)[0])
+        if start is None and end is None:
+            if self._regions is not None:
+                ridx = np.isin(self._regions['codes'], codes)
+                return _expand_ranges(self._regions['offsets'][:-1][ridx],
+                                      self._regions['nbins'][ridx])
+            return np.nonzero(np.isin(self._chrom_codes, codes))[0]
 
-        if exclude:
-            for exc in exclude:
-                idxs = idxs.difference(
-                    np.where(np.asarray(self.chrs) == exc)[0])
-
-        if start is not None:
-            regionmatch = ((np.array(self.ends) + self.flank) > start)
-            indexmatch = np.where(regionmatch)[0]
-            idxs = idxs.intersection(indexmatch)
-
-        if end is not None:
-            regionmatch = ((np.array(self.starts) - self.flank) < end)
-            indexmatch = np.where(regionmatch)[0]
-            idxs = idxs.intersection(indexmatch)
-
-        idxs = list(idxs)
+        idxs = np.concatenate([self._query(code, start, end) for code in codes]
+                              + [np.zeros(0, dtype='int64')])
         idxs.sort()
         return idxs
 
-
     def filter_by_region(self, include=None, exclude=None, start=None, end=None):
 
         """filter_by_region filters for chromosome and region ids.
@@ -296,6 +592,8 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
         included or excluded, the start and the end of
         a required interval as integers and returns a new GenomicIndexer
         associated with the compatible intervals after filtering.
+        In lazy mode, filtering only by chromosome names
+        yields a lazy GenomicIndexer as well.
 
         Parameters
         ----------
@@ -314,12 +612,29 @@ class GenomicIndexer(object):  # pylint: disable=too-many-instance-attributes
         GenomicIndexer
             Containing the filtered regions.
         """
+        new_gindexer = GenomicIndexer(self.binsize, self.stepsize, self.flank)
+
+        if self._regions is not None and start is None and end is None:
+            # select the regions without expanding them
+            regions = self._regions
+            ridx = np.isin(regions['codes'],
+                           self._chrom_selection(include, exclude))
+            new_gindexer._set_regions(self._chrom_names[regions['codes'][ridx]],
+                                      regions['firsts'][ridx],
+                                      regions['nbins'][ridx],
+                                      regions['ends'][ridx],
+                                      regions['binsizes'][ridx],
+                                      regions['strand'][ridx],
+                                      regions['fragments'][ridx])
+            return new_gindexer
+
         idxs = self.idx_by_region(include=include, exclude=exclude, start=start, end=end)
         #  construct the filtered gindexer
-        new_gindexer = GenomicIndexer(self.binsize, self.stepsize, self.flank)
-        new_gindexer.chrs = [self.chrs[i] for i in idxs]
-        new_gindexer.starts = [self.starts[i] for i in idxs]
-        new_gindexer.strand = [self.strand[i] for i in idxs]
-        new_gindexer.ends = [self.ends[i] for i in idxs]
+        codes, starts, ends, strands = self._coords(idxs)
+        new_gindexer._chrom_names = self._chrom_names
+        new_gindexer._chrom_codes = codes
+        new_gindexer.starts = starts
+        new_gindexer.strand = strands
+        new_gindexer.ends = ends
 
         return new_gindexer
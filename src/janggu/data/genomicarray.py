@@ -1,15 +1,27 @@
 """Genomic arrays"""
 
+import json
 import os
+from multiprocessing.pool import ThreadPool
 
 import h5py
 import numpy as np
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
 from HTSeq import GenomicInterval
 from scipy import sparse
 
+from janggu.utils import IndexedFasta
 from janggu.utils import _get_output_data_location
 from janggu.utils import _iv_to_str
 from janggu.utils import _str_to_iv
+from janggu.utils import kmer_index
+from janggu.utils import seq2ind
+
+try:
+    import hdf5plugin
+except ImportError:  # pragma: no cover
+    hdf5plugin = None
 
 
 def _get_iv_length(length, resolution):
@@ -19,23 +31,167 @@ def _get_iv_length(length, resolution):
     return int(np.ceil(float(length)/resolution))
 
 
+def _collapse_mean(values):
+    return values.mean(axis=1)
+
+
+def _collapse_sum(values):
+    return values.sum(axis=1)
+
+
+def _collapse_max(values):
+    return values.max(axis=1)
+
+
 def get_collapser(method):
     """Get collapse method."""
 
     if method is None:
         return None
     elif isinstance(method, str):
+        # module-level functions keep the genomic array picklable
         if method == 'mean':
-            return lambda x: x.mean(axis=1)
+            return _collapse_mean
         elif method == 'sum':
-            return lambda x: x.sum(axis=1)
+            return _collapse_sum
         elif method == 'max':
-            return lambda x: x.max(axis=1)
+            return _collapse_max
     elif callable(method):
         return method
 
     raise ValueError('Unknown method: {}'.format(method))
 
+
+def _gather_windows(array, starts, lengths, reverse,  # pylint: disable=too-many-arguments
+                    length, transform=None):
+    """Gathers a set of windows from an array by fancy indexing.
+
+    The windows are given in array coordinates. Positions that reach out of
+    the array, or beyond the length of the respective window, are zero-padded.
+    Windows marked by reverse are read in reverse order with the strand
+    axis flipped.
+
+    Parameters
+    ----------
+    array : numpy.array
+        Array of shape (length, strand, condition).
+    starts : numpy.array
+        Window starts.
+    lengths : numpy.array
+        Window lengths. At most length.
+    reverse : numpy.array
+        Boolean array indicating the windows to be reversed.
+    length : int
+        Length of the gathered windows.
+    transform : callable or None
+        Function applied to the gathered windows before
+        the padding is zeroed, e.g. a lazy normalization. Default: None.
+
+    Returns
+    -------
+    numpy.array
+        Array of shape (len(starts), length, strand, condition).
+    """
+    offsets = np.arange(length)
+    pos = np.where(reverse[:, None],
+                   (starts + lengths - 1)[:, None] - offsets,
+                   starts[:, None] + offsets)
+    valid = (offsets < lengths[:, None]) & (pos >= 0) & (pos < array.shape[0])
+
+    window = array[np.clip(pos, 0, max(array.shape[0] - 1, 0))]
+    if transform is not None:
+        window = transform(window)
+    window[~valid] = 0
+    window[reverse] = window[reverse][:, :, ::-1, :]
+    return window
+
+
+def _fill_batch_vectorized(garray, chroms, starts, ends,  # pylint: disable=too-many-arguments
+                           strands, out, max_overhead=None):
+    """Fills a batch from a whole genome array by fancy indexing.
+
+    The windows of each chromosome are gathered from the block that
+    spans all of them. This requires the chromosome handles to support
+    slicing.
+    If max_overhead is given and the block exceeds max_overhead times
+    the total length of the windows, the windows of that chromosome
+    are read one by one instead. This avoids reading large unused parts
+    from disk, e.g. for HDF5 datasets.
+    """
+    # convert to array coordinates
+    starts = starts // garray.resolution
+    ends = -(-ends // garray.resolution)
+    lengths = np.minimum(ends - starts, out.shape[1])
+    reverse = strands == '-'
+
+    for chrom in np.unique(chroms):
+        sel = np.nonzero(chroms == chrom)[0]
+        handle = garray.handle[chrom]
+
+        first = max(starts[sel].min(), 0)
+        last = min((starts[sel] + lengths[sel]).max(), handle.shape[0])
+        if max_overhead is None or \
+                last - first <= max_overhead * lengths[sel].sum():
+            groups = [sel]
+        else:
+            groups = [sel[i:(i + 1)] for i in range(len(sel))]
+
+        for group in groups:
+            first = max(starts[group].min(), 0)
+            last = max(min((starts[group] + lengths[group]).max(),
+                           handle.shape[0]), first)
+            if last == first:
+                # the windows do not overlap with the chromosome
+                out[group] = 0
+                continue
+            # the lazy normalization is only applied to the gathered
+            # windows rather than to the entire block.
+            out[group] = _gather_windows(
+                np.asarray(handle[first:last]), starts[group] - first,
+                lengths[group], reverse[group], out.shape[1],
+                lambda window, chrom=chrom: garray._normalized(window, chrom))  # pylint: disable=protected-access
+    return out
+
+
+def _merge_moments(first, second):
+    """Merges the moments of two partitions of the data.
+
+    The moments are given as (weight, mean, m2), where m2 is the
+    weighted sum of squared deviations from the mean. They are
+    combined using the parallel algorithm of Chan et al.
+    """
+    weight = first[0] + second[0]
+    if weight == 0:
+        return first
+    delta = second[1] - first[1]
+    return (weight, first[1] + delta * second[0] / weight,
+            first[2] + second[2] + np.square(delta) * first[0] * second[0] / weight)
+
+
+def _weighted_moments(garray, moments):
+    """Merges the moments of all regions weighted by the region lengths.
+
+    Parameters
+    ----------
+    garray : GenomicArray
+        Genomic array.
+    moments : dict
+        Moments per region as returned by :code:`GenomicArray.moments`.
+
+    Returns
+    -------
+    tuple
+        Total weight, weighted mean and weighted sum
+        of squared deviations per condition.
+    """
+    total = (0, np.zeros(len(garray.condition)), np.zeros(len(garray.condition)))
+    for chrom in moments:
+        count, mean, m2 = moments[chrom]
+        length = garray._interval_length(chrom)  # pylint: disable=protected-access
+        total = _merge_moments(total, (count * length, mean, m2 * length))
+    return total
+
+
 class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
     """GenomicArray stores multi-dimensional genomic information.
 
@@ -64,14 +220,27 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
         Order of the alphabet size. Only relevant for Bioseq Datasets. Default: 1.
     collapser : None or callable
         Method to aggregate values along a given interval.
+    num_threads : int
+        Number of threads used for computing statistics and for
+        normalizing the array. Each chromosome (or region) is
+        processed as a separate job. Default: 1.
     """
     handle = dict()
     _condition = None
     _resolution = None
     _order = None
+    # transformation, shift and scale of a lazy normalizer
+    # that is applied when fetching the data.
+    _normalization = None
+    # number of positions that are processed at once
+    # when computing statistics or normalizing the array.
+    _chunk_length = 1 << 20
+    # whether the chromosomes can be processed by a pool of threads.
+    _threadsafe = True
 
     def __init__(self, stranded=True, conditions=None, typecode='d',
-                 resolution=1, order=1, store_whole_genome=True, collapser=None):
+                 resolution=1, order=1, store_whole_genome=True, collapser=None,
+                 num_threads=1):
         self.stranded = stranded
         if conditions is None:
             conditions = ['sample']
@@ -86,6 +255,7 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
         self.typecode = typecode
         self._full_genome_stored = store_whole_genome
         self.collapser = collapser
+        self.num_threads = num_threads
 
     def __setitem__(self, index, value):
         interval = index[0]
@@ -177,22 +347,26 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
             if not self._full_genome_stored:
                 # correcting for the overshooting starts and ends is not necessary
                 # for partially loaded data
-                return self._reshape(self.handle[_iv_to_str(chrom, interval.start,
-                                                            interval.end)][:(length)],
-                                     (length, 2 if self.stranded else 1, len(self.condition)))
+                key = _iv_to_str(chrom, interval.start, interval.end)
+                return self._normalized(
+                    self._reshape(self.handle[key][:(length)],
+                                  (length, 2 if self.stranded else 1,
+                                   len(self.condition)), key), key)
 
             if start >= 0 and end <= self.handle[chrom].shape[0]:
                 # this is a short-cut, which does not require zero-padding
-                return self._reshape(self.handle[chrom][start:end],
-                                     (end-start, 2 if self.stranded else 1,
-                                      len(self.condition)))
+                return self._normalized(
+                    self._reshape(self.handle[chrom][start:end],
+                                  (end-start, 2 if self.stranded else 1,
+                                   len(self.condition)), chrom), chrom)
 
             # below is some functionality for zero-padding, in case the region
             # reaches out of the chromosome size
 
             data = np.zeros((length, 2 if self.stranded else 1,
                              len(self.condition)),
-                            dtype=self.handle[chrom].dtype)
+                            dtype=self.handle[chrom].dtype
+                            if self._normalization is None else 'float64')
 
             dstart = 0
             dend = length
@@ -208,14 +382,45 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
 
             # dstart and dend are offset by the number of positions
             # the region reaches out of the chromosome
-            data[dstart:dend, :, :] = self._reshape(self.handle[chrom][start:end],
-                                                    (end-start,
-                                                     2 if self.stranded else 1,
-                                                     len(self.condition)))
+            data[dstart:dend, :, :] = self._normalized(
+                self._reshape(self.handle[chrom][start:end],
+                              (end-start, 2 if self.stranded else 1,
+                               len(self.condition)), chrom), chrom)
             return data
 
         raise IndexError("Index must be a GenomicInterval")
 
+    def fill_batch(self, chroms, starts, ends, strands, out):
+        """Fills a batch of genomic windows into a preallocated array.
+
+        Each window is written to the beginning of the respective
+        entry of out, the remainder is left untouched.
+        Windows on the minus strand are reversed and the
+        strand axis is flipped.
+
+        Parameters
+        ----------
+        chroms : numpy.array
+            Chromosome names.
+        starts : numpy.array
+            Window starts in base pairs.
+        ends : numpy.array
+            Window ends in base pairs.
+        strands : numpy.array
+            Window strands.
+        out : numpy.array
+            Output array of shape (len(chroms), window_length, strand, condition).
+        """
+        for i, chrom in enumerate(chroms):
+            interval = GenomicInterval(str(chrom), int(starts[i]),
+                                       int(ends[i]), str(strands[i]))
+            data = np.asarray(self[interval])
+            if interval.strand == '-':
+                data = data[::-1, ::-1, :]
+            out[i, :len(data)] = data
+
+        return out
+
     @property
     def condition(self):
         """condition"""
@@ -236,7 +441,7 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
             raise ValueError('resolution must be greater than zero')
         self._resolution = value
 
-    def _reshape(self, data, shape):
+    def _reshape(self, data, shape, chrom=None):
         # shape not necessary here,
         # data should just fall through
         return data
@@ -250,22 +455,44 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
 
         return self.resolution
 
+    def _map(self, func):
+        """Applies a function to each chromosome (or region).
+
+        If num_threads > 1, the chromosomes are processed by a pool
+        of threads, as numpy releases the GIL for the bulk of the work.
+        Storages that do not benefit from threads, e.g. hdf5,
+        process the chromosomes serially.
+        The results are returned in the order of the chromosomes
+        to merge partial results deterministically.
+        """
+        chroms = list(self.handle)
+        if not self._threadsafe or self.num_threads <= 1 or len(chroms) <= 1:
+            return [func(chrom) for chrom in chroms]
+
+        pool = ThreadPool(min(self.num_threads, len(chroms)))
+        try:
+            return pool.map(func, chroms)
+        finally:
+            pool.close()
+            pool.join()
+
     def scale_by_region_length(self):
         """ This method scales the regions by the region length ."""
-        for chrom in self.handle:
+        def _scale(chrom):
             self.handle[chrom][:] /= self._interval_length(chrom)
+        self._map(_scale)
 
     def weighted_mean(self):
         """ Base pair resolution mean weighted by interval length
         """
 
         # summing the signal
-        sums = [self.sum(chrom) * self._interval_length(chrom) \
-                for chrom in self.handle]
+        sums = self._map(lambda chrom: self.sum(chrom) *
+                         self._interval_length(chrom))
         sums = np.asarray(sums).sum(axis=0)
 
         # weights are determined by interval and chromosome length
-        weights = [np.prod(self.handle[chrom].shape[:-1]) * \
+        weights = [self._num_positions(chrom) * \
                    self._interval_length(chrom) \
                    for chrom in self.handle]
         weights = np.asarray(weights).sum()
@@ -275,14 +502,16 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
         """Centering the signal by the weighted mean"""
         #means = self.weighted_mean()
 
-        for chrom in self.handle:
+        def _shift(chrom):
             # adjust base pair resoltion mean to interval length
             self.handle[chrom][:] -= means
+        self._map(_shift)
 
     def rescale(self, scale):
         """ Method to rescale the signal """
-        for chrom in self.handle:
+        def _rescale(chrom):
             self.handle[chrom][:] /= scale
+        self._map(_rescale)
 
     def sum(self, chrom=None):
         """Sum signal across chromosomes."""
@@ -290,27 +519,183 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
             return self.handle[chrom][:]\
                 .sum(axis=tuple(range(self.handle[chrom].ndim - 1)))
 
-        return np.asarray([self.handle[chrom][:]\
-            .sum(axis=tuple(range(self.handle[chrom].ndim - 1)))
-                           for chrom in self.handle])
+        return np.asarray(self._map(self.sum))
 
     def weighted_sd(self):
         """ Interval scaled standard deviation """
 
         # summing the squared signal signal
-        sums = [np.square(self.handle[chrom][:, :, :]).sum(
-            axis=tuple(range(self.handle[chrom].ndim - 1))) * \
-            self._interval_length(chrom) \
-            for chrom in self.handle]
+        def _squares(chrom):
+            return np.square(self.handle[chrom][:, :, :]).sum(
+                axis=tuple(range(self.handle[chrom].ndim - 1))) * \
+                self._interval_length(chrom)
+        sums = self._map(_squares)
         sums = np.asarray(sums).sum(axis=0)
 
         # weights are determined by interval and chromosome length
-        weights = [np.prod(self.handle[chrom].shape[:-1]) * \
+        weights = [self._num_positions(chrom) * \
                    self._interval_length(chrom) \
                    for chrom in self.handle]
         weights = np.asarray(weights).sum()
         return np.sqrt(sums / (weights - 1.))
 
+    def _num_positions(self, chrom):
+        """Number of positions and strands per condition."""
+        return np.prod(self.handle[chrom].shape[:-1])
+
+    def log_transform(self):
+        """Log-transforms the signal using log(x + 1)."""
+        def _log(chrom):
+            self.handle[chrom][:] = np.log(self.handle[chrom][:] + 1.)
+        self._map(_log)
+
+    def _chunks(self, chrom):
+        """Slices that partition the array of a chromosome."""
+        length = self.handle[chrom].shape[0]
+        return [slice(start, min(start + self._chunk_length, length))
+                for start in range(0, length, self._chunk_length)]
+
+    def moments(self, transform=None):
+        """Moments of the signal scaled by the region length.
+
+        The statistics are gathered in a single pass over the array.
+        Each chromosome (or region) is processed in chunks of bounded
+        size, whose moments are merged successively.
+
+        Parameters
+        ----------
+        transform : callable or None
+            Transformation applied to the signal before the
+            scaling, e.g. np.log1p. Default: None.
+
+        Returns
+        -------
+        dict
+            Number of positions, mean and sum of squared
+            deviations per condition for each chromosome (or region).
+        """
+        def _moments(chrom):
+            length = self._interval_length(chrom)
+            result = (0, np.zeros(len(self.condition)),
+                      np.zeros(len(self.condition)))
+            for chunk in self._chunks(chrom):
+                values = np.asarray(self.handle[chrom][chunk], dtype='float64')
+                if transform is not None:
+                    values = transform(values)
+                values = values.reshape(-1, values.shape[-1]) / length
+                mean = values.mean(axis=0)
+                result = _merge_moments(result,
+                                        (len(values), mean,
+                                         np.square(values - mean).sum(axis=0)))
+            return result
+        return dict(zip(self.handle, self._map(_moments)))
+
+    def normalize(self, shift=0., scale=1., transform=None):
+        """Normalizes the signal in place.
+
+        The signal is transformed to
+        :code:`(transform(x) / region_length - shift) / scale`
+        in a single chunked pass over the array.
+
+        Parameters
+        ----------
+        shift : float or numpy.array
+            Shift per condition. Default: 0.
+        scale : float or numpy.array
+            Scale per condition. Default: 1.
+        transform : callable or None
+            Transformation applied to the signal before the
+            scaling, e.g. np.log1p. Default: None.
+        """
+        self._check_float_storage()
+
+        def _normalize(chrom):
+            length = self._interval_length(chrom)
+            for chunk in self._chunks(chrom):
+                values = np.asarray(self.handle[chrom][chunk], dtype='float64')
+                if transform is not None:
+                    values = transform(values)
+                self.handle[chrom][chunk] = (values / length - shift) / scale
+        self._map(_normalize)
+
+    def _check_float_storage(self):
+        """Checks that the normalized signal can be stored.
+
+        Integer storage would silently truncate the normalized values.
+        """
+        if not np.issubdtype(np.dtype(self.typecode), np.floating):
+            raise ValueError('The normalized signal cannot be stored '
+                             'with typecode={}. Use a floating point '
+                             'typecode or a lazy normalizer, e.g. '
+                             'ZScore(lazy=True).'.format(self.typecode))
+
+    def _apply_normalizer(self, normalizer, cachefile):
+        """Normalizes the signal while the cache is created.
+
+        Lazy normalizers are skipped, as they are fitted after
+        the cache has been loaded.
+        The cache metadata records whether the stored signal
+        is normalized and discards parameters that were
+        fitted on a previous version of the cache.
+        """
+        normalized = normalizer is not None and \
+            not getattr(normalizer, 'lazy', False)
+        if normalized:
+            normalizer(self)
+
+        if cachefile is not None:
+            with open(cachefile + '.normalization.json', 'w') as fmeta:
+                json.dump({'normalized': normalized, 'parameters': {}}, fmeta)
+
+    def _fit_normalizer(self, normalizer, cachefile):
+        """Fits a lazy normalizer, which is applied when fetching the data.
+
+        The fitted shift and scale per condition are stored in the
+        cache metadata by the name of the normalizer. Therefore,
+        they are only determined once, and the same raw cache
+        can serve different normalizers.
+        """
+        if normalizer is None or not getattr(normalizer, 'lazy', False):
+            return
+
+        filename = cachefile + '.normalization.json' \
+            if cachefile is not None else None
+        metadata = {'normalized': False, 'parameters': {}}
+        if filename is not None and os.path.exists(filename):
+            with open(filename, 'r') as fmeta:
+                metadata = json.load(fmeta)
+
+        if metadata['normalized']:
+            raise ValueError('The cached signal is already normalized. '
+                             'Use overwrite=True to rebuild the cache '
+                             'for a lazy normalizer.')
+
+        name = getattr(normalizer, 'name', None)
+        if name in metadata['parameters']:
+            shift, scale = metadata['parameters'][name]
+        else:
+            shift, scale = [np.broadcast_to(np.asarray(param, dtype='float64'),
+                                            (len(self.condition),)).tolist()
+                            for param in normalizer.fit(self)]
+            if filename is not None and name is not None:
+                metadata['parameters'][name] = [shift, scale]
+                with open(filename, 'w') as fmeta:
+                    json.dump(metadata, fmeta)
+
+        self._normalization = (normalizer.transform, np.asarray(shift),
+                               np.asarray(scale))
+
+    def _normalized(self, data, chrom):
+        """Applies the lazy normalization to the data fetched from chrom."""
+        if self._normalization is None:
+            return data
+
+        transform, shift, scale = self._normalization
+        data = np.asarray(data, dtype='float64')
+        if transform is not None:
+            data = transform(data)
+        return (data / self._interval_length(chrom) - shift) / scale
+
     @property
     def order(self):
         """order"""
@@ -333,6 +718,39 @@ class GenomicArray(object):  # pylint: disable=too-many-instance-attributes
         return start // self.resolution
 
 
+def _get_hdf5_chunks(shape, chunks, typecode, min_chunk_bytes=1 << 16):
+    """Determine the HDF5 chunk shape for a chromosome dataset.
+
+    The chunk length along the genome is a multiple of chunks
+    such that a chunk holds at least min_chunk_bytes. Each chunk covers
+    all strands and conditions.
+    Empty datasets are not chunked, because HDF5 rejects chunks
+    that exceed a fixed dimension of size zero.
+    """
+    if 0 in shape:
+        return None
+    if chunks is None:
+        # let h5py guess the chunk shape
+        return True
+    rowbytes = np.dtype(typecode).itemsize * shape[1] * shape[2]
+    length = chunks * max(1, -(-min_chunk_bytes // (chunks * rowbytes)))
+    return tuple(min(chunk, max(1, dim))
+                 for chunk, dim in zip((length,) + shape[1:], shape))
+
+
+def _get_hdf5_compression(compression):
+    """Determine the HDF5 filter arguments for a given codec."""
+    if compression is None:
+        return {}
+    if compression in ['gzip', 'lzf']:
+        return {'compression': compression}
+    if compression == 'blosc':
+        if hdf5plugin is None:
+            raise ValueError("compression='blosc' requires hdf5plugin to be installed.")
+        return dict(hdf5plugin.Blosc())
+    raise ValueError('Unknown compression: {}'.format(compression))
+
+
 class HDF5GenomicArray(GenomicArray):
     """HDF5GenomicArray stores multi-dimensional genomic information.
 
@@ -368,7 +786,29 @@ class HDF5GenomicArray(GenomicArray):
         Function to be called for loading the genomic array.
     collapser : None or callable
         Method to aggregate values along a given interval.
+    chunks : int or None
+        Typical length of the queried windows in array coordinates.
+        The chunk length of the datasets is set to a multiple of it.
+        If None, the chunk shape is determined by h5py. Default: None.
+    compression : str or None
+        Compression codec: None, 'gzip', 'lzf' or 'blosc'.
+        'blosc' requires hdf5plugin. Default: 'gzip'.
+    chunk_cache : int or None
+        Size of the chunk cache in bytes used for reading the datasets.
+        If None, the h5py default is used. Default: None.
+    num_threads : int
+        Ignored, because h5py serializes all calls with a global lock.
+        The chromosomes are always processed one after another.
+        Default: 1.
     """
+    # h5py holds a global lock, threads would not speed up the
+    # computations.
+    _threadsafe = False
+    _handle = None
+    # the process that opened the file
+    _pid = None
+    _filename = None
+    _cache_kwargs = None
 
     def __init__(self, chroms,  # pylint: disable=too-many-locals
                  stranded=True,
@@ -381,10 +821,15 @@ class HDF5GenomicArray(GenomicArray):
                  cache=True,
                  overwrite=False, loader=None,
                  normalizer=None,
-                 collapser=None):
+                 collapser=None,
+                 chunks=None,
+                 compression='gzip',
+                 chunk_cache=None,
+                 num_threads=1):
         super(HDF5GenomicArray, self).__init__(stranded, conditions, typecode,
                                                resolution,
-                                               order, store_whole_genome, collapser)
+                                               order, store_whole_genome, collapser,
+                                               num_threads)
 
         if not cache:
             raise ValueError('HDF5 format requires cache=True')
@@ -399,14 +844,21 @@ class HDF5GenomicArray(GenomicArray):
         if not os.path.exists(memmap_dir):
             os.makedirs(memmap_dir)
         if not os.path.exists(os.path.join(memmap_dir, filename)) or overwrite:
+            filters = _get_hdf5_compression(compression)
             self.handle = h5py.File(os.path.join(memmap_dir, filename), 'w')
 
             for chrom in chroms:
                 shape = (_get_iv_length(chroms[chrom], self.resolution),
                          2 if stranded else 1, len(self.condition))
+                chunkshape = _get_hdf5_chunks(shape, chunks, self.typecode)
+                # unwritten chunks are implicitly zero, which avoids
+                # allocating the dense array in memory.
+                # compression filters require a chunked layout.
                 self.handle.create_dataset(chrom, shape,
-                                           dtype=self.typecode, compression='gzip',
-                                           data=np.zeros(shape, dtype=self.typecode))
+                                           dtype=self.typecode,
+                                           chunks=chunkshape,
+                                           fillvalue=0,
+                                           **(filters if chunkshape else {}))
 
             self.handle.attrs['conditions'] = [np.string_(x) for x in self.condition]
             self.handle.attrs['order'] = self.order
@@ -416,19 +868,82 @@ class HDF5GenomicArray(GenomicArray):
             if loader:
                 loader(self)
 
-            if normalizer:
-                normalizer(self)
+            self._apply_normalizer(normalizer, os.path.join(memmap_dir, filename))
 
             self.handle.close()
         print('reload {}'.format(os.path.join(memmap_dir, filename)))
-        self.handle = h5py.File(os.path.join(memmap_dir, filename), 'r',
-                                driver='stdio')
+        self._filename = os.path.join(memmap_dir, filename)
+        self._cache_kwargs = {'rdcc_nbytes': chunk_cache} if chunk_cache else {}
+        self._open()
 
         self.condition = self.handle.attrs['conditions']
         self.order = self.handle.attrs['order']
         self.resolution = self.handle.attrs['resolution'] \
             if self.handle.attrs['resolution'] > 0 else None
 
+        self._fit_normalizer(normalizer, os.path.join(memmap_dir, filename))
+
+    def _open(self):
+        """Opens the cache file read-only."""
+        self.handle = h5py.File(self._filename, 'r',
+                                driver='stdio', **self._cache_kwargs)
+
+    @property
+    def handle(self):
+        """HDF5 file handle.
+
+        h5py handles must not be shared between processes.
+        Therefore, the file is reopened in a forked worker process.
+        """
+        if self._pid != os.getpid() and self._filename is not None:
+            self._open()
+        return self._handle
+
+    @handle.setter
+    def handle(self, handle):
+        self._handle = handle
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        # h5py objects cannot be pickled.
+        # the file is opened again when unpickled, e.g. in a worker process.
+        state = self.__dict__.copy()
+        del state['_handle']
+        del state['_pid']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def fill_batch(self, chroms, starts, ends, strands, out):
+        """Fills a batch of genomic windows into a preallocated array.
+
+        If the whole genome is stored, the windows of each chromosome
+        are gathered from a single contiguous read, as long as they
+        are located close to each other.
+        Otherwise, the windows are fetched one by one.
+
+        Parameters
+        ----------
+        chroms : numpy.array
+            Chromosome names.
+        starts : numpy.array
+            Window starts in base pairs.
+        ends : numpy.array
+            Window ends in base pairs.
+        strands : numpy.array
+            Window strands.
+        out : numpy.array
+            Output array of shape (len(chroms), window_length, strand, condition).
+        """
+        if not self._full_genome_stored:
+            return super(HDF5GenomicArray, self).fill_batch(chroms, starts, ends,
+                                                            strands, out)
+        return _fill_batch_vectorized(self, chroms, starts, ends, strands, out,
+                                      max_overhead=2)
+
+
 class NPGenomicArray(GenomicArray):
     """NPGenomicArray stores multi-dimensional genomic information.
 
@@ -468,6 +983,8 @@ class NPGenomicArray(GenomicArray):
         Default: None.
     collapser : None or callable
         Method to aggregate values along a given interval.
+    num_threads : int
+        Number of threads used for normalizing the array. Default: 1.
     """
 
     def __init__(self, chroms,  # pylint: disable=too-many-locals
@@ -480,11 +997,13 @@ class NPGenomicArray(GenomicArray):
                  store_whole_genome=True,
                  cache=True,
                  overwrite=False, loader=None,
-                 normalizer=None, collapser=None):
+                 normalizer=None, collapser=None,
+                 num_threads=1):
 
         super(NPGenomicArray, self).__init__(stranded, conditions, typecode,
                                              resolution,
-                                             order, store_whole_genome, collapser)
+                                             order, store_whole_genome, collapser,
+                                             num_threads)
 
         if stranded:
             datatags = datatags + ['stranded'] if datatags else ['stranded']
@@ -508,8 +1027,8 @@ class NPGenomicArray(GenomicArray):
             if loader:
                 loader(self)
 
-            if normalizer:
-                normalizer(self)
+            self._apply_normalizer(normalizer, os.path.join(memmap_dir, filename)
+                                   if cache else None)
 
             condition = [np.string_(x) for x in self.condition]
             names = [x for x in data]
@@ -536,6 +1055,544 @@ class NPGenomicArray(GenomicArray):
         self.resolution = resolution
         self.order = order
 
+        self._fit_normalizer(normalizer, os.path.join(memmap_dir, filename)
+                             if cache else None)
+
+    def fill_batch(self, chroms, starts, ends, strands, out):
+        """Fills a batch of genomic windows into a preallocated array.
+
+        If the whole genome is stored, the windows are gathered
+        per chromosome in a single fancy indexing operation.
+        Otherwise, the windows are fetched one by one.
+
+        Parameters
+        ----------
+        chroms : numpy.array
+            Chromosome names.
+        starts : numpy.array
+            Window starts in base pairs.
+        ends : numpy.array
+            Window ends in base pairs.
+        strands : numpy.array
+            Window strands.
+        out : numpy.array
+            Output array of shape (len(chroms), window_length, strand, condition).
+        """
+        if not self._full_genome_stored:
+            return super(NPGenomicArray, self).fill_batch(chroms, starts, ends,
+                                                          strands, out)
+        return _fill_batch_vectorized(self, chroms, starts, ends, strands, out)
+
+
+class MemmapGenomicArray(GenomicArray):
+    """MemmapGenomicArray stores multi-dimensional genomic information.
+
+    Implements GenomicArray.
+
+    The data is stored in a flat binary file along with a JSON header
+    that describes the layout of the chromosomes in the file.
+    Upon reloading, the file is memory-mapped read-only,
+    which allows multiple processes to share the same copy
+    of the data via the page cache.
+
+    Parameters
+    ----------
+    chroms : dict
+        Dictionary with chromosome names as keys and chromosome lengths
+        as values.
+    stranded : bool
+        Consider stranded profiles. Default: True.
+    conditions : list(str) or None
+        List of cell-type or condition labels associated with the corresponding
+        array dimensions. Default: None means a one-dimensional array is produced.
+    typecode : str
+        Datatype. Default: 'd'.
+    datatags : list(str) or None
+        Tags describing the dataset. This is used to store the cache file.
+    resolution : int
+        Resolution for storing the genomic array. Only relevant for the use
+        with Cover Datasets. Default: 1.
+    order : int
+        Order of the alphabet size. Only relevant for Bioseq Datasets. Default: 1.
+    store_whole_genome : boolean
+        Whether to store the entire genome or only the regions of interest.
+        Default: True
+    cache : boolean
+        Whether to cache the dataset. Default: True
+    overwrite : boolean
+        Whether to overwrite the cache. Default: False
+    loader : callable or None
+        Function to be called for loading the genomic array.
+    normalizer : callable or None
+        Normalization to be applied. This argumenet can be None,
+        if no normalization is applied, or a callable that takes
+        a garray and returns a normalized garray.
+        Default: None.
+    collapser : None or callable
+        Method to aggregate values along a given interval.
+    num_threads : int
+        Number of threads used for normalizing the array. Default: 1.
+    """
+
+    def __init__(self, chroms,  # pylint: disable=too-many-locals
+                 stranded=True,
+                 conditions=None,
+                 typecode='d',
+                 datatags=None,
+                 resolution=1,
+                 order=1,
+                 store_whole_genome=True,
+                 cache=True,
+                 overwrite=False, loader=None,
+                 normalizer=None, collapser=None,
+                 num_threads=1):
+        super(MemmapGenomicArray, self).__init__(stranded, conditions, typecode,
+                                                 resolution,
+                                                 order, store_whole_genome, collapser,
+                                                 num_threads)
+
+        if not cache:
+            raise ValueError('Memmap format requires cache=True')
+
+        if stranded:
+            datatags = datatags + ['stranded'] if datatags else ['stranded']
+
+        memmap_dir = _get_output_data_location(datatags)
+
+        self._filename = os.path.join(memmap_dir, 'storage.memmap')
+        self._headername = os.path.join(memmap_dir, 'storage.json')
+
+        if not os.path.exists(memmap_dir):
+            os.makedirs(memmap_dir)
+
+        if not os.path.exists(self._headername) or overwrite:
+            # the header is written last. Its absence indicates
+            # that the cache file is missing or incomplete.
+            if os.path.exists(self._headername):
+                os.remove(self._headername)
+
+            layout = {}
+            offset = 0
+            for chrom in chroms:
+                length = _get_iv_length(chroms[chrom], self.resolution)
+                layout[chrom] = (offset, length)
+                offset += length
+
+            # np.memmap cannot map an empty file
+            shape = (max(offset, 1), 2 if stranded else 1, len(self.condition))
+            data = np.memmap(self._filename, dtype=self.typecode,
+                             mode='w+', shape=shape)
+            self.handle = {chrom: data[layout[chrom][0]:sum(layout[chrom])]
+                           for chrom in layout}
+
+            # invoke the loader
+            if loader:
+                loader(self)
+
+            self._apply_normalizer(normalizer, self._filename)
+
+            data.flush()
+            del data
+
+            header = {'layout': layout,
+                      'shape': shape,
+                      'typecode': np.dtype(self.typecode).str,
+                      'conditions': [x.decode('utf-8') if isinstance(x, bytes)
+                                     else str(x) for x in self.condition],
+                      'order': self.order,
+                      'resolution': resolution if resolution is not None else 0}
+            with open(self._headername, 'w') as fheader:
+                json.dump(header, fheader)
+
+        print('reload {}'.format(self._filename))
+        self._open()
+
+        self._fit_normalizer(normalizer, self._filename)
+
+    def _open(self):
+        """Memory-maps the cache file read-only."""
+        with open(self._headername, 'r') as fheader:
+            header = json.load(fheader)
+
+        data = np.memmap(self._filename, dtype=header['typecode'],
+                         mode='r', shape=tuple(header['shape']))
+        self.handle = {chrom: data[start:(start + length)]
+                       for chrom, (start, length) in header['layout'].items()}
+
+        self.condition = [np.string_(x) for x in header['conditions']]
+        self.order = header['order']
+        self.resolution = header['resolution'] \
+            if header['resolution'] > 0 else None
+
+    def __getstate__(self):
+        # avoid pickling the memory-mapped data.
+        # it is mapped again when unpickled, e.g. in a worker process.
+        state = self.__dict__.copy()
+        del state['handle']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def fill_batch(self, chroms, starts, ends, strands, out):
+        """Fills a batch of genomic windows into a preallocated array.
+
+        If the whole genome is stored, the windows are gathered
+        per chromosome in a single fancy indexing operation.
+        Otherwise, the windows are fetched one by one.
+
+        Parameters
+        ----------
+        chroms : numpy.array
+            Chromosome names.
+        starts : numpy.array
+            Window starts in base pairs.
+        ends : numpy.array
+            Window ends in base pairs.
+        strands : numpy.array
+            Window strands.
+        out : numpy.array
+            Output array of shape (len(chroms), window_length, strand, condition).
+        """
+        if not self._full_genome_stored:
+            return super(MemmapGenomicArray, self).fill_batch(chroms, starts, ends,
+                                                              strands, out)
+        return _fill_batch_vectorized(self, chroms, starts, ends, strands, out)
+
+
+class FastaGenomicArray(GenomicArray):
+    """FastaGenomicArray provides sequence indices from a FASTA file.
+
+    Implements GenomicArray.
+
+    The sequence is read on demand for each queried interval
+    from an indexed FASTA file and converted to the index
+    representation of the given order. Nothing is loaded upfront.
+    The array is read-only.
+
+    Parameters
+    ----------
+    fastafile : str
+        FASTA filename.
+    order : int
+        Order of the alphabet size. Default: 1.
+    """
+
+    def __init__(self, fastafile, order=1):
+        super(FastaGenomicArray, self).__init__(stranded=False,
+                                                conditions=['idx'],
+                                                typecode='int16',
+                                                resolution=1, order=order,
+                                                store_whole_genome=True)
+        self.fasta = IndexedFasta(fastafile)
+        self.handle = {}
+
+    def __setitem__(self, index, value):
+        raise ValueError('FastaGenomicArray is read-only')
+
+    def __getitem__(self, index):
+        if not isinstance(index, GenomicInterval):
+            raise IndexError("Index must be a GenomicInterval")
+
+        start, end = index.start, index.end
+        # a k-mer index requires order - 1 additional nucleotides
+        seq = self.fasta.fetch(index.chrom, start, end + self.order - 1)
+        indarray = seq2ind(Seq(seq, IUPAC.unambiguous_dna))
+        if self.order > 1:
+            indarray = kmer_index(indarray, self.order,
+                                  len(IUPAC.unambiguous_dna.letters))
+
+        # positions outside of the chromosome are zero-padded
+        # as in the other storage modes.
+        length = self.fasta.index[index.chrom][0] - self.order + 1
+        indarray[:max(min(-start, len(indarray)), 0)] = 0
+        indarray[max(length - start, 0):] = 0
+        return indarray.astype(self.typecode).reshape((-1, 1, 1))
+
+
+def _pack_sequence(iseq):
+    """Packs an index sequence with 2 bits per nucleotide.
+
+    Parameters
+    ----------
+    iseq : numpy.array
+        Nucleotide indices obtained from seq2ind.
+
+    Returns
+    -------
+    tuple(numpy.array, numpy.array)
+        Packed sequence as uint8 array and an array of shape (nruns, 2)
+        containing start and end of the runs of invalid letters (e.g. 'N').
+    """
+    invalid = iseq < 0
+    edges = np.diff(np.concatenate([[0], invalid.astype('int8'), [0]]))
+    nruns = np.stack([np.nonzero(edges == 1)[0],
+                      np.nonzero(edges == -1)[0]], axis=1)
+
+    codes = np.zeros(-(-len(iseq) // 4) * 4, dtype='uint8')
+    codes[:len(iseq)] = np.where(invalid, 0, iseq)
+    codes = codes.reshape(-1, 4)
+    # the first nucleotide occupies the highest bits
+    packed = (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+    return packed.astype('uint8'), nruns.astype('int64')
+
+
+def _unpack_sequence(packed, nruns, start, end):
+    """Unpacks a window of a packed sequence.
+
+    Parameters
+    ----------
+    packed : numpy.array
+        Packed sequence obtained from _pack_sequence.
+    nruns : numpy.array
+        Runs of invalid letters obtained from _pack_sequence.
+    start : int
+        Window start. Must be non-negative.
+    end : int
+        Window end. Must not exceed the sequence length.
+
+    Returns
+    -------
+    numpy.array
+        Nucleotide indices of the window where invalid letters
+        are represented by -1024.
+    """
+    window = np.asarray(packed[(start // 4):(-(-end // 4))])
+    iseq = (window[:, None] >> np.asarray([6, 4, 2, 0], dtype='uint8')) & 3
+    iseq = iseq.reshape(-1)[(start % 4):(start % 4 + end - start)].astype('int16')
+
+    # restore the runs of invalid letters that overlap the window
+    first = np.searchsorted(nruns[:, 1], start, side='right')
+    last = np.searchsorted(nruns[:, 0], end, side='left')
+    for rstart, rend in nruns[first:last]:
+        iseq[max(rstart - start, 0):(rend - start)] = -1024
+    return iseq
+
+
+class PackedGenomicArray(GenomicArray):
+    """PackedGenomicArray stores nucleotide sequences with 2 bits per base.
+
+    Implements GenomicArray.
+
+    Each sequence is packed into a uint8 array holding
+    four nucleotides per byte. Runs of invalid letters (e.g. 'N') are
+    kept in a separate list. The sequence indices of the given order are
+    obtained by unpacking the queried windows.
+    If cached, the packed sequences are memory-mapped read-only,
+    which allows multiple processes to share them via the page cache.
+    The array is read-only after it has been created.
+
+    Parameters
+    ----------
+    seqs : list(Bio.SeqRecord)
+        List of nucleotide sequences. The sequence ids are used
+        as chromosome names.
+    order : int
+        Order of the alphabet size. Default: 1.
+    datatags : list(str) or None
+        Tags describing the dataset. This is used to store the cache file.
+    store_whole_genome : boolean
+        Whether the sequences represent entire chromosomes or
+        only the regions of interest. Default: True
+    cache : boolean
+        Whether to cache the dataset. Default: True
+    overwrite : boolean
+        Whether to overwrite the cache. Default: False
+    """
+
+    def __init__(self, seqs, order=1, datatags=None,
+                 store_whole_genome=True, cache=True, overwrite=False):
+        super(PackedGenomicArray, self).__init__(stranded=False,
+                                                 conditions=['idx'],
+                                                 typecode='int16',
+                                                 resolution=1, order=order,
+                                                 store_whole_genome=store_whole_genome)
+
+        if cache:
+            packed_dir = _get_output_data_location(datatags)
+            self._filename = os.path.join(packed_dir, 'storage.packed')
+            self._headername = os.path.join(packed_dir, 'storage.npz')
+            if not os.path.exists(packed_dir):
+                os.makedirs(packed_dir)
+        else:
+            self._filename = None
+
+        if not cache or not os.path.exists(self._headername) or overwrite:
+            names, offsets, lengths, packed, nruns = [], [0], [], [], []
+            for seq in seqs:
+                if type(seq.seq.alphabet) is not type(IUPAC.unambiguous_dna):
+                    raise ValueError('PackedGenomicArray only supports '
+                                     'nucleotide sequences.')
+                packed_, nruns_ = _pack_sequence(seq2ind(seq))
+                names.append(seq.id)
+                lengths.append(len(seq))
+                offsets.append(offsets[-1] + len(packed_))
+                packed.append(packed_)
+                nruns.append(nruns_)
+
+            header = {'names': np.asarray(names),
+                      'offsets': np.asarray(offsets, dtype='int64'),
+                      'lengths': np.asarray(lengths, dtype='int64'),
+                      'nruns': np.concatenate(nruns) if nruns
+                               else np.zeros((0, 2), dtype='int64'),
+                      'nrunoffsets': np.cumsum([0] + [len(x) for x in nruns]),
+                      'order': self.order}
+            packed = np.concatenate(packed) if packed else np.zeros(0, dtype='uint8')
+
+            if cache:
+                if os.path.exists(self._headername):
+                    os.remove(self._headername)
+                packed.tofile(self._filename)
+                # the header is written last. Its absence indicates
+                # that the cache file is missing or incomplete.
+                np.savez(self._headername, **header)
+            else:
+                self._open(header, packed)
+
+        if cache:
+            print('reload {}'.format(self._filename))
+            self._load()
+
+    def _load(self):
+        """Memory-maps the cache file read-only."""
+        header = np.load(self._headername)
+        # np.memmap cannot map an empty file
+        packed = np.memmap(self._filename, dtype='uint8', mode='r') \
+            if header['offsets'][-1] > 0 else np.zeros(0, dtype='uint8')
+        self._open(header, packed)
+
+    def _open(self, header, packed):
+        names = [str(name) for name in header['names']]
+        offsets, runoffsets = header['offsets'], header['nrunoffsets']
+        self.handle = {name: packed[offsets[i]:offsets[i + 1]]
+                       for i, name in enumerate(names)}
+        self._lengths = dict(zip(names, header['lengths'].tolist()))
+        self._nruns = {name: header['nruns'][runoffsets[i]:runoffsets[i + 1]]
+                       for i, name in enumerate(names)}
+        self.order = int(header['order'])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._filename is not None:
+            # avoid pickling the memory-mapped data.
+            # it is mapped again when unpickled, e.g. in a worker process.
+            del state['handle']
+            del state['_nruns']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._filename is not None:
+            self._load()
+
+    def __setitem__(self, index, value):
+        raise ValueError('PackedGenomicArray is read-only')
+
+    def __getitem__(self, index):
+        if not isinstance(index, GenomicInterval):
+            raise IndexError("Index must be a GenomicInterval")
+
+        if self._full_genome_stored:
+            name = index.chrom
+            start = index.start
+        else:
+            name = _iv_to_str(index.chrom, index.start, index.end)
+            start = 0
+        length = index.end - index.start
+        nbases = self._lengths[name]
+
+        # a k-mer index requires order - 1 additional nucleotides
+        cstart = min(max(start, 0), nbases)
+        cend = min(max(start + length + self.order - 1, cstart), nbases)
+        iseq = _unpack_sequence(self.handle[name], self._nruns[name],
+                                cstart, cend)
+        if self.order > 1:
+            iseq = kmer_index(iseq, self.order,
+                              len(IUPAC.unambiguous_dna.letters))
+
+        # positions outside of the sequence are zero-padded
+        # as in the other storage modes.
+        data = np.zeros(length, dtype=self.typecode)
+        offset = cstart - start
+        data[offset:(offset + len(iseq))] = iseq[:max(length - offset, 0)]
+        return data.reshape((-1, 1, 1))
+
+
+class _SparseTriplets(object):
+    """Accumulates the entries of a sparse matrix as COO triplets.
+
+    The nonzero entries are collected block-wise and only converted to
+    a sparse matrix once. Each block overwrites a range of rows in
+    a set of columns, including the entries that it sets to zero.
+    That is, the block that was written last determines the value.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+        self._rows = []
+        self._cols = []
+        self._data = []
+        self._blocks = []
+        # row ranges written by each block per column
+        self._ranges = {}
+
+    def add(self, start, end, columns, rows, cols, values):  # pylint: disable=too-many-arguments
+        """Writes a block of entries.
+
+        Parameters
+        ----------
+        start : int
+            First row that is overwritten by the block.
+        end : int
+            End of the rows that are overwritten by the block.
+        columns : list(int)
+            Columns that are overwritten by the block.
+        rows : numpy.array
+            Rows of the nonzero entries.
+        cols : numpy.array
+            Columns of the nonzero entries.
+        values : numpy.array
+            Values of the nonzero entries.
+        """
+        block = len(self._blocks)
+        for col in columns:
+            self._ranges.setdefault(int(col), []).append((start, end, block))
+        self._rows.append(np.asarray(rows, dtype='int64'))
+        self._cols.append(np.asarray(cols, dtype='int64'))
+        self._data.append(np.asarray(values, dtype=self.dtype))
+        self._blocks.append(np.full(len(rows), block, dtype='int64'))
+
+    def tocoo(self):
+        """Converts the entries to a coo_matrix."""
+        rows = np.concatenate(self._rows + [np.zeros(0, dtype='int64')])
+        cols = np.concatenate(self._cols + [np.zeros(0, dtype='int64')])
+        data = np.concatenate(self._data + [np.zeros(0, dtype=self.dtype)])
+        blocks = np.concatenate(self._blocks + [np.zeros(0, dtype='int64')])
+
+        # determine the last block that was written to each entry
+        latest = np.full(len(rows), -1, dtype='int64')
+        for col, ranges in self._ranges.items():
+            sel = np.nonzero(cols == col)[0]
+            if not len(sel):  # pylint: disable=len-as-condition
+                continue
+            ranges = np.asarray(ranges, dtype='int64')
+            bounds = np.unique(ranges[:, :2])
+            first = np.searchsorted(bounds, ranges[:, 0])
+            last = np.searchsorted(bounds, ranges[:, 1])
+            # the segment i spans bounds[i] to bounds[i + 1]
+            segments = np.full(len(bounds), -1, dtype='int64')
+            for i in range(len(ranges)):
+                segments[first[i]:last[i]] = ranges[i, 2]
+            latest[sel] = segments[np.searchsorted(bounds, rows[sel],
+                                                   side='right') - 1]
+
+        # entries that were overwritten later on are discarded
+        keep = (latest == blocks) & (data != 0)
+        return sparse.coo_matrix((data[keep], (rows[keep], cols[keep])),
+                                 shape=self.shape, dtype=self.dtype)
+
 
 class SparseGenomicArray(GenomicArray):
     """SparseGenomicArray stores multi-dimensional genomic information.
@@ -577,6 +1634,8 @@ class SparseGenomicArray(GenomicArray):
         Default: None.
     collapser : None or callable
         Method to aggregate values along a given interval.
+    num_threads : int
+        Number of threads used for normalizing the array. Default: 1.
     """
 
     def __init__(self, chroms,  # pylint: disable=too-many-locals
@@ -590,11 +1649,14 @@ class SparseGenomicArray(GenomicArray):
                  cache=True,
                  overwrite=False,
                  loader=None,
-                 collapser=None):
+                 normalizer=None,
+                 collapser=None,
+                 num_threads=1):
         super(SparseGenomicArray, self).__init__(stranded, conditions,
                                                  typecode,
                                                  resolution,
-                                                 order, store_whole_genome, collapser)
+                                                 order, store_whole_genome, collapser,
+                                                 num_threads)
 
         if stranded:
             datatags = datatags + ['stranded'] if datatags else ['stranded']
@@ -606,11 +1668,13 @@ class SparseGenomicArray(GenomicArray):
             os.makedirs(memmap_dir)
         if cache and not os.path.exists(os.path.join(memmap_dir, filename)) \
             or overwrite or not cache:
-            data = {chrom: sparse.dok_matrix((_get_iv_length(chroms[chrom],
-                                                             self.resolution),
-                                              (2 if stranded else 1) *
-                                              len(self.condition)),
-                                             dtype=self.typecode)
+            # the nonzero entries are collected as triplets
+            # and converted to a sparse matrix after loading.
+            data = {chrom: _SparseTriplets((_get_iv_length(chroms[chrom],
+                                                           self.resolution),
+                                            (2 if stranded else 1) *
+                                            len(self.condition)),
+                                           dtype=self.typecode)
                     for chrom in chroms}
             self.handle = data
 
@@ -618,9 +1682,15 @@ class SparseGenomicArray(GenomicArray):
             if loader:
                 loader(self)
 
-            data = self.handle
+            self.handle = {chrom: self.handle[chrom].tocoo().tocsr()
+                           for chrom in self.handle}
+            self._offsets = {chrom: np.zeros(len(self.condition))
+                             for chrom in self.handle}
 
-            data = {chrom: data[chrom].tocoo() for chrom in data}
+            self._apply_normalizer(normalizer, os.path.join(memmap_dir, filename)
+                                   if cache else None)
+
+            data = {chrom: self.handle[chrom].tocoo() for chrom in self.handle}
 
             condition = [np.string_(x) for x in self.condition]
 
@@ -632,6 +1702,8 @@ class SparseGenomicArray(GenomicArray):
                                                for chrom in data}
             storage.update({'shape.'+chrom: \
                 np.asarray(data[chrom].shape) for chrom in data})
+            storage.update({'offset.'+chrom: self._offsets[chrom]
+                            for chrom in data})
             storage['conditions'] = condition
             storage['order'] = order
             storage['resolution'] = resolution if resolution is not None else 0
@@ -644,7 +1716,8 @@ class SparseGenomicArray(GenomicArray):
             storage = np.load(os.path.join(memmap_dir, filename))
 
             names = [x for x in storage.files if
-                     x not in ['conditions', 'order', 'resolution'] and x[:6] != 'shape.']
+                     x not in ['conditions', 'order', 'resolution'] and
+                     x[:6] != 'shape.' and x[:7] != 'offset.']
             condition = storage['conditions']
             order = storage['order']
             resolution = storage['resolution'] if storage['resolution'] > 0 else None
@@ -655,11 +1728,20 @@ class SparseGenomicArray(GenomicArray):
                                               shape=tuple(storage['shape.' +
                                                                   key])).tocsr()
                        for key in names}
+        # shifts of the signal per condition, which are
+        # subtracted when reading to maintain the sparsity.
+        self._offsets = {key: storage['offset.' + key]
+                         if 'offset.' + key in storage
+                         else np.zeros(len(condition))
+                         for key in names}
 
         self.condition = condition
         self.resolution = resolution
         self.order = order
 
+        self._fit_normalizer(normalizer, os.path.join(memmap_dir, filename)
+                             if cache else None)
+
     def __setitem__(self, index, value):
         interval = index[0]
         condition = index[1]
@@ -691,39 +1773,47 @@ class SparseGenomicArray(GenomicArray):
                 value = self.collapser(value)
 
             try:
-                for sind in range(value.shape[-1]):
-                    if not self._full_genome_stored:
-                        for idx, iarray in enumerate(range(start, end)):
-                            val = value[idx, sind]
-
-                            if val > 0:
-
-                                self.handle[
-                                    _iv_to_str(chrom, interval.start,
-                                               interval.end)][
-                                                   idx, sind * len(self.condition)
-                                                   + condition] = val
+                if not self._full_genome_stored:
+                    handle = self.handle[_iv_to_str(chrom, interval.start,
+                                                    interval.end)]
+                    block = value[:(end - start)]
+                    ref_start = 0
+                else:
+                    handle = self.handle[chrom]
+                    if start < 0:
+                        tmp_start = -start
+                        ref_start = 0
                     else:
-                        if start < 0:
-                            tmp_start = -start
-                            ref_start = 0
-                        else:
-                            tmp_start = 0
-                            ref_start = start
-
-                        if end > self.handle[chrom].shape[0]:
-                            tmp_end = value.shape[0] - (end - self.handle[chrom].shape[0])
-                            ref_end = self.handle[chrom].shape[0]
-                        else:
-                            tmp_end = value.shape[0]
-                            ref_end = end
-
-                        for idx, iarray in enumerate(range(ref_start, ref_end)):
-                            val = value[idx + tmp_start, sind]
-                            if val > 0:
-                                self.handle[chrom][iarray,
-                                                   sind * len(self.condition)
-                                                   + condition] = val
+                        tmp_start = 0
+                        ref_start = start
+
+                    if end > handle.shape[0]:
+                        tmp_end = value.shape[0] - (end - handle.shape[0])
+                    else:
+                        tmp_end = value.shape[0]
+                    block = value[tmp_start:tmp_end]
+
+                # the block overwrites its rows in the columns of
+                # the condition, but only the nonzero entries are stored
+                columns = np.arange(block.shape[-1]) * len(self.condition) + \
+                    condition
+                rows, sinds = np.nonzero(block != 0)
+                values = block[rows, sinds]
+                rows = rows + ref_start
+                cols = columns[sinds]
+                if isinstance(handle, _SparseTriplets):
+                    handle.add(ref_start, ref_start + len(block), columns,
+                               rows, cols, values)
+                else:
+                    # the array has already been loaded.
+                    # previous entries in the range are cleared first.
+                    first = handle.indptr[min(ref_start, handle.shape[0])]
+                    last = handle.indptr[min(ref_start + len(block),
+                                             handle.shape[0])]
+                    handle.data[first:last][np.isin(handle.indices[first:last],
+                                                    columns)] = 0
+                    handle[rows, cols] = values
+                    handle.eliminate_zeros()
 
             except KeyError:
                 # we end up here if the peak regions are not a subset of
@@ -740,8 +1830,217 @@ class SparseGenomicArray(GenomicArray):
             return
         raise IndexError("Index must be a GenomicInterval and a condition index")
 
-    def _reshape(self, data, shape):
-        return data.toarray().reshape(shape)
+    def _reshape(self, data, shape, chrom=None):
+        data = data.toarray().reshape(shape)
+        if chrom is not None and self._offsets[chrom].any():
+            data = data - self._offsets[chrom]
+        return data
+
+    def _column_values(self, values):
+        """Expands per condition values to the stranded matrix columns."""
+        return np.tile(np.broadcast_to(values, (len(self.condition),)),
+                       2 if self.stranded else 1)
+
+    def _num_positions(self, chrom):
+        return self.handle[chrom].shape[0] * (2 if self.stranded else 1)
+
+    def _stored_sum(self, chrom, power=1, transform=None):
+        """Sum of the stored values (or their powers) per condition."""
+        mat = self.handle[chrom]
+        if transform is not None:
+            mat = mat.copy()
+            mat.data = transform(mat.data)
+        if power != 1:
+            mat = mat.power(power)
+        return np.asarray(mat.sum(axis=0)).reshape(
+            (2 if self.stranded else 1, len(self.condition))).sum(axis=0)
+
+    def sum(self, chrom=None):
+        """Sum signal across chromosomes."""
+        if chrom is not None:
+            # the implicit zeros contribute the negative offset
+            return self._stored_sum(chrom) - \
+                self._num_positions(chrom) * self._offsets[chrom]
+
+        return np.asarray(self._map(self.sum))
+
+    def weighted_sd(self):
+        """ Interval scaled standard deviation """
+
+        # sum of squares of the shifted signal
+        # including the implicit zeros
+        def _squares(chrom):
+            return (self._stored_sum(chrom, 2) -
+                    2 * self._offsets[chrom] * self._stored_sum(chrom) +
+                    self._num_positions(chrom) * np.square(self._offsets[chrom])) * \
+                self._interval_length(chrom)
+        sums = self._map(_squares)
+        sums = np.asarray(sums).sum(axis=0)
+
+        # weights are determined by interval and chromosome length
+        weights = [self._num_positions(chrom) * \
+                   self._interval_length(chrom) \
+                   for chrom in self.handle]
+        weights = np.asarray(weights).sum()
+        return np.sqrt(sums / (weights - 1.))
+
+    def scale_by_region_length(self):
+        """ This method scales the regions by the region length ."""
+        def _scale(chrom):
+            self.handle[chrom].data /= self._interval_length(chrom)
+            self._offsets[chrom] = self._offsets[chrom] / \
+                self._interval_length(chrom)
+        self._map(_scale)
+
+    def shift(self, means):
+        """Centering the signal by the weighted mean.
+
+        The shift is recorded and applied when reading the data.
+        """
+        for chrom in self.handle:
+            self._offsets[chrom] = self._offsets[chrom] + means
+
+    def rescale(self, scale):
+        """ Method to rescale the signal """
+        columns = self._column_values(scale)
+
+        def _rescale(chrom):
+            mat = self.handle[chrom]
+            mat.data /= columns[mat.indices]
+            self._offsets[chrom] = self._offsets[chrom] / scale
+        self._map(_rescale)
+
+    def log_transform(self):
+        """Log-transforms the signal using log(x + 1)."""
+        self.normalize(transform=np.log1p, scale_by_length=False)
+
+    def moments(self, transform=None):
+        """Moments of the signal scaled by the region length.
+
+        The statistics are determined from the sums of the stored values,
+        accounting for the implicit zeros and the recorded shifts.
+
+        Parameters
+        ----------
+        transform : callable or None
+            Transformation applied to the signal before the
+            scaling. It must map zero to zero, e.g. np.log1p.
+            Default: None.
+
+        Returns
+        -------
+        dict
+            Number of positions, mean and sum of squared
+            deviations per condition for each chromosome (or region).
+        """
+        self._check_float_storage()
+        if transform is not None and \
+                any(self._offsets[chrom].any() for chrom in self.handle):
+            raise ValueError('The transformation cannot be applied '
+                             'to shifted sparse data.')
+
+        def _moments(chrom):
+            length = self._interval_length(chrom)
+            count = self._num_positions(chrom)
+            sums = self._stored_sum(chrom, transform=transform)
+            squares = self._stored_sum(chrom, 2, transform=transform)
+            if count == 0:
+                return (0, np.zeros(len(self.condition)),
+                        np.zeros(len(self.condition)))
+            return (count, (sums / count - self._offsets[chrom]) / length,
+                    (squares - np.square(sums) / count) / length ** 2)
+        return dict(zip(self.handle, self._map(_moments)))
+
+    def normalize(self, shift=0., scale=1., transform=None,
+                  scale_by_length=True):
+        """Normalizes the signal in place.
+
+        The signal is transformed to
+        :code:`(transform(x) / region_length - shift) / scale`.
+        Only the stored values are rescaled, while the shift is
+        recorded and applied when reading the data.
+
+        Parameters
+        ----------
+        shift : float or numpy.array
+            Shift per condition. Default: 0.
+        scale : float or numpy.array
+            Scale per condition. Default: 1.
+        transform : callable or None
+            Transformation applied to the signal before the
+            scaling. It must map zero to zero, e.g. np.log1p.
+            Default: None.
+        scale_by_length : boolean
+            Whether to scale the signal by the region length. Default: True.
+        """
+        self._check_float_storage()
+        if transform is not None and \
+                any(self._offsets[chrom].any() for chrom in self.handle):
+            raise ValueError('The transformation cannot be applied '
+                             'to shifted sparse data.')
+        columns = self._column_values(scale)
+
+        def _normalize(chrom):
+            mat = self.handle[chrom]
+            length = self._interval_length(chrom) if scale_by_length else 1.
+            if transform is not None:
+                mat.data = transform(mat.data)
+            mat.data /= length * columns[mat.indices]
+            self._offsets[chrom] = (self._offsets[chrom] / length + shift) / scale
+        self._map(_normalize)
+
+    def fill_batch(self, chroms, starts, ends, strands, out):
+        """Fills a batch of genomic windows into a preallocated array.
+
+        If the whole genome is stored, the rows of all windows on
+        a chromosome are fetched from the CSR matrix and
+        densified at once.
+        Otherwise, the windows are fetched one by one.
+
+        Parameters
+        ----------
+        chroms : numpy.array
+            Chromosome names.
+        starts : numpy.array
+            Window starts in base pairs.
+        ends : numpy.array
+            Window ends in base pairs.
+        strands : numpy.array
+            Window strands.
+        out : numpy.array
+            Output array of shape (len(chroms), window_length, strand, condition).
+        """
+        if not self._full_genome_stored or self.resolution is None:
+            return super(SparseGenomicArray, self).fill_batch(chroms, starts, ends,
+                                                              strands, out)
+        # convert to array coordinates
+        starts = starts // self.resolution
+        ends = -(-ends // self.resolution)
+        lengths = np.minimum(ends - starts, out.shape[1])
+        reverse = strands == '-'
+        offsets = np.arange(out.shape[1])
+
+        for chrom in np.unique(chroms):
+            sel = np.nonzero(chroms == chrom)[0]
+            handle = self.handle[chrom]
+
+            pos = np.where(reverse[sel, None],
+                           (starts[sel] + lengths[sel] - 1)[:, None] - offsets,
+                           starts[sel, None] + offsets)
+            valid = (offsets < lengths[sel, None]) & (pos >= 0) & \
+                (pos < handle.shape[0])
+
+            window = np.zeros((len(sel), out.shape[1], handle.shape[1]),
+                              dtype=out.dtype)
+            rows = handle[pos[valid]].toarray() - \
+                self._column_values(self._offsets[chrom])
+            window[valid] = self._normalized(
+                rows.reshape(len(rows), -1, len(self.condition)),
+                chrom).reshape(rows.shape)
+            window = window.reshape((len(sel),) + out.shape[1:])
+            window[reverse[sel]] = window[reverse[sel]][:, :, ::-1, :]
+            out[sel] = window
+        return out
 
 class ZScore(object):
     """ZScore normalization.
@@ -749,6 +2048,9 @@ class ZScore(object):
     This class performs ZScore normalization of a GenomicArray.
     It automatically adjusts for variable interval lenths.
 
+    The statistics are determined in a single pass over the array
+    and the normalization is applied in a second pass.
+
     Parameters
     ----------
     means : float or None
@@ -761,29 +2063,65 @@ class ZScore(object):
         If None, the stds will be determined
         from the GenomicArray and then applied.
         Default: None.
+    lazy : boolean
+        If True, the stored signal is left unchanged and the
+        normalization is applied whenever data is fetched from
+        the GenomicArray. The fitted means and standard deviations
+        are kept in the cache metadata. Default: False.
     """
-    def __init__(self, mean=None, std=None):
+    # transformation applied prior to the normalization
+    transform = None
+    _name = 'zscore'
+
+    def __init__(self, mean=None, std=None, lazy=False):
         self.mean = mean
         self.std = std
+        self.lazy = lazy
 
-    def __call__(self, garray):
-        # length scaling
+    @property
+    def name(self):
+        """Key of the fitted parameters in the cache metadata.
 
-        garray.scale_by_region_length()
+        Only parameters that are entirely determined from the data
+        are shared via the cache metadata. Once the instance is fitted,
+        e.g. on the training data, it is reused with its own parameters.
+        """
+        return self._name if self.mean is None and self.std is None else None
+
+    def fit(self, garray):
+        """Determines the means and standard deviations.
 
-        # determine the mean signal per condition
-        if self.mean is None:
-            self.mean = garray.weighted_mean()
+        Parameters
+        ----------
+        garray : GenomicArray
+            Genomic array.
 
-        # centering to zero-mean
-        garray.shift(self.mean)
+        Returns
+        -------
+        tuple
+            Means and standard deviations per condition.
+        """
+        if self.mean is None or self.std is None:
+            # determine the mean and standard deviation
+            # of the length scaled signal per condition
+            weight, mean, m2 = _weighted_moments(garray,
+                                                 garray.moments(self.transform))
+            if self.mean is None:
+                self.mean = mean
 
-        # determines standard deviation per contition
-        if self.std is None:
-            self.std = garray.weighted_sd()
+            if self.std is None:
+                # deviations are taken with respect to the applied mean
+                self.std = np.sqrt((m2 + weight * np.square(mean - self.mean)) /
+                                   (weight - 1.))
 
-        # rescale by standard deviation
-        garray.rescale(self.std)
+        return self.mean, self.std
+
+    def __call__(self, garray):
+
+        mean, std = self.fit(garray)
+
+        # length scaling, centering and rescaling at once
+        garray.normalize(mean, std, self.transform)
 
         return garray
 
@@ -807,41 +2145,74 @@ class ZScoreLog(ZScore):
         If None, the stds will be determined
         from the GenomicArray and then applied.
         Default: None.
+    lazy : boolean
+        If True, the stored signal is left unchanged and the
+        normalization is applied whenever data is fetched from
+        the GenomicArray. Default: False.
     """
-    def __init__(self, means=None, stds=None):
-        super(ZScoreLog, self).__init__(means, stds)
-
-    def __call__(self, garray):
+    transform = staticmethod(np.log1p)
+    _name = 'zscorelog'
 
-        # overall mean
-        # first log transform
-        for chrom in garray.handle:
-            garray.handle[chrom][:] = np.log(garray.handle[chrom][:] + 1.)
+    def __init__(self, means=None, stds=None, lazy=False):
+        super(ZScoreLog, self).__init__(means, stds, lazy)
 
-        return super(ZScoreLog, self).__call__(garray)
 
+class TPM(object):
+    """TPM normalization.
 
-def normalize_garray_tpm(garray):
-    """This function performs TPM normalization
-    for a given GenomicArray.
+    This class performs TPM normalization of a GenomicArray.
 
+    Parameters
+    ----------
+    lazy : boolean
+        If True, the stored signal is left unchanged and the
+        normalization is applied whenever data is fetched from
+        the GenomicArray. Default: False.
     """
+    transform = None
+    name = 'tpm'
+
+    def __init__(self, lazy=False):
+        self.lazy = lazy
+
+    @staticmethod
+    def fit(garray):
+        """Determines the scaling factors.
+
+        Parameters
+        ----------
+        garray : GenomicArray
+            Genomic array.
+
+        Returns
+        -------
+        tuple
+            Shift and scale per condition.
+        """
+        # total signal per condition after rescaling
+        # by region lengths in bp
+        moments = garray.moments()
+        total = np.asarray([moments[chrom][0] * moments[chrom][1]
+                            for chrom in moments]).sum(axis=0)
 
-    # rescale by region lengths in bp
-    garray.scale_by_region_length()
+        # rescaling by region lengths in kb and by the
+        # total signal in million reduces to x / length / (total / 1e6)
+        return 0., total / 1e6
 
-    # recale to kb
-    garray.rescale(1e-3)
+    def __call__(self, garray):
+        shift, scale = self.fit(garray)
+        garray.normalize(shift, scale)
 
-    # compute scaling factor
-    scale = garray.sum() # per chromsome sum
-    scale = scale.sum(axis=0) # sum across chroms
-    scale /= 1e6 # rescale by million
+        return garray
 
-    # divide by scaling factor
-    garray.rescale(scale)
 
-    return garray
+def normalize_garray_tpm(garray):
+    """This function performs TPM normalization
+    for a given GenomicArray.
+
+    """
+
+    return TPM()(garray)
 
 
 def get_normalizer(normalizer):
@@ -855,7 +2226,7 @@ def get_normalizer(normalizer):
         elif normalizer == 'zscorelog':
             return ZScoreLog()
         elif normalizer == 'tpm':
-            return normalize_garray_tpm
+            return TPM()
     elif callable(normalizer):
         return normalizer
     raise ValueError('unknown normalizer: {}'.format(normalizer))
@@ -867,7 +2238,9 @@ def create_genomic_array(chroms, stranded=True, conditions=None, typecode='float
                          store_whole_genome=True,
                          datatags=None, cache=True, overwrite=False,
                          loader=None,
-                         normalizer=None, collapser=None):
+                         normalizer=None, collapser=None,
+                         chunks=None, compression='gzip', chunk_cache=None,
+                         num_threads=1):
     """Factory function for creating a GenomicArray.
 
     This function creates a genomic array for a given storage mode.
@@ -885,14 +2258,17 @@ def create_genomic_array(chroms, stranded=True, conditions=None, typecode='float
     typecode : str
         Datatype. Default: 'float32'.
     storage : str
-        Storage type can be 'ndarray', 'hdf5' or 'sparse'.
+        Storage type can be 'ndarray', 'hdf5', 'memmap' or 'sparse'.
         Numpy loads the entire dataset into the memory. HDF5 keeps
         the data on disk and loads the mini-batches from disk.
+        Memmap keeps the data in a memory-mapped file on disk.
         Sparse maintains sparse matrix representation of the dataset
         in the memory.
         Usage of numpy will require high memory consumption, but allows fast
         slicing operations on the dataset. HDF5 requires low memory consumption,
         but fetching the data from disk might be time consuming.
+        memmap allows fast slicing while the data is shared
+        between processes via the page cache.
         sparse will be a good compromise if the data is indeed sparse. In this
         case, memory consumption will be low while slicing will still be fast.
     datatags : list(str) or None
@@ -915,10 +2291,32 @@ def create_genomic_array(chroms, stranded=True, conditions=None, typecode='float
         Normalization to be applied. This argumenet can be None,
         if no normalization is applied, or a callable that takes
         a garray and returns a normalized garray.
+        Normalizers constructed with lazy=True, e.g. ZScore(lazy=True),
+        leave the cached signal unchanged. Their fitted parameters
+        are stored in the cache metadata and they are applied
+        whenever data is fetched. Other built-in normalizers
+        require a floating point typecode.
         Default: None.
     collapser : str, callable or None
         Collapse method defines how the signal is aggregated for resolution>1 or resolution=None.
         For example, by summing the signal over a given interval.
+    chunks : int or None
+        Typical length of the queried windows in array coordinates.
+        Only relevant for storage='hdf5', where the chunk length
+        is aligned to it. Default: None means the chunk shape is
+        determined by h5py.
+    compression : str or None
+        Compression codec used with storage='hdf5'.
+        May be None, 'gzip', 'lzf' or 'blosc' (requires hdf5plugin).
+        Default: 'gzip'.
+    chunk_cache : int or None
+        Chunk cache size in bytes used with storage='hdf5'.
+        Default: None means the h5py default is used.
+    num_threads : int
+        Number of threads used for computing statistics and for
+        normalizing the array. It is ignored for storage='hdf5',
+        because h5py serializes all calls with a global lock.
+        Default: 1.
     """
 
     # check if collapser available
@@ -945,7 +2343,11 @@ def create_genomic_array(chroms, stranded=True, conditions=None, typecode='float
                                 overwrite=overwrite,
                                 loader=loader,
                                 normalizer=get_normalizer(normalizer),
-                                collapser=get_collapser(collapser))
+                                collapser=get_collapser(collapser),
+                                chunks=chunks,
+                                compression=compression,
+                                chunk_cache=chunk_cache,
+                                num_threads=num_threads)
     elif storage == 'ndarray':
         return NPGenomicArray(chroms, stranded=stranded,
                               conditions=conditions,
@@ -958,11 +2360,23 @@ def create_genomic_array(chroms, stranded=True, conditions=None, typecode='float
                               overwrite=overwrite,
                               loader=loader,
                               normalizer=get_normalizer(normalizer),
-                              collapser=get_collapser(collapser))
+                              collapser=get_collapser(collapser),
+                              num_threads=num_threads)
+    elif storage == 'memmap':
+        return MemmapGenomicArray(chroms, stranded=stranded,
+                                  conditions=conditions,
+                                  typecode=typecode,
+                                  datatags=datatags,
+                                  resolution=resolution,
+                                  order=order,
+                                  store_whole_genome=store_whole_genome,
+                                  cache=cache,
+                                  overwrite=overwrite,
+                                  loader=loader,
+                                  normalizer=get_normalizer(normalizer),
+                                  collapser=get_collapser(collapser),
+                                  num_threads=num_threads)
     elif storage == 'sparse':
-        if normalizer is not None:
-            print("Dataset normalization is not supported "
-                  "for sparse genomic data yet. Argument ignored.")
         return SparseGenomicArray(chroms, stranded=stranded,
                                   conditions=conditions,
                                   typecode=typecode,
@@ -973,6 +2387,8 @@ def create_genomic_array(chroms, stranded=True, conditions=None, typecode='float
                                   cache=cache,
                                   overwrite=overwrite,
                                   loader=loader,
-                                  collapser=get_collapser(collapser))
+                                  normalizer=get_normalizer(normalizer),
+                                  collapser=get_collapser(collapser),
+                                  num_threads=num_threads)
 
-    raise Exception("Storage type must be 'hdf5', 'ndarray' or 'sparse'")
+    raise Exception("Storage type must be 'hdf5', 'ndarray', 'memmap' or 'sparse'")
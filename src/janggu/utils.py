@@ -1,9 +1,12 @@
 """Utilities for janggu """
 
+import hashlib
 import json
 import os
+from collections import OrderedDict
 from collections import defaultdict
 from copy import deepcopy
+from threading import Lock
 
 import numpy as np
 import pandas as pd
@@ -98,6 +101,154 @@ def sequences_from_fasta(fasta, string='dna'):
     return seqs
 
 
+class IndexedFasta(object):
+    """Random access to the sequences in a FASTA file.
+
+    The sequences are located via a samtools-compatible
+    FASTA index (.fai). An up-to-date index next to the FASTA file
+    is used if available. Otherwise, the index is created and
+    cached in the janggu output directory, such that the directory
+    of the FASTA file is left untouched.
+    Only the bytes of the requested regions are read from the FASTA file.
+    The regions may be fetched from multiple threads concurrently.
+
+    Parameters
+    ----------
+    filename : str
+        FASTA filename. The file must be uncompressed and all lines
+        of a sequence, except for the last one, must be of equal length.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._handle = None
+        self._lock = Lock()
+
+        for faidx in [filename + '.fai', self._cached_index_location(filename)]:
+            if os.path.exists(faidx) and \
+                    os.path.getmtime(faidx) >= os.path.getmtime(filename):
+                self.index = self._read_index(faidx)
+                return
+
+        self.index = self._build_index(filename)
+        try:
+            if not os.path.exists(os.path.dirname(faidx)):
+                os.makedirs(os.path.dirname(faidx))
+            with open(faidx, 'w') as findex:
+                for name, entry in self.index.items():
+                    findex.write('\t'.join([name] + [str(x) for x in entry]) + '\n')
+        except (IOError, OSError):  # pragma: no cover
+            # the index is only kept in memory
+            pass
+
+    @staticmethod
+    def _cached_index_location(filename):
+        """Location of the index in the janggu output directory."""
+        key = hashlib.md5(os.path.abspath(filename).encode('utf-8')).hexdigest()
+        return os.path.join(_get_output_data_location(['fastaindex']),
+                            '{}.{}.fai'.format(os.path.basename(filename), key))
+
+    @staticmethod
+    def _read_index(faidx):
+        index = OrderedDict()
+        with open(faidx, 'r') as findex:
+            for line in findex:
+                fields = line.rstrip('\n').split('\t')
+                index[fields[0]] = tuple(int(x) for x in fields[1:5])
+        return index
+
+    @staticmethod
+    def _build_index(filename):
+        index = OrderedDict()
+        entry = None
+
+        def _add(entry):
+            name, length, offset, linebases, linewidth, _ = entry
+            index[name] = (length, offset, linebases, linewidth)
+
+        offset = 0
+        with open(filename, 'rb') as ffasta:
+            for line in ffasta:
+                if line.startswith(b'>'):
+                    if entry is not None:
+                        _add(entry)
+                    name = line[1:].split()[0].decode('ascii') if line[1:].strip() else ''
+                    entry = [name, 0, offset + len(line), 0, 0, False]
+                elif entry is not None:
+                    bases = len(line.rstrip(b'\r\n'))
+                    if entry[3] == 0:
+                        entry[3] = bases
+                        entry[4] = len(line)
+                    elif (entry[5] and bases > 0) or bases > entry[3]:
+                        # only the last line may be shorter than the others
+                        raise ValueError('Lines of sequence "{}" in {} must be of equal '
+                                         'length to be indexed.'.format(entry[0],
+                                                                        filename))
+                    elif bases < entry[3] or len(line) != entry[4]:
+                        entry[5] = True
+                    entry[1] += bases
+                offset += len(line)
+        if entry is not None:
+            _add(entry)
+        return index
+
+    def __getstate__(self):
+        # the open file handle and the lock are not pickled
+        state = self.__dict__.copy()
+        state['_handle'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @property
+    def chroms(self):
+        """Dictionary of sequence names and lengths."""
+        return OrderedDict((name, entry[0]) for name, entry in self.index.items())
+
+    def fetch(self, chrom, start, end):
+        """Fetch a region of a sequence.
+
+        Parameters
+        ----------
+        chrom : str
+            Sequence name.
+        start : int
+            Start position (zero-based).
+        end : int
+            End position (exclusive).
+
+        Returns
+        -------
+        str
+            Sequence of length end - start. Positions outside of
+            the sequence are represented by 'N'.
+        """
+        length, offset, linebases, linewidth = self.index[chrom]
+
+        cstart = min(max(start, 0), length)
+        cend = max(min(end, length), cstart)
+
+        seq = b''
+        if cend > cstart:
+            first = offset + (cstart // linebases) * linewidth + cstart % linebases
+            last = offset + ((cend - 1) // linebases) * linewidth + \
+                (cend - 1) % linebases
+            # seek and read on the shared handle must not interleave
+            with self._lock:
+                if self._handle is None:
+                    self._handle = open(self.filename, 'rb')
+                self._handle.seek(first)
+                seq = self._handle.read(last - first + 1)
+            seq = seq.replace(b'\n', b'').replace(b'\r', b'')
+
+        left = min(max(-start, 0), end - start)
+        return 'N' * left + seq.decode('ascii') + \
+            'N' * (end - start - left - len(seq))
+
+
 LETTERMAP = {k: i for i, k in enumerate(sorted(IUPAC.unambiguous_dna.letters))}
 NNUC = len(IUPAC.unambiguous_dna.letters)
 
@@ -105,10 +256,25 @@ NNUC = len(IUPAC.unambiguous_dna.letters)
 NMAP = defaultdict(lambda: -1024)
 NMAP.update(LETTERMAP)
 
+
+def _make_lookup_table(lettermap):
+    """Lookup table mapping (case-insensitive) character codes to integers.
+
+    Any other characters (e.g. 'N') map to -1024."""
+    table = np.full(256, -1024, dtype='int16')
+    for letter, idx in lettermap.items():
+        table[ord(letter.upper())] = idx
+        table[ord(letter.lower())] = idx
+    return table
+
+
+NLUT = _make_lookup_table(LETTERMAP)
+
 # mapping of amino acids to integers
 LETTERMAP = {k: i for i, k in enumerate(sorted(IUPAC.protein.letters))}
 PMAP = defaultdict(lambda: -1024)
 PMAP.update(LETTERMAP)
+PLUT = _make_lookup_table(LETTERMAP)
 
 
 def seq2ind(seq):
@@ -120,6 +286,9 @@ def seq2ind(seq):
     Any other characters (e.g. 'N') are represented by a negative value
     to avoid confusion with valid nucleotides.
 
+    The sequence is encoded by viewing it as a byte array and
+    mapping it through a lookup table.
+
     Parameters
     ----------
     seq : str, Bio.SeqRecord or Bio.Seq.Seq
@@ -127,7 +296,7 @@ def seq2ind(seq):
 
     Returns
     -------
-    list(int)
+    numpy.array
         Integer array representation of the biological sequence.
     """
 
@@ -135,12 +304,51 @@ def seq2ind(seq):
         seq = seq.seq
     if isinstance(seq, (str, Seq)):
         if type(seq.alphabet) is type(IUPAC.unambiguous_dna):
-            return [NMAP[x.upper()] for x in seq]
-        # else proteins should be used
-        return [PMAP[x.upper()] for x in seq]
+            table = NLUT
+        else:
+            # else proteins should be used
+            table = PLUT
+        # non-ascii characters are replaced by '?'
+        seq = np.frombuffer(str(seq).encode('ascii', 'replace'), dtype='uint8')
+        return table[seq]
     raise TypeError('seq2ind: Format is not supported')
 
 
+def kmer_index(iseq, order, alphabetsize):
+    """Transforms an index sequence into a higher-order index sequence.
+
+    Each window of order consecutive letters is mapped to
+    an integer between zero and pow(alphabetsize, order) - 1,
+    where the first letter of the window is the most significant digit.
+    Windows containing invalid letters (e.g. 'N') are represented by -1024.
+
+    Parameters
+    ----------
+    iseq : numpy.array
+        Index sequence obtained from seq2ind.
+    order : int
+        Order of the sequence representation.
+    alphabetsize : int
+        Alphabet size.
+
+    Returns
+    -------
+    numpy.array
+        Integer array of length len(iseq) - order + 1.
+    """
+    iseq = np.asarray(iseq)
+    length = max(len(iseq) - order + 1, 0)
+    kmers = np.zeros(length, dtype='int64')
+    for i in range(order):
+        kmers *= alphabetsize
+        kmers += iseq[i:(i + length)]
+
+    # mark windows with invalid letters
+    invalid = np.concatenate([[0], np.cumsum(iseq < 0)])
+    kmers[(invalid[order:] - invalid[:length]) > 0] = -1024
+    return kmers
+
+
 def sequence_padding(seqs, length):
     """This function truncates or pads the sequences
     to achieve fixed length sequences.
@@ -166,7 +374,7 @@ def sequence_padding(seqs, length):
     return seqs_
 
 
-def as_onehot(iseq, order, alphabetsize):
+def as_onehot(iseq, order, alphabetsize, out=None, dtype='int8'):
     """Converts a index sequence into one-hot representation.
 
     This method is used to transform a biological sequence
@@ -182,6 +390,16 @@ def as_onehot(iseq, order, alphabetsize):
     order: int
         Order of the sequence representation. Used for higher-order
         motif modelling.
+    alphabetsize : int
+        Size of the alphabet.
+    out : numpy.array or None
+        Optional output buffer of shape
+        `(batch_size, sequence length, 1, pow(alphabetsize, order))`.
+        If supplied, the one-hot representation is written into it.
+        Default: None means a new array is allocated.
+    dtype : str
+        Datatype of the allocated output array, e.g. 'int8', 'float32'
+        or 'float16'. It is ignored if out is supplied. Default: 'int8'.
 
     Returns
     -------
@@ -191,13 +409,30 @@ def as_onehot(iseq, order, alphabetsize):
         `(batch_size, sequence length, 1, pow(alphabetsize, order))`
     """
 
-    onehot = np.zeros((len(iseq),
-                       iseq.shape[1], 1,
-                       pow(alphabetsize, order)), dtype='int8')
-    for nuc in np.arange(pow(alphabetsize, order)):
-        onehot[:, :, 0, nuc][iseq == nuc] = 1
+    nsymbols = pow(alphabetsize, order)
+    shape = (len(iseq), iseq.shape[1], 1, nsymbols)
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    else:
+        if out.shape != shape:
+            raise ValueError('out must have shape {}, but has shape {}.'.format(
+                shape, out.shape))
+        out[:] = 0
+
+    # scatter the ones into the flattened buffer in a single pass.
+    # invalid letters (e.g. N) are represented by negative indices
+    # and result in all-zero columns.
+    iseq = np.asarray(iseq).astype('int64').reshape(-1)
+    valid = (iseq >= 0) & (iseq < nsymbols)
+    flatidx = np.arange(len(iseq), dtype='int64') * nsymbols + iseq
+    if out.flags.c_contiguous:
+        out.reshape(-1)[flatidx[valid]] = 1
+    else:
+        onehot = np.zeros(shape, dtype=out.dtype)
+        onehot.reshape(-1)[flatidx[valid]] = 1
+        out[:] = onehot
 
-    return onehot
+    return out
 
 
 def _complement_index(idx, order):
@@ -6,11 +6,16 @@ matplotlib.use('AGG')  # pylint: disable=
 import numpy as np
 import pandas
 import pkg_resources
+import pyBigWig
+import pysam
 import pytest
 
 from janggu.data import Cover
 from janggu.data import GenomicIndexer
 from janggu.data import plotGenomeTrack
+from janggu.data.coverage import BedLoader
+from janggu.data.coverage import _count_bam_reads
+from janggu.data.coverage import _get_read_positions
 
 def test_channel_last_first():
     data_path = pkg_resources.resource_filename('janggu', 'resources/')
@@ -130,6 +135,130 @@ def test_bam_genomic_interval_access_whole_genome():
                             cover[chrom, start, end, strand][:, shift:,:,:])
 
 
+def test_bam_batch_access_whole_genome(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, "sample.bed")
+
+    bamfile_ = os.path.join(data_path, "sample.bam")
+
+    for reso in [1, 50]:
+        covers = [Cover.create_from_bam(
+            'test',
+            bamfiles=bamfile_,
+            roi=bed_file,
+            binsize=200,
+            flank=16000,
+            storage=storage,
+            cache=True,
+            store_whole_genome=True,
+            resolution=reso) for storage in ['ndarray', 'hdf5']]
+
+        idxs = list(range(len(covers[0])))
+        np.random.shuffle(idxs)
+        batch = covers[0][idxs]
+        np.testing.assert_equal(batch, covers[1][idxs])
+        for i, idx in enumerate(idxs):
+            np.testing.assert_equal(batch[i:(i+1)],
+                                    covers[0][covers[0].gindexer[idx]])
+
+
+def test_bam_num_workers():
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, "sample.bed")
+
+    bamfile_ = os.path.join(data_path, "sample.bam")
+
+    for store_whole_genome in [True, False]:
+        for reso in [1, 50]:
+            covers = [Cover.create_from_bam(
+                'test',
+                bamfiles=[bamfile_, bamfile_],
+                roi=bed_file,
+                binsize=200,
+                store_whole_genome=store_whole_genome,
+                resolution=reso,
+                num_workers=num_workers) for num_workers in [1, 2]]
+
+            idxs = list(range(len(covers[0])))
+            np.testing.assert_equal(covers[0][idxs], covers[1][idxs])
+            assert covers[0][idxs].sum() > 0
+
+
+def _write_bam(filename, chroms, reads):
+    """Writes single end reads of length 10 given as (chrom, start, reverse)."""
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': chrom, 'LN': length} for chrom, length in chroms]}
+    names = [chrom for chrom, _ in chroms]
+    with pysam.AlignmentFile(filename, 'wb', header=header) as bam:
+        for i, (chrom, start, reverse) in enumerate(sorted(
+                reads, key=lambda read: (names.index(read[0]), read[1]))):
+            aln = pysam.AlignedSegment()
+            aln.query_name = 'read{}'.format(i)
+            aln.query_sequence = 'A' * 10
+            aln.flag = 0x10 if reverse else 0
+            aln.reference_id = names.index(chrom)
+            aln.reference_start = start
+            aln.mapping_quality = 60
+            aln.cigartuples = ((0, 10),)
+            aln.next_reference_id = -1
+            aln.next_reference_start = -1
+            aln.template_length = 0
+            aln.query_qualities = pysam.qualitystring_to_array('I' * 10)
+            bam.write(aln)
+    pysam.index(filename)
+
+
+def test_bam_multi_file_counts(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    chroms = [('chr1', 1000), ('chr2', 500)]
+    bamfiles = [tmpdir.join('sample1.bam').strpath,
+                tmpdir.join('sample2.bam').strpath]
+    # reads are counted at the 5 prime end, which is
+    # the read end for reads on the reverse strand
+    _write_bam(bamfiles[0], chroms, [('chr1', 10, False),
+                                     ('chr1', 100, True),
+                                     ('chr2', 260, False)])
+    _write_bam(bamfiles[1], chroms, [('chr1', 15, False),
+                                     ('chr1', 20, False),
+                                     ('chr2', 480, True)])
+    roi = tmpdir.join('roi.bed')
+    roi.write('chr1\t0\t200\t.\t0\t+\nchr2\t200\t300\t.\t0\t+\n')
+
+    # regions x bins x strands x files
+    expected = np.zeros((3, 2, 2, 2))
+    expected[0, 0, 0, 0] = 1
+    expected[0, 0, 0, 1] = 2
+    expected[1, 0, 1, 0] = 1
+    expected[2, 1, 0, 0] = 1
+
+    for store in ['ndarray', 'hdf5']:
+        for store_whole_genome in [True, False]:
+            for num_workers in [1, 2]:
+                cover = Cover.create_from_bam(
+                    'test',
+                    bamfiles=bamfiles,
+                    roi=roi.strpath,
+                    binsize=100,
+                    resolution=50,
+                    storage=store,
+                    cache=True,
+                    overwrite=True,
+                    store_whole_genome=store_whole_genome,
+                    num_workers=num_workers)
+
+                np.testing.assert_equal(cover[[0, 1, 2]], expected)
+
+                if store_whole_genome:
+                    assert cover.garray.handle['chr1'].shape == (20, 2, 2)
+                    assert cover.garray.handle['chr2'].shape == (10, 2, 2)
+                    np.testing.assert_equal(
+                        np.asarray(cover.garray.handle['chr2'])[9], [[0, 0], [0, 1]])
+                    np.testing.assert_equal(
+                        np.asarray(cover.garray.handle['chr1']).sum(axis=(0, 1)),
+                        [2, 2])
+
+
 def test_bam_genomic_interval_access_part_genome():
     data_path = pkg_resources.resource_filename('janggu', 'resources/')
     bed_file = os.path.join(data_path, "sample.bed")
@@ -221,6 +350,106 @@ def test_bigwig_genomic_interval_access_whole_genome():
                         np.testing.assert_equal(cover[i][:, :-shift,:, :], cover[chrom, start, end, strand][:, shift:,:,:])
 
 
+def test_bigwig_num_workers():
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, "sample.bed")
+
+    bwfile_ = os.path.join(data_path, "sample.bw")
+
+    for store_whole_genome in [True, False]:
+        for reso, collapser in [(1, None), (50, 'mean'), (50, 'max')]:
+            covers = [Cover.create_from_bigwig(
+                'test',
+                bigwigfiles=[bwfile_, bwfile_],
+                roi=bed_file,
+                binsize=200,
+                store_whole_genome=store_whole_genome,
+                resolution=reso,
+                collapser=collapser,
+                num_workers=num_workers) for num_workers in [1, 2]]
+
+            idxs = list(range(len(covers[0])))
+            np.testing.assert_equal(covers[0][idxs], covers[1][idxs])
+            assert covers[0][idxs].sum() > 0
+
+
+def test_bigwig_num_workers_collapser():
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, "sample.bed")
+
+    bwfile_ = os.path.join(data_path, "sample.bw")
+
+    # a lambda cannot be sent to the worker processes
+    with pytest.raises(ValueError):
+        Cover.create_from_bigwig('test', bigwigfiles=bwfile_,
+                                 roi=bed_file, binsize=200, resolution=50,
+                                 collapser=lambda x: x.max(axis=1),
+                                 num_workers=2)
+
+    # while it is supported for serial loading
+    cover = Cover.create_from_bigwig('test', bigwigfiles=bwfile_,
+                                     roi=bed_file, binsize=200, resolution=50,
+                                     collapser=lambda x: x.max(axis=1))
+    ref = Cover.create_from_bigwig('test', bigwigfiles=bwfile_,
+                                   roi=bed_file, binsize=200, resolution=50,
+                                   collapser='max', num_workers=2)
+    idxs = list(range(len(cover)))
+    np.testing.assert_equal(cover[idxs], ref[idxs])
+
+
+def test_bigwig_multi_file_signal(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    bwfiles = [tmpdir.join('sample1.bw').strpath,
+               tmpdir.join('sample2.bw').strpath]
+    for bwfile, entries in zip(bwfiles, [(['chr1', 'chr1', 'chr2'],
+                                          [0, 100, 450], [50, 150, 500],
+                                          [1., 2., 4.]),
+                                         (['chr1', 'chr2'], [150, 200],
+                                          [200, 300], [3., .5])]):
+        bw_file = pyBigWig.open(bwfile, 'w')
+        bw_file.addHeader([('chr1', 1000), ('chr2', 500)])
+        bw_file.addEntries(entries[0], entries[1], ends=entries[2],
+                           values=entries[3])
+        bw_file.close()
+    roi = tmpdir.join('roi.bed')
+    roi.write('chr1\t0\t200\t.\t0\t+\nchr2\t200\t300\t.\t0\t+\n')
+
+    # regions x bins x strand x files
+    expected = np.zeros((3, 2, 1, 2))
+    expected[0, 0, 0, 0] = 50.
+    expected[1, 0, 0, 0] = 100.
+    expected[1, 1, 0, 1] = 150.
+    expected[2, :, 0, 1] = 25.
+
+    for store in ['ndarray', 'hdf5']:
+        for store_whole_genome in [True, False]:
+            for num_workers in [1, 2]:
+                cover = Cover.create_from_bigwig(
+                    'test',
+                    bigwigfiles=bwfiles,
+                    roi=roi.strpath,
+                    binsize=100,
+                    resolution=50,
+                    collapser='sum',
+                    storage=store,
+                    cache=True,
+                    overwrite=True,
+                    store_whole_genome=store_whole_genome,
+                    num_workers=num_workers)
+
+                np.testing.assert_allclose(cover[[0, 1, 2]], expected)
+
+                if store_whole_genome:
+                    assert cover.garray.handle['chr1'].shape == (20, 1, 2)
+                    np.testing.assert_allclose(
+                        np.asarray(cover.garray.handle['chr2'])[:, 0, :],
+                        [[0, 0], [0, 0], [0, 0], [0, 0], [0, 25],
+                         [0, 25], [0, 0], [0, 0], [0, 0], [200, 0]])
+                    np.testing.assert_allclose(
+                        np.asarray(cover.garray.handle['chr1']).sum(axis=(0, 1)),
+                        [150, 150])
+
+
 def test_bigwig_genomic_interval_access_part_genome():
     data_path = pkg_resources.resource_filename('janggu', 'resources/')
     bed_file = os.path.join(data_path, "sample.bed")
@@ -930,6 +1159,146 @@ def test_cover_bam_paired_midpoint():
     assert cover.garray.handle['ref'][34, 0, 0] == 1
 
 
+def _reference_read_position(aln, min_mapq, pairedend):
+    """Per-read implementation that preceded the vectorized counting."""
+    if aln.is_unmapped or aln.mapping_quality < min_mapq or aln.is_read2:
+        return None
+
+    if aln.is_paired:
+        if not (aln.is_proper_pair and
+                aln.reference_name == aln.next_reference_name):
+            return None
+        if pairedend == 'midpoint':
+            pos = min(aln.reference_start, aln.next_reference_start) + \
+                abs(aln.template_length) // 2
+        elif aln.is_reverse:
+            pos = max(aln.reference_end,
+                      aln.next_reference_start + aln.query_length)
+        else:
+            pos = min(aln.reference_start, aln.next_reference_start)
+    elif aln.is_reverse:
+        pos = aln.reference_end
+    else:
+        pos = aln.reference_start
+
+    return pos, int(aln.is_reverse)
+
+
+def _reference_bam_counts(bamfile, locus, length, offset, min_mapq,
+                          pairedend, resolution):
+    """Counts the reads one by one and sums them at the given resolution."""
+    counts = np.zeros((length, 2))
+    aln_file = pysam.AlignmentFile(bamfile, 'rb')
+    for aln in aln_file.fetch(*locus):
+        read = _reference_read_position(aln, min_mapq, pairedend)
+        if read is None:
+            continue
+        pos, strand = read
+        if offset is not None:
+            pos -= offset
+        if 0 <= pos < length:
+            counts[pos, strand] += 1
+    aln_file.close()
+    return counts.reshape(-1, resolution, 2).sum(axis=1)
+
+
+class _Alignment(object):
+    """Alignment record with the attributes used for counting."""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, fields):
+        flag, rstart, rend, mapq, tlen, mstart, qlen, sameref = fields
+        self.is_paired = flag & 0x1 != 0
+        self.is_proper_pair = flag & 0x2 != 0
+        self.is_unmapped = flag & 0x4 != 0
+        self.is_reverse = flag & 0x10 != 0
+        self.is_read2 = flag & 0x80 != 0
+        self.reference_start = rstart
+        self.reference_end = rend
+        self.mapping_quality = mapq
+        self.template_length = tlen
+        self.next_reference_start = mstart
+        self.query_length = qlen
+        self.reference_name = 'chr1'
+        self.next_reference_name = 'chr1' if sameref else 'chr2'
+
+
+def test_get_read_positions():
+    rng = np.random.RandomState(0)
+    nreads = 2000
+    rstart = rng.randint(0, 1000, nreads)
+    qlen = rng.randint(10, 50, nreads)
+    mstart = rstart + rng.randint(-200, 200, nreads)
+    fields = np.stack([rng.randint(0, 256, nreads),
+                       rstart, rstart + qlen,
+                       rng.randint(0, 60, nreads),
+                       rng.randint(-300, 300, nreads),
+                       mstart, qlen,
+                       rng.randint(0, 2, nreads)], axis=1)
+    # all paired, proper, read1/read2, strand and unmapped flag combinations
+    assert len(np.unique(fields[:, 0] & 0x97)) == 32
+
+    for pairedend in ['5prime', 'midpoint']:
+        for min_mapq in [0, 30]:
+            reads = [_reference_read_position(_Alignment(row), min_mapq,
+                                              pairedend) for row in fields]
+            reads = np.asarray([read for read in reads if read is not None])
+            pos, strand = _get_read_positions(fields, min_mapq, pairedend)
+            np.testing.assert_equal(pos, reads[:, 0])
+            np.testing.assert_equal(strand, reads[:, 1])
+
+
+def test_count_bam_reads():
+    # sample.bam contains single end reads, while sample2.bam contains
+    # paired end reads, unmapped reads, unmapped mates and low quality reads
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    for bamfile in ['sample.bam', 'sample2.bam']:
+        bamfile = os.path.join(data_path, bamfile)
+        aln_file = pysam.AlignmentFile(bamfile, 'rb')
+        chroms = dict(zip(aln_file.references, aln_file.lengths))
+        aln_file.close()
+
+        for chrom in chroms:
+            # the entire chromosome without offset and
+            # a region whose read positions are shifted by the offset
+            size = chroms[chrom]
+            for start, end, offset in [(0, size, None),
+                                       (size // 4, 3 * size // 4, size // 4)]:
+                for resolution in [1, 50]:
+                    length = -(-(end - start) // resolution) * resolution
+                    for pairedend in ['5prime', 'midpoint']:
+                        for min_mapq in [0, 30]:
+                            ref = _reference_bam_counts(bamfile,
+                                                        (chrom, start, end),
+                                                        length, offset,
+                                                        min_mapq, pairedend,
+                                                        resolution)
+                            job = (bamfile, (chrom, start, end), length, offset,
+                                   min_mapq, pairedend, 'float32', resolution)
+                            # a small chunk size processes the
+                            # alignments in several chunks
+                            for chunksize in [3, 100000]:
+                                np.testing.assert_equal(
+                                    _count_bam_reads(job, chunksize=chunksize),
+                                    ref)
+
+    # the counts at resolution > 1 equal the summed base pair counts
+    bamfile = os.path.join(data_path, 'sample2.bam')
+    for pairedend in ['5prime', 'midpoint']:
+        covers = [Cover.create_from_bam('test', bamfiles=bamfile,
+                                        pairedend=pairedend, min_mapq=30,
+                                        store_whole_genome=True,
+                                        resolution=resolution)
+                  for resolution in [1, 10]]
+        for chrom in covers[0].garray.handle:
+            counts = covers[0].garray.handle[chrom]
+            counts = counts[:len(counts) // 10 * 10]
+            np.testing.assert_equal(
+                covers[1].garray.handle[chrom][:len(counts) // 10],
+                counts.reshape((-1, 10) + counts.shape[1:]).sum(axis=1))
+            assert covers[1].garray.handle[chrom].sum() == \
+                covers[0].garray.handle[chrom].sum()
+
+
 def test_cover_bam(tmpdir):
     os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
     data_path = pkg_resources.resource_filename('janggu', 'resources/')
@@ -1352,6 +1721,58 @@ def test_load_cover_bed_categorical():
         np.testing.assert_equal(cover[4].sum(), 1)
 
 
+def test_load_cover_bed_categorical_adjacent(tmpdir):
+    bed_file = pkg_resources.resource_filename('janggu', 'resources/sample.bed')
+    score_file = tmpdir.join('adjacent.bed')
+    # two classes that share the first bin
+    score_file.write('chr1\t15000\t15100\t.\t1\nchr1\t15100\t15300\t.\t2\n')
+
+    for store, whole_genome in [('ndarray', False), ('sparse', False),
+                                ('ndarray', True), ('sparse', True)]:
+        cover = Cover.create_from_bed(
+            "cov",
+            bedfiles=score_file.strpath,
+            roi=bed_file,
+            binsize=200, stepsize=100,
+            storage=store,
+            store_whole_genome=whole_genome,
+            mode='categorical')
+
+        np.testing.assert_equal(cover.shape[1:], (200, 1, 3))
+        np.testing.assert_equal(cover[0][0, :100, 0, 1], np.ones(100))
+        np.testing.assert_equal(cover[0][0, 100:, 0, 2], np.ones(100))
+        # each position is assigned to at most one class
+        np.testing.assert_equal(cover[[0, 1, 2, 3]].sum(axis=-1).max(), 1)
+        np.testing.assert_equal(cover[[0, 1, 2, 3]].sum(), 200 + 200 + 100)
+
+
+def test_load_cover_bed_chunks(monkeypatch):
+    bed_file = pkg_resources.resource_filename('janggu', 'resources/sample.bed')
+    score_file = pkg_resources.resource_filename('janggu',
+                                                 'resources/scored_sample.bed')
+
+    for store_whole_genome in [True, False]:
+        for resolution, collapser in [(1, None), (50, 'max'), (50, 'sum')]:
+            covers = []
+            # the coverage is evaluated in chunks of about 100 bp
+            # rather than in one pass over the chromosome
+            for chunk_length in [1 << 20, 100]:
+                monkeypatch.setattr(BedLoader, '_chunk_length', chunk_length)
+                covers.append(Cover.create_from_bed(
+                    "cov",
+                    bedfiles=score_file,
+                    roi=bed_file,
+                    binsize=200, stepsize=100,
+                    resolution=resolution,
+                    collapser=collapser,
+                    store_whole_genome=store_whole_genome,
+                    mode='score'))
+
+            idxs = list(range(len(covers[0])))
+            np.testing.assert_equal(covers[0][idxs], covers[1][idxs])
+            assert covers[0][idxs].sum() > 0
+
+
 def test_filter_by_region():
 
     roi_file = pkg_resources.resource_filename('janggu',
@@ -1,11 +1,20 @@
 import os
 
 import matplotlib
+import numpy as np
 import pkg_resources
 import pytest
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 
+from janggu.data import Array
 from janggu.data import Bioseq
+from janggu.data import Cover
+from janggu.data import RandomReverseComplement
 from janggu.data import split_train_test
+from janggu.data.data import JangguSequence
+from janggu.data.data import PrefetchSequence
 from janggu.data.data import _data_props
 
 matplotlib.use('AGG')
@@ -49,3 +58,227 @@ def test_split_train_test():
     assert len(traindna) == 50
     assert len(testdna) == 50
     assert len(dna) == len(traindna) + len(testdna)
+
+
+def test_random_reverse_complement(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, 'sample.bed')
+    bamfile_ = os.path.join(data_path, 'sample.bam')
+    refgenome = os.path.join(data_path, 'sample_genome.fa')
+
+    dna = Bioseq.create_from_refgenome('dna', refgenome=refgenome,
+                                       roi=bed_file, binsize=200,
+                                       order=2, store_whole_genome=True)
+    cover = Cover.create_from_bam('cov', bamfiles=bamfile_, roi=bed_file,
+                                  binsize=200, resolution=50,
+                                  store_whole_genome=True)
+    idxs = list(range(len(dna)))
+    refdna, refcover = dna[idxs], cover[idxs]
+
+    with pytest.raises(ValueError):
+        RandomReverseComplement(fraction=1.5)
+
+    rcomp = RandomReverseComplement(fraction=0.5, seed=42)
+    dna.transformations = [rcomp.transformation(dna)]
+    cover.transformations = [rcomp.transformation(cover)]
+
+    # outside of a JangguSequence, the data is not augmented
+    np.testing.assert_equal(dna[idxs], refdna)
+
+    jseq = JangguSequence(len(dna), inputs={'dna': dna},
+                          outputs={'cov': cover})
+    inputs, outputs, _ = jseq[0]
+    assert jseq.augmentations == [rcomp]
+    assert rcomp.mask is None
+
+    # flipped samples coincide with the opposite strand
+    flipped = np.nonzero((inputs['dna'] != refdna).any(axis=(1, 2, 3)))[0]
+    assert 0 < len(flipped) < len(dna)
+    for idx in flipped:
+        giv = dna.gindexer[idx]
+        strand = '+' if giv.strand == '-' else '-'
+        np.testing.assert_equal(inputs['dna'][idx:(idx + 1)],
+                                dna[giv.chrom, giv.start, giv.end, strand])
+    np.testing.assert_equal(outputs['cov'][flipped],
+                            refcover[flipped][:, ::-1, ::-1, :])
+
+    # the entire batch
+    rcomp.fraction = 1.
+    inputs, outputs, _ = jseq[0]
+    np.testing.assert_equal(outputs['cov'], refcover[:, ::-1, ::-1, :])
+
+
+def test_bucket_by_length(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    seqs = [SeqRecord(Seq('ACGT' * length, IUPAC.unambiguous_dna),
+                      id='seq{}'.format(i))
+            for i, length in enumerate([5, 1, 3, 2, 5, 1, 4])]
+
+    with pytest.raises(Exception):
+        Bioseq.create_from_seq('dna', fastafile=seqs)
+
+    dna = Bioseq.create_from_seq('dna', fastafile=seqs, variable_length=True)
+    assert dna.shape == (7, 20, 1, 4)
+    np.testing.assert_equal(dna.sequence_lengths, [20, 4, 12, 8, 20, 4, 16])
+
+    # shorter sequences are zero-padded
+    np.testing.assert_equal(dna[1].sum(axis=(0, 2, 3)), [1] * 4 + [0] * 16)
+
+    labels = Array('labels', np.arange(7))
+    with pytest.raises(ValueError):
+        JangguSequence(2, inputs={'labels': labels}, bucket_by_length=True)
+
+    jseq = JangguSequence(2, inputs={'dna': dna}, outputs={'labels': labels},
+                          bucket_by_length=True)
+    assert len(jseq) == 4
+    lengths = []
+    for i in range(len(jseq)):
+        inputs, outputs, _ = jseq[i]
+        idxs = outputs['labels']
+        # each batch is padded to its longest sequence
+        assert inputs['dna'].shape[1] == dna.sequence_lengths[idxs].max()
+        np.testing.assert_equal(inputs['dna'],
+                                dna[list(idxs)][:, :inputs['dna'].shape[1]])
+        lengths.append(inputs['dna'].shape[1])
+    assert lengths == [4, 12, 20, 20]
+
+    jseq = JangguSequence(2, inputs={'dna': dna}, outputs={'labels': labels},
+                          bucket_by_length=True, shuffle=True)
+    jseq.on_epoch_end()
+    idxs = np.concatenate([jseq[i][1]['labels'] for i in range(len(jseq))])
+    np.testing.assert_equal(np.sort(idxs), np.arange(7))
+
+
+def test_prefetch_sequence(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, 'sample.bed')
+    bamfile_ = os.path.join(data_path, 'sample.bam')
+    refgenome = os.path.join(data_path, 'sample_genome.fa')
+
+    dna = Bioseq.create_from_refgenome('dna', refgenome=refgenome,
+                                       roi=bed_file, binsize=200,
+                                       storage='memmap', cache=True,
+                                       store_whole_genome=True)
+    # hdf5 files are reopened by the worker processes
+    cover = Cover.create_from_bam('cov', bamfiles=bamfile_, roi=bed_file,
+                                  binsize=200, resolution=50,
+                                  storage='hdf5', cache=True,
+                                  store_whole_genome=True)
+    labels = Array('labels', np.arange(len(dna)))
+
+    with pytest.raises(ValueError):
+        PrefetchSequence(JangguSequence(8, {'dna': dna}), workers=0)
+    with pytest.raises(ValueError):
+        PrefetchSequence(JangguSequence(8, {'dna': dna}), queue_size=0)
+
+    for use_multiprocessing in [False, True]:
+        jseq = JangguSequence(8, inputs={'dna': dna, 'cov': cover},
+                              outputs={'labels': labels}, shuffle=True)
+        pseq = PrefetchSequence(jseq, workers=2, queue_size=3,
+                                use_multiprocessing=use_multiprocessing)
+        assert len(pseq) == len(jseq)
+        assert pseq.inputs is jseq.inputs
+
+        for _ in range(2):
+            for i in range(len(pseq)):
+                inputs, outputs, _ = pseq[i]
+                ref_inputs, ref_outputs, _ = jseq[i]
+                np.testing.assert_equal(inputs['dna'], ref_inputs['dna'])
+                np.testing.assert_equal(inputs['cov'], ref_inputs['cov'])
+                np.testing.assert_equal(outputs['labels'],
+                                        ref_outputs['labels'])
+            pseq.on_epoch_end()
+
+        # batches requested out of order
+        np.testing.assert_equal(pseq[3][0]['dna'], jseq[3][0]['dna'])
+        np.testing.assert_equal(pseq[1][0]['dna'], jseq[1][0]['dna'])
+        pseq.close()
+
+    jseq = JangguSequence(8, inputs={'dna': dna}, outputs={'labels': labels})
+    refs = [jseq[i][1]['labels'] for i in range(len(jseq))]
+    builds = []
+    getbatch = jseq._getbatch
+
+    def _getbatch(idxs):
+        builds.append(idxs[0])
+        return getbatch(idxs)
+    jseq._getbatch = _getbatch
+
+    # batches requested out of order, e.g. if shuffled by keras,
+    # are assembled once per epoch
+    pseq = PrefetchSequence(jseq, workers=2, queue_size=3)
+    for _ in range(2):
+        for i in np.random.RandomState(0).permutation(len(pseq)):
+            np.testing.assert_equal(pseq[i][1]['labels'], refs[i])
+        assert len(builds) == len(pseq)
+        assert len(set(builds)) == len(pseq)
+        pseq.on_epoch_end()
+        builds[:] = []
+    pseq.close()
+
+    # the sequence shuffles the batches itself and prefetches
+    # them in this order
+    pseq = PrefetchSequence(jseq, workers=2, queue_size=3, shuffle=True)
+    for _ in range(2):
+        labels_ = np.concatenate([pseq[i][1]['labels']
+                                  for i in range(len(pseq))])
+        np.testing.assert_equal(np.sort(labels_.ravel()), np.arange(len(dna)))
+        assert len(builds) == len(pseq)
+        pseq.on_epoch_end()
+        builds[:] = []
+    pseq.close()
+
+
+def test_batch_buffers(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, 'sample.bed')
+    bamfile_ = os.path.join(data_path, 'sample.bam')
+    refgenome = os.path.join(data_path, 'sample_genome.fa')
+
+    dna = Bioseq.create_from_refgenome('dna', refgenome=refgenome,
+                                       roi=bed_file, binsize=200,
+                                       store_whole_genome=True)
+    cover = Cover.create_from_bam('cov', bamfiles=bamfile_, roi=bed_file,
+                                  binsize=200, resolution=50,
+                                  store_whole_genome=True)
+    idxs = list(range(8))
+    refdna, refcover = dna[idxs], cover[idxs]
+    assert refdna.dtype == np.int8
+    assert refcover.dtype == np.float64
+
+    dna = Bioseq.create_from_refgenome('dna', refgenome=refgenome,
+                                       roi=bed_file, binsize=200,
+                                       store_whole_genome=True,
+                                       batch_dtype='float16')
+    # dtype refers to the storage, batch_dtype to the batches
+    cover = Cover.create_from_bam('cov', bamfiles=bamfile_, roi=bed_file,
+                                  binsize=200, resolution=50,
+                                  store_whole_genome=True,
+                                  dtype='float64', batch_dtype='float32')
+    np.testing.assert_equal(dna[idxs], refdna)
+    assert dna[idxs].dtype == np.float16
+    np.testing.assert_equal(cover[idxs], refcover)
+    assert cover[idxs].dtype == np.float32
+
+    # write into a preallocated buffer
+    out = np.ones(cover._batch_shape(len(idxs)), dtype='float32')
+    assert cover.get_batch(idxs, out=out) is out
+    np.testing.assert_equal(out, refcover)
+    with pytest.raises(ValueError):
+        cover.get_batch(idxs[:4], out=out)
+
+    with pytest.raises(ValueError):
+        JangguSequence(8, {'dna': dna}, buffers=-1)
+
+    jseq = JangguSequence(8, inputs={'dna': dna}, outputs={'cov': cover},
+                          buffers=2)
+    batches = [jseq[i] for i in range(3)]
+    np.testing.assert_equal(batches[2][0]['dna'], dna[list(range(16, 24))])
+    np.testing.assert_equal(batches[2][1]['cov'], cover[list(range(16, 24))])
+    # the buffers are recycled after two batches
+    assert np.shares_memory(batches[0][0]['dna'], batches[2][0]['dna'])
+    assert np.shares_memory(batches[0][1]['cov'], batches[2][1]['cov'])
+    assert not np.shares_memory(batches[1][1]['cov'], batches[2][1]['cov'])
@@ -1,9 +1,14 @@
 import os
+import pickle
+from itertools import product
 
 import matplotlib
 import numpy as np
 import pkg_resources
 import pytest
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 from HTSeq import BED_Reader
 from keras.layers import Input
 from keras.models import Model
@@ -13,6 +18,8 @@ from janggu.data import GenomicIndexer
 from janggu.layers import Complement
 from janggu.layers import Reverse
 from janggu.utils import complement_permmatrix
+from janggu.utils import kmer_index
+from janggu.utils import seq2ind
 from janggu.utils import sequences_from_fasta
 
 matplotlib.use('AGG')
@@ -230,6 +237,123 @@ def test_dna_dims_order_1_from_reference(tmpdir):
                             dtype='int8'))
 
 
+def test_dna_from_indexed_fasta(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, 'sample.bed')
+    refgenome = os.path.join(data_path, 'sample_genome.fa')
+
+    for order in [1, 2]:
+        ref = Bioseq.create_from_refgenome('ref', refgenome=refgenome,
+                                           roi=bed_file, binsize=200,
+                                           flank=150, order=order,
+                                           store_whole_genome=True)
+        # read the regions of interest via the fasta index
+        roi = Bioseq.create_from_refgenome('roi', refgenome=refgenome,
+                                           roi=bed_file, binsize=200,
+                                           flank=150, order=order)
+        # read the regions on demand
+        fasta = Bioseq.create_from_refgenome('fasta', refgenome=refgenome,
+                                             roi=bed_file, binsize=200,
+                                             flank=150, order=order,
+                                             storage='fasta')
+        # the packaged reference is left untouched
+        assert not os.path.exists(refgenome + '.fai')
+
+        idxs = list(range(len(ref)))
+        np.testing.assert_equal(roi[idxs], ref[idxs])
+        np.testing.assert_equal(fasta[idxs], ref[idxs])
+        np.testing.assert_equal(fasta['chr1', 29900, 30100],
+                                ref['chr1', 29900, 30100])
+
+    with pytest.raises(ValueError):
+        Bioseq.create_from_refgenome('fasta', refgenome=sequences_from_fasta(refgenome),
+                                     roi=bed_file, binsize=200,
+                                     storage='fasta')
+
+
+def test_dna_packed(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, 'sample.bed')
+    refgenome = sequences_from_fasta(os.path.join(data_path,
+                                                  'sample_genome.fa'))
+    # mask a few stretches with N's
+    for seq in refgenome:
+        seq.seq = Seq('N' + str(seq.seq)[1:100] + 'N' * 55
+                      + str(seq.seq)[155:15020] + 'NnN'
+                      + str(seq.seq)[15023:], IUPAC.unambiguous_dna)
+
+    for order, store_whole_genome, cache in product([1, 2], [True, False],
+                                                    [True, False]):
+        name = 'packed{}{}'.format(store_whole_genome, cache)
+        ref = Bioseq.create_from_refgenome('ref', refgenome=refgenome,
+                                           roi=bed_file, binsize=200,
+                                           flank=150, order=order,
+                                           store_whole_genome=store_whole_genome)
+        packed = Bioseq.create_from_refgenome(name, refgenome=refgenome,
+                                              roi=bed_file, binsize=200,
+                                              flank=150, order=order,
+                                              store_whole_genome=store_whole_genome,
+                                              storage='packed', cache=cache)
+        garray = pickle.loads(pickle.dumps(packed.garray))
+        for giv in ref.gindexer:
+            giv.end -= order - 1
+            np.testing.assert_equal(packed.garray[giv], ref.garray[giv])
+            np.testing.assert_equal(garray[giv], ref.garray[giv])
+
+        if store_whole_genome:
+            for giv in [('chr1', -10, 200), ('chr2', 29900, 30100),
+                        ('chr1', 14900, 15100)]:
+                np.testing.assert_equal(packed[giv], ref[giv])
+
+
+def test_dna_reverse_complement_with_n(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    refgenome = [SeqRecord(Seq('ACGGTNNCATTGA', IUPAC.unambiguous_dna),
+                           id='chr1')]
+    roi = tmpdir.join('roi.bed')
+    roi.write('chr1\t0\t13\t.\t0\t+\nchr1\t0\t13\t.\t0\t-\n')
+
+    for order in [1, 2]:
+        dna = Bioseq.create_from_refgenome('dna', refgenome=refgenome,
+                                           roi=roi.strpath, order=order,
+                                           store_whole_genome=True)
+        iseq = dna.iseq4idx([0, 1])
+        rcseq = kmer_index(seq2ind(refgenome[0].reverse_complement()),
+                           order, 4)
+        np.testing.assert_equal(iseq[1], rcseq)
+        np.testing.assert_equal(dna['chr1', 0, 13, '-'][0], dna[1][0])
+        # N's yield all-zero columns on both strands
+        np.testing.assert_equal(dna[0].sum(axis=-1)[0, :, 0],
+                                dna[1].sum(axis=-1)[0, ::-1, 0])
+
+
+def test_dna_batch_access_whole_genome(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+    bed_file = os.path.join(data_path, 'sample.bed')
+    refgenome = os.path.join(data_path, 'sample_genome.fa')
+
+    for order in [1, 2]:
+        # the large flank lets the windows reach beyond the chromosome ends
+        dnas = [Bioseq.create_from_refgenome('dna', refgenome=refgenome,
+                                             roi=bed_file, binsize=200,
+                                             flank=16000, order=order,
+                                             storage=storage, cache=True,
+                                             store_whole_genome=True)
+                for storage in ['ndarray', 'hdf5', 'memmap', 'packed']]
+
+        idxs = list(range(len(dnas[0])))
+        np.random.shuffle(idxs)
+        batch = dnas[0].iseq4idx(idxs)
+        for dna in dnas[1:]:
+            np.testing.assert_equal(batch, dna.iseq4idx(idxs))
+        for i, idx in enumerate(idxs):
+            np.testing.assert_equal(batch[i],
+                                    dnas[0]._getsingleitem(dnas[0].gindexer[idx]))
+
+
 def test_dna_dims_order_2(tmpdir):
     os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
     order = 2
@@ -1,10 +1,17 @@
 import os
+import pickle
+import threading
 
 import numpy as np
 import pytest
 from HTSeq import GenomicInterval
 
 from janggu.data import create_genomic_array
+from janggu.data.genomicarray import TPM
+from janggu.data.genomicarray import ZScore
+from janggu.data.genomicarray import ZScoreLog
+from janggu.data.genomicarray import _get_hdf5_chunks
+from janggu.data.genomicarray import _weighted_moments
 from janggu.data.genomicarray import get_collapser
 from janggu.data.genomicarray import get_normalizer
 
@@ -38,6 +45,105 @@ def test_hdf5_no_cache():
                                   storage='hdf5', cache=False)
 
 
+def test_hdf5_layout(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    iv = GenomicInterval('chr10', 100, 120, '.')
+
+    def _loader(garray):
+        garray[iv, 0] = np.ones((20, 1))
+
+    for compression in [None, 'gzip', 'lzf']:
+        ga = create_genomic_array({'chr10': 300000, 'chr1': 20, 'chr2': 0},
+                                  stranded=False,
+                                  typecode='int8', storage='hdf5',
+                                  datatags=['test_hdf5_layout', str(compression)],
+                                  loader=_loader, chunks=200,
+                                  compression=compression,
+                                  chunk_cache=1 << 20)
+
+        np.testing.assert_equal(ga[iv], np.ones((20, 1, 1)))
+        np.testing.assert_equal(ga[GenomicInterval('chr10', 0, 300000)].sum(), 20)
+        np.testing.assert_equal(ga.handle['chr10'].compression, compression)
+        # chunks are aligned to the window length
+        np.testing.assert_equal(ga.handle['chr10'].chunks, (65600, 1, 1))
+        np.testing.assert_equal(ga.handle['chr1'].chunks, (20, 1, 1))
+        # empty datasets are not chunked
+        assert ga.handle['chr2'].shape == (0, 1, 1)
+        assert ga.handle['chr2'].chunks is None
+
+        # the file is reopened after unpickling
+        ga2 = pickle.loads(pickle.dumps(ga))
+        assert ga2.handle is not ga.handle
+        np.testing.assert_equal(ga2[iv], ga[iv])
+        np.testing.assert_equal(ga2.handle['chr10'].chunks, (65600, 1, 1))
+
+    with pytest.raises(ValueError):
+        create_genomic_array({'chr10': 300}, stranded=False,
+                             typecode='int8', storage='hdf5',
+                             datatags=['test_hdf5_layout', 'unknown'],
+                             compression='unknown')
+
+
+def test_get_hdf5_chunks():
+    # the chunk length is a multiple of chunks holding at least 64KB
+    assert _get_hdf5_chunks((300000, 2, 3), 200, 'float32') == (2800, 2, 3)
+    # but it does not exceed the dataset shape
+    assert _get_hdf5_chunks((20, 2, 3), 200, 'float32') == (20, 2, 3)
+    assert _get_hdf5_chunks((1, 1, 1), 200, 'int8') == (1, 1, 1)
+    assert _get_hdf5_chunks((20, 2, 3), None, 'float32') is True
+    # empty datasets are not chunked
+    assert _get_hdf5_chunks((0, 2, 3), 200, 'float32') is None
+    assert _get_hdf5_chunks((0, 2, 3), None, 'float32') is None
+    assert _get_hdf5_chunks((20, 2, 0), 200, 'float32') is None
+
+
+def test_memmap_no_cache():
+
+    with pytest.raises(Exception):
+        # cache must be True
+        ga = create_genomic_array({'chr10': 300},
+                                  stranded=True, typecode='int8',
+                                  storage='memmap', cache=False)
+
+
+def test_memmap_instance(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    iv = GenomicInterval('chr10', 100, 120, '+')
+
+    def _loader(garray):
+        garray[iv, 0] = np.ones((20, 2))
+        garray[iv, 1] = 2 * np.ones((20, 2))
+
+    ga = create_genomic_array({'chr10': 300, 'chr1': 200}, stranded=True,
+                              conditions=['c1', 'c2'],
+                              typecode='int8', resolution=10,
+                              storage='memmap', datatags=['test_memmap'],
+                              collapser='sum',
+                              loader=_loader)
+
+    np.testing.assert_equal(ga[iv].shape, (2, 2, 2))
+    np.testing.assert_equal(ga[iv][:, :, 0], 10 * np.ones((2, 2)))
+    np.testing.assert_equal(ga[iv][:, :, 1], 20 * np.ones((2, 2)))
+    np.testing.assert_equal(ga.condition, [b'c1', b'c2'])
+
+    # the data is memory-mapped read-only
+    with pytest.raises(ValueError):
+        ga[iv, 0] = np.zeros((20, 2))
+
+    # reload from the cache without a loader
+    ga2 = create_genomic_array({'chr10': 300, 'chr1': 200}, stranded=True,
+                               conditions=['c1', 'c2'],
+                               typecode='int8', resolution=10,
+                               storage='memmap', datatags=['test_memmap'],
+                               collapser='sum')
+    np.testing.assert_equal(ga2[iv], ga[iv])
+
+    # the memory-map is restored after unpickling
+    ga3 = pickle.loads(pickle.dumps(ga))
+    np.testing.assert_equal(ga3[iv], ga[iv])
+    np.testing.assert_equal(ga3.handle['chr1'].shape, (20, 2, 2))
+
+
 def test_invalid_access():
 
     ga = create_genomic_array({'chr10': 300}, stranded=False,
@@ -170,7 +276,7 @@ def test_logzscore_normalization(tmpdir):
         garray[GenomicInterval('chr2', 0, 300), 0] = np.repeat(100, 300).reshape(-1,1)
         return garray
 
-    for store in ['ndarray', 'hdf5']:
+    for store in ['ndarray', 'hdf5', 'sparse']:
         ga = create_genomic_array({'chr1': 150, 'chr2': 300},
                                   stranded=False, typecode='float32',
                                   storage=store, cache=True, loader=loading,
@@ -195,7 +301,7 @@ def test_tmp_normalization(tmpdir):
         garray[GenomicInterval('chr2', 0, 300), 0] = np.repeat(1, 300).reshape(-1, 1)
         return garray
 
-    for store in ['ndarray', 'hdf5']:
+    for store in ['ndarray', 'hdf5', 'sparse']:
         ga = create_genomic_array({'chr1': 150, 'chr2': 300}, stranded=False, typecode='float32',
                                   storage=store, cache=True, resolution=50, loader=loading,
                                   collapser='sum',
@@ -234,3 +340,355 @@ def test_check_resolution_collapse_compatibility():
                               storage="ndarray", cache=False, resolution=None, loader=loading,
                               collapser='sum',
                               normalizer=get_normalizer('tpm'))
+
+
+def test_sparse_batch_access():
+    values = np.random.RandomState(0).rand(20, 2)
+    values[values < .5] = 0
+
+    def loader(garray):
+        garray[GenomicInterval('chr1', 10, 30, '.'), 0] = values
+        garray[GenomicInterval('chr2', 40, 60, '.'), 1] = values
+        # overlapping writes
+        garray[GenomicInterval('chr1', 20, 40, '.'), 0] = values[::-1]
+        # negative values and zeros overwriting previous values
+        garray[GenomicInterval('chr2', 0, 20, '.'), 1] = -values
+        garray[GenomicInterval('chr2', 45, 55, '.'), 1] = np.zeros((10, 2))
+
+    ga, ref = [create_genomic_array({'chr1': 100, 'chr2': 50}, stranded=True,
+                                    conditions=['c1', 'c2'], typecode='float32',
+                                    storage=storage, cache=False, loader=loader)
+               for storage in ['sparse', 'ndarray']]
+
+    chroms = np.asarray(['chr1', 'chr2', 'chr1', 'chr2'])
+    starts = np.asarray([-5, 35, 15, 0])
+    ends = starts + 30
+    strands = np.asarray(['+', '-', '-', '+'])
+    batch = ga.fill_batch(chroms, starts, ends, strands,
+                          np.zeros((4, 30, 2, 2), dtype='float32'))
+    np.testing.assert_equal(batch,
+                            ref.fill_batch(chroms, starts, ends, strands,
+                                           np.zeros((4, 30, 2, 2),
+                                                    dtype='float32')))
+    for i in range(4):
+        np.testing.assert_equal(ga[GenomicInterval(chroms[i], starts[i],
+                                                   ends[i], '.')],
+                                ref[GenomicInterval(chroms[i], starts[i],
+                                                    ends[i], '.')])
+
+    # writing to the loaded array
+    ga[GenomicInterval('chr2', 0, 20, '.'), 0] = values
+    ref[GenomicInterval('chr2', 0, 20, '.'), 0] = values
+    np.testing.assert_equal(ga[GenomicInterval('chr2', 0, 50, '.')],
+                            ref[GenomicInterval('chr2', 0, 50, '.')])
+
+    ga[GenomicInterval('chr1', 15, 35, '.'), 0] = np.zeros((20, 2))
+    ref[GenomicInterval('chr1', 15, 35, '.'), 0] = np.zeros((20, 2))
+    np.testing.assert_equal(ga[GenomicInterval('chr1', 0, 100, '.')],
+                            ref[GenomicInterval('chr1', 0, 100, '.')])
+    assert (ga.handle['chr1'].data != 0).all()
+
+
+def test_sparse_normalization(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    values = np.random.RandomState(0).rand(300, 2)
+    values[values < .8] = 0
+
+    def loading(garray):
+        garray[GenomicInterval('chr1', 0, 150), 0] = values[:150]
+        garray[GenomicInterval('chr2', 0, 300), 1] = values
+        return garray
+
+    chroms = np.asarray(['chr1', 'chr2'])
+    starts = np.asarray([-50, 100])
+    ends = starts + 100
+    strands = np.asarray(['+', '-'])
+    for normalizer in ['zscore', 'zscorelog', 'tpm']:
+        ga, ref = [create_genomic_array({'chr1': 150, 'chr2': 300},
+                                        stranded=True, conditions=['c1', 'c2'],
+                                        typecode='float32', storage=store,
+                                        cache=True, loader=loading,
+                                        datatags=[normalizer],
+                                        normalizer=normalizer)
+                   for store in ['sparse', 'ndarray']]
+
+        # the stored values remain sparse
+        assert ga.handle['chr1'].nnz == (values[:150] > 0).sum()
+        np.testing.assert_allclose(ga.weighted_mean(), ref.weighted_mean(),
+                                   rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(ga.weighted_sd(), ref.weighted_sd(),
+                                   rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(ga.sum(), ref.sum(), rtol=1e-5)
+        np.testing.assert_allclose(ga[GenomicInterval('chr2', 0, 300)],
+                                   ref[GenomicInterval('chr2', 0, 300)],
+                                   rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(
+            ga.fill_batch(chroms, starts, ends, strands,
+                          np.zeros((2, 100, 2, 2), dtype='float32')),
+            ref.fill_batch(chroms, starts, ends, strands,
+                           np.zeros((2, 100, 2, 2), dtype='float32')),
+            rtol=1e-5, atol=1e-5)
+
+
+def test_chunked_moments(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    values = np.random.RandomState(0).rand(300, 2)
+
+    def loading(garray):
+        garray[GenomicInterval('chr1', 0, 150), 0] = values[:150]
+        garray[GenomicInterval('chr2', 0, 300), 1] = values
+        return garray
+
+    for store in ['ndarray', 'hdf5', 'memmap', 'sparse']:
+        ga = create_genomic_array({'chr1': 150, 'chr2': 300},
+                                  stranded=True, conditions=['c1', 'c2'],
+                                  typecode='float32', storage=store,
+                                  cache=True, loader=loading)
+        full = np.concatenate([np.asarray(ga[GenomicInterval('chr1', 0, 150)]),
+                               np.asarray(ga[GenomicInterval('chr2', 0, 300)])])
+        full = full.reshape(-1, 2)
+        for chunk_length in [7, 100, 1 << 20]:
+            ga._chunk_length = chunk_length
+            weight, mean, m2 = _weighted_moments(ga, ga.moments())
+            assert weight == len(full)
+            np.testing.assert_allclose(mean, full.mean(axis=0), rtol=1e-5)
+            np.testing.assert_allclose(m2, full.var(axis=0) * len(full),
+                                       rtol=1e-5)
+
+            weight, mean, m2 = _weighted_moments(ga, ga.moments(np.log1p))
+            np.testing.assert_allclose(mean, np.log1p(full).mean(axis=0),
+                                       rtol=1e-5)
+
+    # a provided mean is used to determine the standard deviation
+    ga = create_genomic_array({'chr1': 150, 'chr2': 300},
+                              stranded=True, conditions=['c1', 'c2'],
+                              typecode='float32', storage='ndarray',
+                              cache=False, loader=loading,
+                              normalizer=ZScore(mean=1.))
+    np.testing.assert_allclose(
+        ga[GenomicInterval('chr2', 0, 300)][:, :, 1],
+        (values - 1.) / np.sqrt(np.square(full[:, 1] - 1.).sum() /
+                                (len(full) - 1.)),
+        rtol=1e-4)
+
+
+def test_parallel_normalization(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    chroms = {'chr{}'.format(i): 50 + i for i in range(20)}
+    values = np.random.RandomState(0).rand(70, 2)
+
+    def loading(garray):
+        for chrom in chroms:
+            garray[GenomicInterval(chrom, 0, chroms[chrom]), 0] = \
+                values[:chroms[chrom]]
+        return garray
+
+    for store in ['ndarray', 'hdf5', 'memmap', 'sparse']:
+        for normalizer in [None, 'zscorelog', 'tpm']:
+            results = []
+            for num_threads in [1, 3]:
+                ga = create_genomic_array(chroms, stranded=False,
+                                          conditions=['c1', 'c2'],
+                                          typecode='float32', storage=store,
+                                          datatags=['threads{}'.format(num_threads)],
+                                          overwrite=True, loader=loading,
+                                          normalizer=normalizer,
+                                          num_threads=num_threads)
+                assert ga.num_threads == num_threads
+                results.append((ga.sum(), ga.weighted_mean(), ga.weighted_sd(),
+                                [np.asarray(ga[GenomicInterval(chrom, 0, chroms[chrom])])
+                                 for chrom in sorted(chroms)]))
+
+            # the partial results are merged in the same order
+            np.testing.assert_equal(results[0][0], results[1][0])
+            np.testing.assert_equal(results[0][1], results[1][1])
+            np.testing.assert_equal(results[0][2], results[1][2])
+            for first, second in zip(results[0][3], results[1][3]):
+                np.testing.assert_equal(first, second)
+
+
+def test_lazy_normalization(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    values = np.random.RandomState(0).rand(300, 2)
+    values[values < .5] = 0
+
+    def loading(garray):
+        garray[GenomicInterval('chr1', 0, 150), 0] = values[:150]
+        garray[GenomicInterval('chr2', 0, 300), 1] = values
+        return garray
+
+    chroms = np.asarray(['chr1', 'chr2'])
+    starts = np.asarray([-50, 100])
+    ends = starts + 100
+    strands = np.asarray(['+', '-'])
+    for store in ['ndarray', 'hdf5', 'memmap', 'sparse']:
+        # the raw cache is created once
+        create_genomic_array({'chr1': 150, 'chr2': 300},
+                             stranded=True, conditions=['c1', 'c2'],
+                             typecode='float32', storage=store,
+                             datatags=['raw'], loader=loading)
+        for name, normalizer in [('zscore', ZScore),
+                                 ('zscorelog', ZScoreLog),
+                                 ('tpm', TPM)]:
+            ref = create_genomic_array({'chr1': 150, 'chr2': 300},
+                                       stranded=True, conditions=['c1', 'c2'],
+                                       typecode='float32', storage=store,
+                                       datatags=[name], loader=loading,
+                                       normalizer=name)
+            for _ in range(2):
+                # the second time, the fitted parameters
+                # are taken from the cache metadata
+                ga = create_genomic_array({'chr1': 150, 'chr2': 300},
+                                          stranded=True,
+                                          conditions=['c1', 'c2'],
+                                          typecode='float32', storage=store,
+                                          datatags=['raw'],
+                                          normalizer=normalizer(lazy=True))
+
+                np.testing.assert_allclose(ga[GenomicInterval('chr2', 0, 300)],
+                                           ref[GenomicInterval('chr2', 0, 300)],
+                                           rtol=1e-4, atol=1e-5)
+                np.testing.assert_allclose(
+                    ga.fill_batch(chroms, starts, ends, strands,
+                                  np.zeros((2, 100, 2, 2), dtype='float32')),
+                    ref.fill_batch(chroms, starts, ends, strands,
+                                   np.zeros((2, 100, 2, 2), dtype='float32')),
+                    rtol=1e-4, atol=1e-5)
+
+        # the stored signal remains unchanged
+        ga = create_genomic_array({'chr1': 150, 'chr2': 300},
+                                  stranded=True, conditions=['c1', 'c2'],
+                                  typecode='float32', storage=store,
+                                  datatags=['raw'])
+        np.testing.assert_allclose(ga[GenomicInterval('chr2', 0, 300)][:, 0, 1],
+                                   values[:, 0], rtol=1e-6)
+
+        with pytest.raises(ValueError):
+            # the signal has already been normalized in the cache
+            create_genomic_array({'chr1': 150, 'chr2': 300},
+                                 stranded=True, conditions=['c1', 'c2'],
+                                 typecode='float32', storage=store,
+                                 datatags=['zscore'],
+                                 normalizer=ZScore(lazy=True))
+
+
+def test_normalization_integer_storage(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+
+    def loading(garray):
+        garray[GenomicInterval('chr1', 0, 100), 0] = np.arange(100).reshape(-1, 1)
+        return garray
+
+    for store in ['ndarray', 'hdf5', 'memmap', 'sparse']:
+        for normalizer in ['zscore', 'zscorelog', 'tpm']:
+            # the normalized signal would be truncated
+            with pytest.raises(ValueError):
+                create_genomic_array({'chr1': 100}, stranded=False,
+                                     typecode='int16', storage=store,
+                                     datatags=['int', normalizer],
+                                     overwrite=True, loader=loading,
+                                     normalizer=normalizer)
+
+        # lazy normalizers leave the stored signal unchanged
+        ga = create_genomic_array({'chr1': 100}, stranded=False,
+                                  typecode='int16', storage=store,
+                                  datatags=['int', 'lazy'],
+                                  overwrite=True, loader=loading,
+                                  normalizer=ZScore(lazy=True))
+        values = ga[GenomicInterval('chr1', 0, 100)]
+        np.testing.assert_allclose(values.mean(), 0., atol=1e-6)
+
+
+def test_lazy_normalization_batch_work(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    values = np.random.RandomState(0).rand(1000000, 1)
+
+    def loading(garray):
+        garray[GenomicInterval('chr1', 0, 1000000), 0] = values
+        return garray
+
+    # two windows at both ends of a long chromosome
+    chroms = np.asarray(['chr1', 'chr1'])
+    starts = np.asarray([-50, 999900])
+    ends = starts + 200
+    strands = np.asarray(['+', '-'])
+    for store in ['ndarray', 'hdf5', 'memmap']:
+        ga = create_genomic_array({'chr1': 1000000}, stranded=False,
+                                  typecode='float32', storage=store,
+                                  datatags=['batchwork'], loader=loading,
+                                  normalizer=ZScore(lazy=True))
+        normalized = ga._normalized
+        sizes = []
+
+        def _normalized(data, chrom):
+            sizes.append(data.size)
+            return normalized(data, chrom)
+        ga._normalized = _normalized
+
+        batch = ga.fill_batch(chroms, starts, ends, strands,
+                              np.ones((2, 200, 1, 1), dtype='float32'))
+        # only the windows are normalized rather than the
+        # block spanning the chromosome
+        assert sum(sizes) <= batch.size
+
+        ref = normalized(values.astype('float32')[:, None, :], 'chr1')
+        np.testing.assert_equal(batch[0, :50], 0)
+        np.testing.assert_allclose(batch[0, 50:], ref[:150],
+                                   rtol=1e-5, atol=1e-5)
+        # the reversed window is padded at the beginning
+        np.testing.assert_equal(batch[1, :100], 0)
+        np.testing.assert_allclose(batch[1, 100:], ref[999900:][::-1],
+                                   rtol=1e-5, atol=1e-5)
+
+
+def test_lazy_normalization_reuse(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    train = np.random.RandomState(0).rand(100, 1)
+    test = 10. * np.random.RandomState(1).rand(100, 1)
+
+    def loader(values):
+        def loading(garray):
+            garray[GenomicInterval('chr1', 0, 100), 0] = values
+            return garray
+        return loading
+
+    for normalizer in [ZScore, ZScoreLog]:
+        fitted = normalizer(lazy=True)
+        assert fitted.name is not None
+        create_genomic_array({'chr1': 100}, stranded=False,
+                             typecode='float32', storage='ndarray',
+                             datatags=['train'], loader=loader(train),
+                             normalizer=fitted)
+        mean, std = fitted.mean, fitted.std
+        # the fitted instance is not keyed by the generic name anymore
+        assert fitted.name is None
+
+        ga = create_genomic_array({'chr1': 100}, stranded=False,
+                                  typecode='float32', storage='ndarray',
+                                  datatags=['test'], loader=loader(test),
+                                  normalizer=fitted)
+        signal = test if fitted.transform is None else fitted.transform(test)
+        np.testing.assert_allclose(ga[GenomicInterval('chr1', 0, 100)][:, 0, :],
+                                   (signal - mean) / std, rtol=1e-4, atol=1e-5)
+
+        # a new instance determines the statistics of the test data
+        # rather than reusing the parameters of the training data
+        ga = create_genomic_array({'chr1': 100}, stranded=False,
+                                  typecode='float32', storage='ndarray',
+                                  datatags=['test'], loader=loader(test),
+                                  normalizer=normalizer(lazy=True))
+        values = ga[GenomicInterval('chr1', 0, 100)][:, 0, :]
+        np.testing.assert_allclose(values.mean(), 0., atol=1e-5)
+
+
+def test_hdf5_serial_map(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.strpath
+    chroms = {'chr1': 100, 'chr2': 100, 'chr3': 100}
+
+    for store, serial in [('hdf5', True), ('ndarray', False)]:
+        ga = create_genomic_array(chroms, stranded=False, typecode='float32',
+                                  storage=store, datatags=['serial'],
+                                  overwrite=True, num_threads=3)
+        # hdf5 ignores num_threads, because h5py holds a global lock
+        threads = ga._map(lambda chrom: threading.current_thread())
+        assert (set(threads) == {threading.current_thread()}) == serial
@@ -1,3 +1,4 @@
+import itertools
 import os
 
 import matplotlib
@@ -105,3 +106,102 @@ def test_gindexer_merged_variable_length_ranges():
     iv = gi[-1]
     np.testing.assert_equal((iv.chrom, iv.start, iv.end, iv.strand),
                             ('chr2', 24000, 25000, '-'))
+
+
+def test_gindexer_idx_by_region():
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+
+    for (binsize, stepsize, flank), lazy in itertools.product(
+            [(200, 50, 0), (200, 200, 10), (3000, 3000, 5)], [False, True]):
+        gi = GenomicIndexer.create_from_file(
+            os.path.join(data_path, 'sample.bed'), binsize=binsize,
+            stepsize=stepsize, flank=flank, lazy=lazy)
+
+        chrs = np.asarray([iv.chrom for iv in gi])
+        starts = np.asarray([iv.start for iv in gi]) + flank
+        ends = np.asarray([iv.end for iv in gi]) - flank
+
+        for start, end in [(0, 100000), (15000, 15100), (15210, 15300),
+                           (20000, 26000), (None, 15500), (24500, None)]:
+            for chrom in ['chr1', 'chr2', 'chr10']:
+                fltr = chrs == chrom
+                if start is not None:
+                    fltr &= (ends + flank) > start
+                if end is not None:
+                    fltr &= (starts - flank) < end
+                np.testing.assert_equal(
+                    gi.idx_by_region(include=chrom, start=start, end=end),
+                    np.where(fltr)[0])
+
+        np.testing.assert_equal(gi.idx_by_region(exclude='chr1'),
+                                np.where(chrs != 'chr1')[0])
+
+
+def test_gindexer_lazy():
+    data_path = pkg_resources.resource_filename('janggu', 'resources/')
+
+    for binsize, stepsize, zero_padding in [(200, 50, True), (3000, 3000, True),
+                                            (3000, 3000, False), (300, 500, True),
+                                            (None, None, True)]:
+        kwargs = dict(binsize=binsize, stepsize=stepsize, flank=3,
+                      zero_padding=zero_padding, collapse=binsize is None)
+        gi = GenomicIndexer.create_from_file(
+            os.path.join(data_path, 'sample.bed'), **kwargs)
+        gil = GenomicIndexer.create_from_file(
+            os.path.join(data_path, 'sample.bed'), lazy=True, **kwargs)
+
+        np.testing.assert_equal(len(gil), len(gi))
+        np.testing.assert_equal(gil.tostr(), gi.tostr())
+        np.testing.assert_equal([iv.strand for iv in gil],
+                                [iv.strand for iv in gi])
+        np.testing.assert_equal(gil[-1].start, gi[-1].start)
+        for val_lazy, val in zip(gil.get_batch([1, 0, -2]),
+                                 gi.get_batch([1, 0, -2])):
+            np.testing.assert_equal(val_lazy, val)
+
+        np.testing.assert_equal(gil.filter_by_region(include='chr2').tostr(),
+                                gi.filter_by_region(include='chr2').tostr())
+        np.testing.assert_equal(gil.filter_by_region(exclude='chr2',
+                                                     start=16000,
+                                                     end=17000).tostr(),
+                                gi.filter_by_region(exclude='chr2',
+                                                    start=16000,
+                                                    end=17000).tostr())
+
+        # accessing the interval arrays keeps the lazy representation
+        np.testing.assert_equal(gil.starts, gi.starts)
+        np.testing.assert_equal(gil.ends, gi.ends)
+        assert gil._regions is not None
+        np.testing.assert_equal(gil.tostr(), gi.tostr())
+
+
+def test_gindexer_fragment_ends():
+    for lazy in [False, True]:
+        # stepsize > binsize: the fragment extends to the region end
+        gi = GenomicIndexer.create_from_region('chr1', 0, 290, '.',
+                                               binsize=50, stepsize=100,
+                                               lazy=lazy)
+        np.testing.assert_equal(gi.starts, [0, 100, 200])
+        np.testing.assert_equal(gi.ends, [50, 150, 290])
+        np.testing.assert_equal(gi.idx_by_region(include='chr1', start=260,
+                                                 end=280), [2])
+
+        # stepsize < binsize
+        gi = GenomicIndexer.create_from_region('chr1', 0, 290, '.',
+                                               binsize=100, stepsize=50,
+                                               lazy=lazy)
+        np.testing.assert_equal(gi.starts, [0, 50, 100, 150, 200])
+        np.testing.assert_equal(gi.ends, [100, 150, 200, 250, 290])
+
+        # region shorter than the binsize
+        gi = GenomicIndexer.create_from_region('chr1', 0, 30, '.',
+                                               binsize=50, stepsize=100,
+                                               lazy=lazy)
+        np.testing.assert_equal(gi.starts, [0])
+        np.testing.assert_equal(gi.ends, [30])
+
+        gi = GenomicIndexer.create_from_region('chr1', 0, 290, '.',
+                                               binsize=50, stepsize=100,
+                                               zero_padding=False, lazy=lazy)
+        np.testing.assert_equal(gi.starts, [0, 100])
+        np.testing.assert_equal(gi.ends, [50, 150])
@@ -1,6 +1,18 @@
+import os
+import pickle
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 import pkg_resources
+import pytest
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
 
+from janggu.utils import IndexedFasta
+from janggu.utils import as_onehot
 from janggu.utils import get_genome_size
+from janggu.utils import kmer_index
+from janggu.utils import seq2ind
 
 
 def test_genome_size():
@@ -8,3 +20,81 @@ def test_genome_size():
     gsize = get_genome_size('sacCer3', data_path)
     print(gsize)
     assert gsize['chrXV'] == 1091291
+
+
+def test_seq2ind():
+    dna = Seq('ACgtNn.', IUPAC.unambiguous_dna)
+    np.testing.assert_equal(seq2ind(dna), [0, 1, 2, 3, -1024, -1024, -1024])
+
+    protein = Seq('ACdy', IUPAC.protein)
+    np.testing.assert_equal(seq2ind(protein), [0, 1, 2, 19])
+
+
+def test_kmer_index():
+    iseq = np.random.randint(4, size=100)
+    for order in range(1, 5):
+        # the first letter is the most significant digit
+        filter_ = np.asarray([pow(4, i) for i in range(order)])
+        np.testing.assert_equal(kmer_index(iseq, order, 4),
+                                np.convolve(iseq, filter_, mode='valid'))
+
+    iseq = seq2ind(Seq('ACNGT', IUPAC.unambiguous_dna))
+    np.testing.assert_equal(kmer_index(iseq, 2, 4), [1, -1024, -1024, 11])
+
+
+def test_as_onehot():
+    iseq = np.random.randint(16, size=(3, 50))
+    iseq[0, 3] = -1024
+    onehot = as_onehot(iseq, 2, 4)
+    assert onehot.shape == (3, 50, 1, 16)
+    assert onehot.dtype == np.int8
+    np.testing.assert_equal(onehot[:, :, 0, :].argmax(axis=-1)[iseq >= 0],
+                            iseq[iseq >= 0])
+    np.testing.assert_equal(onehot.sum(axis=-1)[:, :, 0], iseq >= 0)
+
+    np.testing.assert_equal(as_onehot(iseq, 2, 4, dtype='float32'), onehot)
+    assert as_onehot(iseq, 2, 4, dtype='float32').dtype == np.float32
+
+    # the output buffer is overwritten
+    out = np.ones((3, 50, 1, 16), dtype='float16')
+    assert as_onehot(iseq, 2, 4, out=out) is out
+    np.testing.assert_equal(out, onehot)
+
+    with pytest.raises(ValueError):
+        as_onehot(iseq, 1, 4, out=out)
+
+
+def test_indexed_fasta(tmpdir):
+    os.environ['JANGGU_OUTPUT'] = tmpdir.join('output').strpath
+    fasta = tmpdir.join('test.fa')
+    fasta.write('>seq1 description\nACGTA\nCGTAC\nGT\n>seq2\nTTTT\n')
+
+    fasta = IndexedFasta(fasta.strpath)
+    # the index is not written next to the fasta file
+    assert not os.path.exists(fasta.filename + '.fai')
+    assert fasta.chroms == {'seq1': 12, 'seq2': 4}
+    assert fasta.fetch('seq1', 0, 12) == 'ACGTACGTACGT'
+    assert fasta.fetch('seq1', 4, 7) == 'ACG'
+    # positions outside of the sequence
+    assert fasta.fetch('seq1', -2, 2) == 'NNAC'
+    assert fasta.fetch('seq2', 2, 6) == 'TTNN'
+
+    # reload the index
+    assert IndexedFasta(fasta.filename).index == fasta.index
+    assert os.listdir(tmpdir.join('output', 'datasets', 'fastaindex').strpath)
+
+    # concurrent fetches from a shared handle
+    pool = ThreadPool(4)
+    seqs = pool.map(lambda start: fasta.fetch('seq1', start, start + 5),
+                    list(range(8)) * 50)
+    pool.close()
+    assert seqs == [fasta.fetch('seq1', start, start + 5)
+                    for start in list(range(8)) * 50]
+
+    # the index and the lock are recreated when unpickled
+    assert pickle.loads(pickle.dumps(fasta)).fetch('seq1', 4, 7) == 'ACG'
+
+    invalid = tmpdir.join('invalid.fa')
+    invalid.write('>seq1\nACG\nCGTAC\n')
+    with pytest.raises(ValueError):
+        IndexedFasta(invalid.strpath)